@@ -0,0 +1,41 @@
+import time
+import numpy as np
+import pandas as pd
+
+from f1tenth_benchmarks.simulator.laser_models import ScanSimulator2D
+from f1tenth_benchmarks.utils.track_utils import CentreLine
+from f1tenth_benchmarks.utils.BasePlanner import load_parameter_file, ensure_path_exists
+
+N_POSES = 200
+
+
+def scan_poses(scanner, poses):
+    scans = np.array([scanner.scan(pose, std_dev=0) for pose in poses[:2]]) # compile before timing
+    start = time.perf_counter()
+    scans = np.array([scanner.scan(pose, std_dev=0) for pose in poses])
+    return scans, (time.perf_counter() - start) / len(poses)
+
+
+def compare_ray_casters(map_list=["example", "MoscowRaceway", "Austin", "Spielberg"]):
+    """Times the EDT and segment ray casters on poses along the centre line and reports how far apart their ranges are"""
+    params = load_parameter_file("simulator_params")
+    results = []
+    for map_name in map_list:
+        poses = np.array([CentreLine(map_name).calculate_pose(s) for s in np.linspace(0, 1, N_POSES, endpoint=False)])
+        edt_scanner = ScanSimulator2D(params.num_beams, params.fov, map_name, params.random_seed, ray_caster="edt")
+        segment_scanner = ScanSimulator2D(params.num_beams, params.fov, map_name, params.random_seed, ray_caster="segments")
+
+        edt_scans, edt_time = scan_poses(edt_scanner, poses)
+        segment_scans, segment_time = scan_poses(segment_scanner, poses)
+        errors = np.abs(edt_scans - segment_scans)
+
+        results.append({"TestMap": map_name, "EdtTime_ms": edt_time * 1000, "SegmentTime_ms": segment_time * 1000, "Speedup": edt_time / segment_time,
+                        "MeanDifference": np.mean(errors), "MedianDifference": np.median(errors), "P99Difference": np.percentile(errors, 99)})
+        print(f"{map_name}: EDT {edt_time*1000:.2f} ms, segments {segment_time*1000:.2f} ms, mean difference {np.mean(errors):.3f} m")
+
+    ensure_path_exists("Logs/RayCasters/")
+    pd.DataFrame(results).to_csv("Logs/RayCasters/RayCasterComparison.csv", index=False, float_format='%.4f')
+
+
+if __name__ == "__main__":
+    compare_ray_casters()
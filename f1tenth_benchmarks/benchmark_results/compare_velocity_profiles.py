@@ -0,0 +1,31 @@
+import numpy as np
+import trajectory_planning_helpers as tph
+
+from f1tenth_benchmarks.utils.track_utils import CentreLine
+from f1tenth_benchmarks.utils.velocity_profile import VelocityProfile
+from f1tenth_benchmarks.utils.BasePlanner import load_parameter_file
+
+TOLERANCE = 1e-6 # m/s, open lines (closed lines differ by up to ~1e-3 because tph stops its cornering speed iteration at 0.5 %)
+
+
+def compare_velocity_profiles(map_list=["aut", "esp", "gbr", "mco"], mus=[0.5, 0.9], dyn_model_exps=[1.0, 2.0]):
+    """Checks VelocityProfile against tph.calc_vel_profile on the centre lines"""
+    params = load_parameter_file("RaceTrackGenerator")
+    vehicle = load_parameter_file("vehicle_params")
+    ggv = np.array([[0, params.max_longitudinal_acc, params.max_lateral_acc], [vehicle.max_speed, params.max_longitudinal_acc, params.max_lateral_acc]])
+    ax_max_machine = np.array([[0, params.max_longitudinal_acc], [vehicle.max_speed, params.max_longitudinal_acc]])
+    for map_name in map_list:
+        centre_line = CentreLine(map_name)
+        kappa, el_lengths = np.asarray(centre_line.kappa), np.asarray(centre_line.el_lengths)
+        for mu in mus:
+            for dyn_model_exp in dyn_model_exps:
+                reference = tph.calc_vel_profile.calc_vel_profile(ax_max_machine, kappa, el_lengths, False, 0, vehicle.vehicle_mass, ggv=ggv, mu=np.full(len(kappa), mu),
+                                                                  v_max=vehicle.max_speed, v_start=vehicle.max_speed, dyn_model_exp=dyn_model_exp)
+                speeds = VelocityProfile(ggv, ax_max_machine, mu, vehicle.max_speed, dyn_model_exp=dyn_model_exp).solve(kappa, el_lengths, v_start=vehicle.max_speed)
+                difference = np.max(np.abs(speeds - reference))
+                print(f"{map_name} mu {mu} exp {dyn_model_exp}: max difference {difference:.2e} m/s")
+                assert difference < TOLERANCE, f"VelocityProfile differs from tph by {difference} m/s"
+
+
+if __name__ == "__main__":
+    compare_velocity_profiles()
@@ -1,16 +1,12 @@
 from f1tenth_benchmarks.classic_racing.GlobalMPCC import GlobalMPCC
 from f1tenth_benchmarks.classic_racing.GlobalPurePursuit import GlobalPurePursuit
-from f1tenth_benchmarks.classic_racing.RaceTrackGenerator import RaceTrackGenerator, load_parameter_file_with_extras
+from f1tenth_benchmarks.classic_racing.RaceTrackGenerator import generate_raceline_bundle
 
 from f1tenth_benchmarks.run_scripts.run_functions import *
 
 def generate_racelines():
     friction_mus = [0.5, 0.6, 0.7, 0.8, 0.9, 1]
-    test_map = "aut"
-    for friction in friction_mus:
-        params = load_parameter_file_with_extras("RaceTrackGenerator", extra_params={"mu": friction})
-        raceline_id = f"mu{int(params.mu*100)}"
-        RaceTrackGenerator(test_map, raceline_id, params, plot_raceline=True)
+    generate_raceline_bundle("friction", ["aut"], friction_mus)
 
 """
 Run the MPCC tests to generate the lap times graph
@@ -42,7 +38,7 @@ def planning_pure_puresuit_frictions():
     for friction in friction_vals:
         test_id = f"mu{int(friction*100)}_steps4"
         print(f"Testing {test_id}...")
-        planner = GlobalPurePursuit(test_id, False, planner_name="GlobalPlanPP", extra_params={"racetrack_set": f"mu{int(friction*100)}"})
+        planner = GlobalPurePursuit(test_id, False, planner_name="GlobalPlanPP", extra_params={"racetrack_set": "friction", "racetrack_mu": friction})
         test_planning_single_map(planner, map_name, test_id, number_of_laps=10)
 
 
@@ -53,7 +49,7 @@ def full_stack_pure_pursuit_frictions():
     for friction in friction_vals:
         test_id = f"mu{int(friction*100)}_steps4"
         print(f"Testing {test_id}...")
-        planner = GlobalPurePursuit(test_id, False, planner_name="FullStackPP", extra_params={"racetrack_set": f"mu{int(friction*100)}"})
+        planner = GlobalPurePursuit(test_id, False, planner_name="FullStackPP", extra_params={"racetrack_set": "friction", "racetrack_mu": friction})
         test_full_stack_single_map(planner, map_name, test_id, number_of_laps=10)
 
 
@@ -69,7 +65,7 @@ def planning_pure_puresuit_frequencies():
         for friction in friction_vals:
             test_id = f"mu{int(friction*100)}_steps{simulator_timestep}"
             print(f"Testing {test_id}...")
-            planner = GlobalPurePursuit(test_id, False, planner_name="GlobalPlanPP", extra_params={"racetrack_set": f"mu{int(friction*100)}"})
+            planner = GlobalPurePursuit(test_id, False, planner_name="GlobalPlanPP", extra_params={"racetrack_set": "friction", "racetrack_mu": friction})
             test_planning_single_map(planner, map_name, test_id, extra_params={"n_sim_steps": simulator_timestep}, number_of_laps=10)
 
 def full_stack_pure_puresuit_frequencies():
@@ -80,7 +76,7 @@ def full_stack_pure_puresuit_frequencies():
         for friction in friction_vals:
             test_id = f"mu{int(friction*100)}_steps{simulator_timestep}"
             print(f"Testing {test_id}...")
-            planner = GlobalPurePursuit(test_id, False, planner_name="FullStackPP300", extra_params={"racetrack_set": f"mu{int(friction*100)}"})
+            planner = GlobalPurePursuit(test_id, False, planner_name="FullStackPP300", extra_params={"racetrack_set": "friction", "racetrack_mu": friction})
             test_full_stack_single_map(planner, map_name, test_id, extra_params={"n_sim_steps": simulator_timestep}, number_of_laps=10, extra_pf_params={"number_of_particles": 300})
 
 
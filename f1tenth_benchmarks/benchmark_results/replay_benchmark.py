@@ -0,0 +1,89 @@
+import time
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+
+from f1tenth_benchmarks.utils.BasePlanner import load_parameter_file, ensure_path_exists
+from f1tenth_benchmarks.mapless_racing.FollowTheGap import FollowTheGap
+from f1tenth_benchmarks.localmap_racing.LocalMapPP import LocalMapPP
+
+
+def load_recording(planner_name, test_id, map_name, lap=0):
+    """Memory-mapped SimLog (state, action, progress per step) and ScanLog of a lap recorded with save_scan_history"""
+    path = f"Logs/{planner_name}/RawData_{test_id}/"
+    history = np.load(path + f"SimLog_{map_name}_{lap}.npy", mmap_mode='r')
+    scans = np.load(path + f"ScanLog_{map_name}_{lap}.npy", mmap_mode='r')
+    return history, scans
+
+
+def replay_observation(state, scan, progress, laptime):
+    return {"vehicle_state": state,
+            "pose": np.array([state[0], state[1], state[4]]),
+            "vehicle_speed": state[3],
+            "scan": scan,
+            "collision": False,
+            "lap_complete": False,
+            "timeout": False,
+            "laptime": laptime,
+            "progress": progress}
+
+
+def replay_planner(planner, history, scans, control_period):
+    """
+    Open-loop replay: every recorded observation is passed to planner.plan, whatever the planner did on the previous step.
+    Returns the compute time of each step and the difference between the planner's action and the recorded one.
+    """
+    assert len(scans) == len(history), f"The ScanLog has {len(scans)} scans for {len(history)} steps, it was not recorded with the SimLog"
+    n_steps = len(history)
+    compute_times = np.zeros(n_steps)
+    actions = np.zeros((n_steps, 2))
+    for i in range(n_steps):
+        observation = replay_observation(np.array(history[i, :7]), np.array(scans[i]), history[i, 9], i * control_period)
+        start = time.perf_counter()
+        actions[i] = planner.plan(observation)
+        compute_times[i] = time.perf_counter() - start
+
+    deltas = actions - history[:n_steps, 7:9]
+    return pd.DataFrame({"Step": np.arange(n_steps), "ComputeTime": compute_times, "Steering": actions[:, 0], "Speed": actions[:, 1], "SteeringDelta": deltas[:, 0], "SpeedDelta": deltas[:, 1]})
+
+
+def replay_worker(planner_spec, recording, control_period):
+    planner_class, args, kwargs = planner_spec
+    planner_name, test_id, map_name, lap = recording
+    planner = planner_class(*args, **kwargs)
+    planner.set_map(map_name)
+    history, scans = load_recording(planner_name, test_id, map_name, lap)
+    steps = replay_planner(planner, history, scans, control_period)
+    steps.to_csv(f"Logs/Replay/{planner_name}_{test_id}/Replay_{planner.name}_{map_name}_{lap}.csv", index=False, float_format='%.6f')
+
+    compute_times = steps.ComputeTime.to_numpy()[1:] # the first call includes compilation
+    return {"Planner": planner.name, "TestMap": map_name, "Lap": lap, "Steps": len(steps), "MeanComputeTime": np.mean(compute_times), "P99ComputeTime": np.percentile(compute_times, 99), "MaxComputeTime": np.max(compute_times),
+            "DeadlineMisses": int(np.sum(compute_times > control_period)), "MeanSteeringDelta": np.mean(np.abs(steps.SteeringDelta)), "MeanSpeedDelta": np.mean(np.abs(steps.SpeedDelta))}
+
+
+def replay_benchmark(planner_specs, planner_name, test_id, map_name, lap=0, n_workers=None):
+    """
+    Replays one recording through several planners in parallel processes, each of which memory-maps the same log files.
+    planner_specs are (planner class, args, kwargs) so that every process builds its own planner.
+    """
+    params = load_parameter_file("simulator_params")
+    control_period = params.timestep * params.n_sim_steps
+    ensure_path_exists("Logs/Replay/")
+    ensure_path_exists(f"Logs/Replay/{planner_name}_{test_id}/")
+
+    recording = (planner_name, test_id, map_name, lap)
+    n_workers = n_workers or len(planner_specs)
+    with mp.get_context("spawn").Pool(n_workers) as pool:
+        results = pool.starmap(replay_worker, [(spec, recording, control_period) for spec in planner_specs])
+
+    results = pd.DataFrame(results)
+    results.to_csv(f"Logs/Replay/{planner_name}_{test_id}/ReplaySummary_{map_name}_{lap}.csv", index=False, float_format='%.6f')
+    print(results)
+    return results
+
+
+if __name__ == "__main__":
+    # the recording must have been made with save_scan_history: True
+    planner_specs = [(FollowTheGap, ("replay_ftg",), {}),
+                     (LocalMapPP, ("replay_localmap",), {})]
+    replay_benchmark(planner_specs, "FollowTheGap", "Std", "aut")
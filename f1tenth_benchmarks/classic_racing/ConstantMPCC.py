@@ -12,6 +12,7 @@ NU = 2
 class ConstantMPCC(BasePlanner):
     def __init__(self, test_id, save_data=False, planner_name="ConstantMPCC"):
         super().__init__(planner_name, test_id, params_name="GlobalMPCC")
+        self.scan_beams = slice(0, 0) # only the pose is used
         self.save_data = save_data
         if self.save_data:
             self.mpcc_data_path = self.data_root_path + f"MPCCData_{test_id}/"
@@ -9,6 +9,7 @@ class GlobalPurePursuit(BasePlanner):
     def __init__(self, test_id, use_centre_line=False, planner_name="GlobalPurePursuit", init_folder=True, extra_params={}):
         self.use_centre_line = use_centre_line
         super().__init__(planner_name, test_id, params_name="GlobalPurePursuit", init_folder=init_folder, extra_params=extra_params)
+        self.scan_beams = slice(0, 0) # only the pose is used
         self.racetrack = None
         self.use_centre_line = use_centre_line
 
@@ -24,7 +25,7 @@ class GlobalPurePursuit(BasePlanner):
         if self.use_centre_line:
             self.racetrack = CentreLine(map_name)
         else:
-            self.racetrack = RaceTrack(map_name, self.planner_params.racetrack_set)
+            self.racetrack = RaceTrack(map_name, self.planner_params.racetrack_set, mu=self.planner_params.racetrack_mu)
 
     def plan(self, obs):
         self.step_counter += 1
@@ -0,0 +1,137 @@
+import numpy as np
+from numba import njit, prange
+from scipy.interpolate import splev
+
+from f1tenth_benchmarks.utils.BasePlanner import BasePlanner, load_parameter_file
+from f1tenth_benchmarks.utils.track_utils import CentreLine
+from f1tenth_benchmarks.simulator.dynamic_models import pid, steering_constraint, accl_constraints
+from f1tenth_benchmarks.simulator.laser_models import load_map_assets, distance_transform
+
+
+class MPPI(BasePlanner):
+    """
+    Model Predictive Path Integral control: n_samples noisy [steer, speed] sequences are rolled out through the kinematic single track model
+    and the next control sequence is their average weighted by exp(-cost / temperature).
+    As in MPPI, each cost includes the control term temperature * u^T Sigma^-1 eps of the nominal sequence u and the sample's perturbation eps.
+    The number of rollouts is fixed, so every step costs the same regardless of the track.
+    """
+    def __init__(self, test_id, planner_name="MPPI", extra_params={}):
+        super().__init__(planner_name, test_id, params_name="MPPI", extra_params=extra_params)
+        self.scan_beams = slice(0, 0) # only the pose is used
+        p = self.planner_params
+        if p.n_samples < 1 or p.horizon < 1 or p.n_substeps < 1 or p.temperature <= 0:
+            raise ValueError(f"MPPI needs n_samples, horizon and n_substeps of at least 1 and a positive temperature, got {p.n_samples}, {p.horizon}, {p.n_substeps} and {p.temperature}")
+        sim_params = load_parameter_file("simulator_params")
+        self.dynamics_params = np.array([sim_params.lf + sim_params.lr, sim_params.s_min, sim_params.s_max, sim_params.sv_min, sim_params.sv_max, sim_params.v_switch, sim_params.a_max, sim_params.v_min, sim_params.v_max])
+        self.collision_radius = sim_params.width / 2 + p.collision_margin
+        self.cost_weights = np.array([p.weight_progress, p.weight_contour, p.weight_steer_rate, p.weight_collision])
+
+        self.rng = np.random.default_rng(p.random_seed)
+        self.noise_std = np.array([p.steer_noise, p.speed_noise])
+        self.noise = np.zeros((p.n_samples, p.horizon, 2))
+        self.controls = np.zeros((p.n_samples, p.horizon, 2))
+        self.nominal = np.zeros((p.horizon, 2))
+        self.n_reference = int((p.max_speed * p.dt * p.horizon + 1) / p.reference_spacing)
+        self.search_window = int(np.ceil(p.max_speed * p.dt / p.reference_spacing)) + 2
+
+        self.centre_line = None
+        self.last_steer = 0.0
+
+    def set_map(self, map_name):
+        self.map_name = map_name
+        self.centre_line = CentreLine(map_name)
+        _, self.map_dt, origin, self.resolution = load_map_assets(map_name)
+        self.origin = np.array(origin, dtype=np.float64)
+        self.orig_c, self.orig_s = np.cos(self.origin[2]), np.sin(self.origin[2])
+        self.nominal[:, 0] = 0
+        self.nominal[:, 1] = self.planner_params.min_speed
+        self.last_steer = 0.0
+
+    def plan(self, obs):
+        self.step_counter += 1
+        p = self.planner_params
+        pose = obs["pose"]
+        state = np.array([pose[0], pose[1], self.last_steer, obs["vehicle_speed"], pose[2]])
+        reference = self.local_reference(pose)
+
+        self.rng.standard_normal(out=self.noise)
+        self.noise *= self.noise_std
+        np.add(self.nominal, self.noise, out=self.controls)
+        np.clip(self.controls[:, :, 0], -p.max_steer, p.max_steer, out=self.controls[:, :, 0])
+        np.clip(self.controls[:, :, 1], p.min_speed, p.max_speed, out=self.controls[:, :, 1])
+
+        costs = rollout_costs(state, self.controls, p.dt, p.n_substeps, self.dynamics_params, reference, p.reference_spacing, self.search_window, self.cost_weights, self.collision_radius, self.last_steer,
+                              self.origin[0], self.origin[1], self.orig_c, self.orig_s, self.map_dt.shape[0], self.map_dt.shape[1], self.resolution, self.map_dt)
+        costs += p.temperature * np.einsum("nk,snk->s", self.nominal / self.noise_std**2, self.controls - self.nominal) # perturbations after clipping
+        weights = np.exp(-(costs - costs.min()) / p.temperature)
+        weights /= weights.sum()
+        self.nominal = np.einsum("s,snk->nk", weights, self.controls)
+
+        action = self.nominal[0].copy()
+        self.nominal[:-1] = self.nominal[1:] # warm start for the next step
+        self.last_steer = action[0]
+
+        return action
+
+    def local_reference(self, pose):
+        """Centre line points every reference_spacing from the vehicle's progress forward over the longest distance a rollout can cover"""
+        length = self.centre_line.s_path[-1]
+        ss = self.centre_line.calculate_progress_m(pose[:2]) + np.arange(self.n_reference) * self.planner_params.reference_spacing
+        return np.ascontiguousarray(np.array(splev((ss % length) / length, self.centre_line.tck, ext=3)).T) # the spline parameter is the fraction of the track
+
+
+@njit(cache=True)
+def ks_step(x, y, steer, vel, yaw, steer_ref, speed_ref, dt, params):
+    """One Euler step of vehicle_dynamics_ks with the simulator's pid, written with scalars so that the rollouts do not allocate"""
+    lwb, s_min, s_max, sv_min, sv_max, v_switch, a_max, v_min, v_max = params[0], params[1], params[2], params[3], params[4], params[5], params[6], params[7], params[8]
+    accl, sv = pid(speed_ref, steer_ref, vel, steer, sv_max, a_max, v_max, v_min)
+    sv = steering_constraint(steer, sv, s_min, s_max, sv_min, sv_max)
+    accl = accl_constraints(vel, accl, v_switch, a_max, v_min, v_max)
+
+    x_new = x + dt * vel * np.cos(yaw)
+    y_new = y + dt * vel * np.sin(yaw)
+    yaw_new = yaw + dt * vel / lwb * np.tan(steer)
+    return x_new, y_new, steer + dt * sv, vel + dt * accl, yaw_new
+
+
+@njit(cache=True, parallel=True)
+def rollout_costs(state, controls, dt, n_substeps, params, reference, reference_spacing, search_window, weights, collision_radius, last_steer, orig_x, orig_y, orig_c, orig_s, height, width, resolution, map_dt):
+    """
+    Cost of each control sequence in controls (n_samples, horizon, [steer, speed]).
+    Squared distance to the local centre line and steering changes are penalised, progress along the reference is rewarded,
+    and a rollout that comes within collision_radius of a wall is charged weight_collision for every step it does not complete.
+    """
+    n_samples, horizon = controls.shape[0], controls.shape[1]
+    n_reference = reference.shape[0]
+    w_progress, w_contour, w_steer_rate, w_collision = weights[0], weights[1], weights[2], weights[3]
+    sub_dt = dt / n_substeps
+    costs = np.zeros(n_samples)
+    for i in prange(n_samples):
+        x, y, steer, vel, yaw = state[0], state[1], state[2], state[3], state[4]
+        previous_steer = last_steer
+        ref_index = 0
+        cost = 0.0
+        for k in range(horizon):
+            for _ in range(n_substeps):
+                x, y, steer, vel, yaw = ks_step(x, y, steer, vel, yaw, controls[i, k, 0], controls[i, k, 1], sub_dt, params)
+
+            steer_change = controls[i, k, 0] - previous_steer
+            cost += w_steer_rate * steer_change * steer_change
+            previous_steer = controls[i, k, 0]
+
+            # the nearest reference point only moves forward, so it is searched for in a short window
+            best = np.inf
+            start = max(ref_index - 2, 0)
+            for j in range(start, min(ref_index + search_window, n_reference)):
+                d = (x - reference[j, 0]) ** 2 + (y - reference[j, 1]) ** 2
+                if d < best:
+                    best = d
+                    ref_index = j
+            cost += w_contour * best
+
+            if distance_transform(x, y, orig_x, orig_y, orig_c, orig_s, height, width, resolution, map_dt) < collision_radius:
+                cost += w_collision * (horizon - k)
+                break
+
+        costs[i] = cost - w_progress * ref_index * reference_spacing
+    return costs
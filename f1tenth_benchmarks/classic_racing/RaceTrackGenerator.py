@@ -4,10 +4,13 @@ import pandas as pd
 import trajectory_planning_helpers as tph
 from f1tenth_benchmarks.utils.BasePlanner import *
 from f1tenth_benchmarks.utils.track_utils import CentreLine, RaceTrack
+from f1tenth_benchmarks.utils.velocity_profile import VelocityProfile
+from f1tenth_benchmarks.utils.min_curvature import opt_min_curv_sparse
 from f1tenth_benchmarks.data_tools.specific_plotting.plot_racelines import RaceTrackPlotter
 import matplotlib.pyplot as plt
 from f1tenth_benchmarks.utils.smooth_centre_lines import smooth_centre_lines
 import csv
+import multiprocessing as mp
 
 from copy import copy
 from f1tenth_benchmarks.data_tools.plotting_utils import *
@@ -23,11 +26,7 @@ class RaceTrackGenerator(RaceTrack):
     def __init__(self, map_name, raceline_id, params, load_mincurve=False, plot_raceline=True) -> None:
         super().__init__(map_name, load=False)
         self.raceline_id = raceline_id
-        try:
-            self.centre_line = CentreLine(map_name, "Data/smooth_centre_lines/")
-        except:
-            smooth_centre_lines()
-            self.centre_line = CentreLine(map_name, "Data/smooth_centre_lines/")
+        self.centre_line = load_smooth_centre_line(map_name)
         # ensure_path_exists(f"Data/racelines/")
         # ensure_path_exists(f"Data/min_curve_lines/")
         # ensure_path_exists(f"Data/raceline_data/")
@@ -68,30 +67,16 @@ class RaceTrackGenerator(RaceTrack):
         if crossing: print(f"Major problem: nvecs are crossing. Result will be incorrect. Fix the center line file.")
 
     def generate_minimum_curvature_path(self):
-        path_cl = np.row_stack([self.centre_line.path, self.centre_line.path[0]])
-        el_lengths_cl = np.append(self.centre_line.el_lengths, self.centre_line.el_lengths[0])
-        coeffs_x, coeffs_y, A, normvec_normalized = tph.calc_splines.calc_splines(path_cl, el_lengths_cl)
-    
-        widths = self.centre_line.widths.copy() - self.params.vehicle_width / 2
-        track = np.concatenate([self.centre_line.path, widths], axis=1)
-        alpha, error = tph.opt_min_curv.opt_min_curv(track, self.centre_line.nvecs, A, 1, 0, print_debug=True, closed=True)
-
-        self.path, A_raceline, coeffs_x_raceline, coeffs_y_raceline, spline_inds_raceline_interp, t_values_raceline_interp, self.s_raceline, spline_lengths_raceline, el_lengths_raceline_interp_cl = tph.create_raceline.create_raceline(self.centre_line.path, self.centre_line.nvecs, alpha, self.params.raceline_step) 
-        self.psi, self.kappa = tph.calc_head_curv_num.calc_head_curv_num(self.path, el_lengths_raceline_interp_cl, True)
+        self.s_raceline, self.path, self.psi, self.kappa = minimum_curvature_line(self.centre_line, self.params, print_debug=True)
 
         min_curve_line = np.concatenate([self.s_raceline[:, None], self.path, self.psi[:, None], self.kappa[:, None]], axis=1)
         np.savetxt(f"Data/min_curve_lines/{self.map_name}_min_curve_line.csv", min_curve_line, delimiter=',')
 
     def generate_velocity_profile(self):
-        mu = self.params.mu * np.ones(len(self.path))
         self.el_lengths = np.linalg.norm(np.diff(self.path, axis=0), axis=1)
 
-        ggv = np.array([[0, self.params.max_longitudinal_acc, self.params.max_lateral_acc], 
-                        [self.vehicle.max_speed, self.params.max_longitudinal_acc, self.params.max_lateral_acc]])
-        ax_max_machine = np.array([[0, self.params.max_longitudinal_acc],
-                                   [self.vehicle.max_speed, self.params.max_longitudinal_acc]])
-
-        self.speeds = tph.calc_vel_profile.calc_vel_profile(ax_max_machine, self.kappa, self.el_lengths, False, 0, self.vehicle.vehicle_mass, ggv=ggv, mu=mu, v_max=self.vehicle.max_speed, v_start=self.vehicle.max_speed)
+        velocity_profile = build_velocity_profile(self.params, self.vehicle, len(self.path))
+        self.speeds = velocity_profile.solve(self.kappa, self.el_lengths, v_start=self.vehicle.max_speed).copy()
 
         ts = tph.calc_t_profile.calc_t_profile(self.speeds, self.el_lengths, 0)
         print(f"Planned Lap Time: {ts[-1]}")
@@ -102,6 +87,7 @@ class RaceTrackGenerator(RaceTrack):
         self.s_track = np.insert(np.cumsum(self.el_lengths), 0, 0)
         raceline = np.concatenate([self.s_track[:, None], self.path, self.psi[:, None], self.kappa[:, None], self.speeds[:, None], acc[:, None]], axis=1)
         np.savetxt(self.raceline_path + self.map_name+ '_raceline.csv', raceline, delimiter=',')
+        RaceTrack(self.map_name, self.raceline_id) # builds the binary track artifact
 
     def __del__(self):
         try:
@@ -140,6 +126,77 @@ class Track:
 
 
 
+def load_smooth_centre_line(map_name):
+    try:
+        return CentreLine(map_name, "Data/smooth_centre_lines/")
+    except:
+        smooth_centre_lines()
+        return CentreLine(map_name, "Data/smooth_centre_lines/")
+
+
+def minimum_curvature_line(centre_line, params, print_debug=False):
+    """Minimum curvature line through the centre line corridor, resampled every raceline_step: returns s, path, psi and kappa"""
+    widths = centre_line.widths.copy() - params.vehicle_width / 2
+    track = np.concatenate([centre_line.path, widths], axis=1)
+    alpha, error = opt_min_curv_sparse(track, centre_line.nvecs, 1, 0, n_iterations=params.min_curvature_iterations, print_debug=print_debug)
+
+    path, A_raceline, coeffs_x_raceline, coeffs_y_raceline, spline_inds_raceline_interp, t_values_raceline_interp, s_raceline, spline_lengths_raceline, el_lengths_raceline_interp_cl = tph.create_raceline.create_raceline(centre_line.path, centre_line.nvecs, alpha, params.raceline_step) 
+    psi, kappa = tph.calc_head_curv_num.calc_head_curv_num(path, el_lengths_raceline_interp_cl, True)
+    return s_raceline, path, psi, kappa
+
+
+def build_velocity_profile(params, vehicle, capacity):
+    ggv = np.array([[0, params.max_longitudinal_acc, params.max_lateral_acc], 
+                    [vehicle.max_speed, params.max_longitudinal_acc, params.max_lateral_acc]])
+    ax_max_machine = np.array([[0, params.max_longitudinal_acc],
+                               [vehicle.max_speed, params.max_longitudinal_acc]])
+    return VelocityProfile(ggv, ax_max_machine, params.mu, vehicle.max_speed, capacity=capacity)
+
+
+def acceleration_profiles(speeds, el_lengths):
+    """tph.calc_ax_profile (with a zero appended) for every row of speeds"""
+    acc = np.zeros_like(speeds)
+    acc[:, :-1] = (speeds[:, 1:] ** 2 - speeds[:, :-1] ** 2) / (2 * el_lengths)
+    return acc
+
+
+def raceline_bundle_entries(map_name, params, mus):
+    """The minimum curvature line of one map with its speed and acceleration profiles for every mu, keyed as in the bundle"""
+    vehicle = load_parameter_file("vehicle_params")
+    centre_line = CentreLine(map_name, "Data/smooth_centre_lines/")
+    s_raceline, path, psi, kappa = minimum_curvature_line(centre_line, params)
+    el_lengths = np.linalg.norm(np.diff(path, axis=0), axis=1)
+
+    speeds = build_velocity_profile(params, vehicle, len(path)).solve_batch(kappa, el_lengths, mus, v_start=vehicle.max_speed)
+    acc = acceleration_profiles(speeds, el_lengths)
+    s_track = np.insert(np.cumsum(el_lengths), 0, 0)
+    print(f"{map_name}: planned lap times {np.round([np.sum(el_lengths / ((v[1:] + v[:-1]) / 2)) for v in speeds], 2)} for mu {mus}")
+
+    return {f"{map_name}/s_track": s_track, f"{map_name}/path": path, f"{map_name}/psi": psi, f"{map_name}/kappa": kappa, f"{map_name}/speeds": speeds, f"{map_name}/acc": acc}
+
+
+def generate_raceline_bundle(bundle_id, map_list, mus, params=None, n_workers=None):
+    """
+    Racelines for every map and friction value in one file, Data/racelines/{bundle_id}_bundle.npz (load with RaceTrack(map_name, bundle_id, mu=mu)).
+    Only the velocity profile depends on mu, so the minimum curvature line is solved once per map and the maps are solved in parallel processes.
+    """
+    params = params or load_parameter_file("RaceTrackGenerator")
+    mus = np.asarray(mus, dtype=np.float64)
+    if not all(os.path.exists(f"Data/smooth_centre_lines/{map_name}_centerline.csv") for map_name in map_list):
+        smooth_centre_lines()
+
+    n_workers = min(n_workers or len(map_list), len(map_list))
+    with mp.get_context("spawn").Pool(n_workers) as pool:
+        entries = pool.starmap(raceline_bundle_entries, [(map_name, params, mus) for map_name in map_list])
+
+    bundle = {"mus": mus, "maps": np.array(map_list)}
+    for map_entries in entries:
+        bundle.update(map_entries)
+    ensure_path_exists("Data/racelines/")
+    np.savez(f"Data/racelines/{bundle_id}_bundle.npz", **bundle)
+    save_params(params, "Data/racelines/", f"{bundle_id}_bundle_params")
+
+
 def generate_racelines():
     params = load_parameter_file("RaceTrackGenerator")
     # params.mu = 0.5
@@ -1,11 +1,9 @@
 import numpy as np
-import yaml
 from numba import njit 
-from PIL import Image
 import os 
-from scipy.ndimage import distance_transform_edt as edt
 
 from f1tenth_benchmarks.utils.BasePlanner import load_parameter_file_with_extras
+from f1tenth_benchmarks.simulator.laser_models import load_map_assets
 
 
 class ParticleFilter:
@@ -20,6 +18,7 @@ class ParticleFilter:
         self.NP = self.params.number_of_particles
         self.dt = self.params.dt
         self.num_beams = self.params.number_of_beams
+        self.scan_beams = slice(None, None, 24)
         self.lap_number = 0
         self.map_name = None
 
@@ -42,7 +41,7 @@ class ParticleFilter:
     def localise(self, action, observation):
         vehicle_speed = observation["vehicle_speed"] 
         self.particle_control_update(action, vehicle_speed)
-        self.measurement_update(observation["scan"][::24])
+        self.measurement_update(observation["scan"][self.scan_beams])
 
         estimate = np.dot(self.particles.T, self.weights)
         self.estimates.append(estimate)
@@ -107,27 +106,15 @@ class SensorModel:
         self.cosines = np.cos(theta_arr)
     
     def load_map(self, map_path):
-        map_img_path = os.path.splitext(map_path)[0] + ".png"
-        map_img = np.array(Image.open(map_img_path).transpose(Image.FLIP_TOP_BOTTOM))
-        map_img = map_img.astype(np.float64)
-
-        map_img[map_img <= 128.] = 0.
-        map_img[map_img > 128.] = 255.
-        self.map_img = map_img
-
-        self.map_height = map_img.shape[0]
-        self.map_width = map_img.shape[1]
-
-        with open(map_path + ".yaml", 'r') as yaml_stream:
-            map_metadata = yaml.safe_load(yaml_stream)
-            self.map_resolution = map_metadata['resolution']
-            self.origin = map_metadata['origin']
+        """The same shared image and distance transform assets as the simulator's ScanSimulator2D"""
+        directory, map_name = os.path.split(map_path)
+        self.map_img, self.dt, self.origin, self.map_resolution = load_map_assets(map_name, directory + "/")
+        self.map_height = self.map_img.shape[0]
+        self.map_width = self.map_img.shape[1]
 
         self.orig_x = self.origin[0]
         self.orig_y = self.origin[1]
 
-        self.dt = self.map_resolution * edt(map_img)
-
     def scan(self, pose):
         scan = get_scan(pose, self.theta_dis, self.fov, self.num_beams, self.theta_index_increment, self.sines, self.cosines, self.eps, self.orig_x, self.orig_y, self.map_height, self.map_width, self.map_resolution, self.dt, self.max_range)
 
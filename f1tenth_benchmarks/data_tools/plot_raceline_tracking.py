@@ -165,12 +165,10 @@ class TrajectoryPlotter:
 
         
 def calculate_cross_track(track_line, positions):
-    s_points = np.zeros(len(positions))
-    for i in range(len(positions)):
-        s_points[i] = track_line.calculate_progress_percent(positions[i])
-
-    closest_pts = np.array(splev(s_points, track_line.tck, ext=3)).T
-    cross_track_errors = np.linalg.norm(positions - closest_pts, axis=1)
+    s, n, _ = track_line.to_frenet(positions)
+    s_points = s / track_line.s_path[-1]
+    closest_pts = track_line.from_frenet(s, 0)
+    cross_track_errors = np.abs(n)
 
     return s_points, cross_track_errors, closest_pts
 
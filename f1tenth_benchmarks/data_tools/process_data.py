@@ -1,39 +1,64 @@
 import pandas as pd
-import glob 
+import glob
 import numpy as np
 import os
 
+from f1tenth_benchmarks.utils.map_assets import file_key
+
+LOGS_PATH = "/home/m810z573/Downloads/f1tenth_benchmarks/f1tenth_benchmarks/benchmark_results/Logs/"
+CACHE_PATH = LOGS_PATH + "SummaryCache/"
+
+
+def summarise_results(df):
+    """Progress, lap time and completion rate of every (Vehicle, TestMap, TestID) in one groupby"""
+    df = df.assign(Completed=df.Progress > 0.99, FinishedTime=df.Time.where(df.Progress > 0.994))
+    summary = df.groupby(["Vehicle", "TestMap", "TestID"], sort=False).agg(AvgProgress=("Progress", "mean"), AvgTime=("FinishedTime", "mean"),
+                                                                           StdTime=("FinishedTime", "std"), CompletionRate=("Completed", "mean"))
+    summary = summary.reset_index().rename(columns={"TestMap": "MapName"})
+    return summary[["Vehicle", "TestID", "MapName", "AvgProgress", "AvgTime", "StdTime", "CompletionRate"]]
+
+
+def load_folder_results(results_file, planner_name):
+    """
+    The results of one planner and their summary.
+    Both are cached in the planner's own folder of SummaryCache, in a pickle named by the results file's mtime and size, so only folders with new runs are read and summarised again.
+    """
+    cache_path = CACHE_PATH + f"{planner_name}/"
+    cache_file = cache_path + f"{file_key(results_file)}.pkl"
+    if os.path.exists(cache_file):
+        return pd.read_pickle(cache_file)
+
+    df = pd.read_csv(results_file)
+    df["Vehicle"] = planner_name
+    results = (df, summarise_results(df))
+
+    for stale_file in glob.glob(cache_path + "*.pkl"):
+        os.remove(stale_file)
+    os.makedirs(cache_path, exist_ok=True)
+    pd.to_pickle(results, cache_file)
+    return results
 
 
 def process_data():
     #folders = glob.glob("Logs/*")
-    folders = glob.glob("/home/m810z573/Downloads/f1tenth_benchmarks/f1tenth_benchmarks/benchmark_results/Logs/*")
-    #folders = "/home/m810z573/Downloads/f1tenth_benchmarks/f1tenth_benchmarks/benchmark_results/Logs/*"
+    folders = glob.glob(LOGS_PATH + "*")
     full_df = []
     summary_df = []
     for folder in folders:
         planner_name = folder.split("/")[-1]
-        if not os.path.exists(folder + f"/Results_{planner_name}.csv"): continue
-        df = pd.read_csv(folder + f"/Results_{planner_name}.csv")
-        df["Vehicle"] = planner_name
+        results_file = folder + f"/Results_{planner_name}.csv"
+        if not os.path.exists(results_file): continue
+        df, summary = load_folder_results(results_file, planner_name)
         full_df.append(df)
-
-        for map_name in df.TestMap.unique():
-            map_df = df.loc[df["TestMap"] == map_name]
-            for test_id in map_df.TestID.unique():
-                test_id_df = map_df.loc[map_df.TestID == test_id]
-                completion_rate = np.count_nonzero(test_id_df.Progress > 0.99) / test_id_df.shape[0] 
-                average_time = test_id_df.loc[test_id_df.Progress > 0.994].Time.mean()
-                std_time = test_id_df.loc[test_id_df.Progress > 0.994].Time.std()
-                summary_df.append({"Vehicle": planner_name, "TestID":test_id, "MapName": map_name, "AvgProgress": test_id_df.Progress.mean(), "AvgTime": average_time, "StdTime": std_time, "CompletionRate": completion_rate})
+        summary_df.append(summary)
 
     full_df = pd.concat(full_df)
     full_df = full_df.sort_values(by=["Vehicle", "TestMap"])
-    full_df.to_csv("/home/m810z573/Downloads/f1tenth_benchmarks/f1tenth_benchmarks/benchmark_results/Logs/Full.csv", index=False, float_format='%.4f')
-    summary_df = pd.DataFrame(summary_df)
+    full_df.to_csv(LOGS_PATH + "Full.csv", index=False, float_format='%.4f')
+    summary_df = pd.concat(summary_df)
     summary_df['VehicleID'] = summary_df['Vehicle'] + "_" + summary_df['TestID']
     summary_df = summary_df.sort_values(by=["Vehicle", "MapName"])
-    summary_df.to_csv("/home/m810z573/Downloads/f1tenth_benchmarks/f1tenth_benchmarks/benchmark_results/Logs/Summary.csv", index=False, float_format='%.4f')
+    summary_df.to_csv(LOGS_PATH + "Summary.csv", index=False, float_format='%.4f')
     print("Complied Full.csv and Summary.csv.")
 
 if __name__ == "__main__":
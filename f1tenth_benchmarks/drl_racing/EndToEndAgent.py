@@ -2,33 +2,79 @@ import numpy as np
 from f1tenth_benchmarks.drl_racing.sac import TrainSAC, TestSAC
 from f1tenth_benchmarks.drl_racing.td3 import TrainTD3, TestTD3, TrainTinyTD3
 from f1tenth_benchmarks.drl_racing.reward_functions import create_reward_function
+from f1tenth_benchmarks.drl_racing.inference import ScanHistory, load_inference_actor
+from f1tenth_benchmarks.drl_racing.checkpointing import CheckpointManager, agent_state_dict, load_agent_state_dict, rng_state_dict, load_rng_state_dict
 from f1tenth_benchmarks.utils.BasePlanner import BasePlanner, save_params
 import torch
 
-def create_train_agent(state_dim, algorithm):
+def create_train_agent(state_dim, algorithm, prioritized=False):
     action_dim = 2
     if algorithm == "TD3":
-        agent = TrainTD3(state_dim, action_dim)
+        agent = TrainTD3(state_dim, action_dim, prioritized)
     elif algorithm == "SAC":
-        agent = TrainSAC(state_dim, action_dim)
+        agent = TrainSAC(state_dim, action_dim, prioritized)
     elif algorithm == "TinyTD3":
-        agent = TrainTinyTD3(state_dim, action_dim)
+        agent = TrainTinyTD3(state_dim, action_dim, prioritized)
     else: raise ValueError(f"Algorithm {algorithm} not recognised")
     
     return agent
     
 
 
+class TrainingCheckpoints:
+    """
+    Checkpointing for the training agents: the agent, replay buffer and RNG states are saved at the configured cadence, not at every episode end.
+    """
+    def init_checkpoints(self):
+        p = self.planner_params
+        self.checkpoints = CheckpointManager(self.data_root_path + p.checkpoint_directory, p.checkpoint_every_steps, p.checkpoint_every_seconds, p.checkpoint_keep_last, p.checkpoint_keep_best, p.resume_training)
+        if p.resume_training:
+            self.resume_from_checkpoint()
+
+    def checkpoint_score(self):
+        if len(self.reward_history) == 0:
+            return None
+        return float(np.mean(self.reward_history[-10:]))
+
+    def save_checkpoint(self):
+        state = {"step": self.step_counter, 
+                 "agent": agent_state_dict(self.agent), 
+                 "replay_buffer": self.agent.replay_buffer.state_dict(), 
+                 "rng": rng_state_dict(), 
+                 "reward_history": self.reward_history}
+        self.checkpoints.save(self.step_counter, state, self.checkpoint_score())
+        np.save(self.data_root_path + "RewardHistory.npy", self.reward_history)
+        self.agent.save(self.name, self.data_root_path)
+
+    def resume_from_checkpoint(self):
+        state = self.checkpoints.load_latest()
+        if state is None:
+            print("No checkpoint found: training from scratch")
+            return
+        load_agent_state_dict(self.agent, state["agent"])
+        self.agent.replay_buffer.load_state_dict(state["replay_buffer"])
+        load_rng_state_dict(state["rng"])
+        self.reward_history = list(state["reward_history"])
+        self.step_counter = state["step"]
+        self.checkpoints.last_step = self.step_counter
+        print(f"Resumed training from step {self.step_counter}")
+
+    def finish_training(self):
+        if self.is_learner: # async actor workers send their episode rewards to the learner instead
+            self.save_checkpoint()
+
+
 class EndToEndAgent(BasePlanner):
     def __init__(self, test_id):
         BasePlanner.__init__(self, "EndToEnd", test_id)
         self.range_finder_scale = 10
 
         self.skip_n = int(np.ceil(1081 / self.planner_params.number_of_beams))
+        self.scan_beams = slice(None, None, self.skip_n)
         # self.state_space = self.planner_params.number_of_beams *2 + 1
         self.state_space = self.planner_params.number_of_beams *2
-        self.scan_buffer = np.zeros((self.planner_params.n_scans, self.planner_params.number_of_beams))
-        self.actor = torch.load(self.data_root_path + f'{self.name}_actor.pth')
+        self.scan_buffer = ScanHistory(self.planner_params.n_scans, self.planner_params.number_of_beams)
+        self.actor = load_inference_actor(self.data_root_path, self.name, (self.state_space, ), self.planner_params.inference_backend)
         
     def plan(self, obs):
         nn_state = self.transform_obs(obs)
@@ -54,32 +100,31 @@ class EndToEndAgent(BasePlanner):
         speed = obs['vehicle_speed'] / self.planner_params.max_speed
         scan = np.clip(obs['scan'][::self.skip_n] /self.planner_params.range_finder_scale, 0, 1)
 
-        if self.scan_buffer.all() ==0: # first reading
-            for i in range(self.scan_buffer.shape[0]):
-                self.scan_buffer[i, :] = scan 
-        else:
-            self.scan_buffer = np.roll(self.scan_buffer, 1, axis=0)
-            self.scan_buffer[0, :] = scan
+        self.scan_buffer.add(scan)
 
-        dual_scan = np.reshape(self.scan_buffer, (-1))
+        dual_scan = np.reshape(self.scan_buffer.stacked(), (-1))
         # nn_obs = np.concatenate((dual_scan, [speed]))
 
         return dual_scan
 
     def transform_action(self, nn_action):
-        steering_angle = nn_action[0] * self.vehicle_params.max_steer
-        speed = (nn_action[1] + 1) * (self.vehicle_params.max_speed  / 2 - 0.5) + 1
+        steering_angle = nn_action[..., 0] * self.vehicle_params.max_steer
+        speed = (nn_action[..., 1] + 1) * (self.vehicle_params.max_speed  / 2 - 0.5) + 1
         #speed = (nn_action[1] + 1) * (self.vehicle_params.max_speed  / 2 - 1) + 2
         # speed = (nn_action[1] + 1) * (self.vehicle_params.max_speed  / 2 - 1.5) + 3
         # speed = (nn_action[1] + 1) * (self.vehicle_params.max_speed  / 2 - 1.5) + 4
-        speed = min(speed, self.planner_params.max_speed) # cap the speed for the planner
+        speed = np.minimum(speed, self.planner_params.max_speed) # cap the speed for the planner
 
-        action = np.array([steering_angle, speed])
+        action = np.stack([steering_angle, speed], axis=-1)
 
         return action
+
+    def act_batch(self, nn_states):
+        """Actions for a batch of transformed observations (e.g. parallel test laps), requires an exported inference_backend"""
+        return self.transform_action(self.actor.act_batch(nn_states))
     
 
-class TrainEndToEndAgent(EndToEndAgent): 
+class TrainEndToEndAgent(TrainingCheckpoints, EndToEndAgent): 
     def __init__(self, map_name, test_id, extra_params={}):
         BasePlanner.__init__(self, "EndToEnd", test_id, extra_params=extra_params) #NOTE: do not call the inherited __init__()
 
@@ -90,15 +135,19 @@ class TrainEndToEndAgent(EndToEndAgent):
         self.action = None
 
         self.skip_n = int(np.ceil(1081 / self.planner_params.number_of_beams))
+        self.scan_beams = slice(None, None, self.skip_n)
         self.state_space = self.planner_params.number_of_beams *2 + 1 
         self.state_space = self.planner_params.number_of_beams *2
-        self.scan_buffer = np.zeros((self.planner_params.n_scans, self.planner_params.number_of_beams))
+        self.scan_buffer = ScanHistory(self.planner_params.n_scans, self.planner_params.number_of_beams)
 
-        self.agent = create_train_agent(self.state_space, self.planner_params.algorithm)
+        self.agent = create_train_agent(self.state_space, self.planner_params.algorithm, self.planner_params.prioritized_replay)
+        self.is_learner = True # actor workers in async training only collect experience
         self.current_ep_reward = 0
         self.reward_history = []
+        self.init_checkpoints()
 
     def plan(self, obs): # This overwrites the above plan method
+        self.step_counter += 1
         nn_state = self.transform_obs(obs)
         
         self.add_memory_entry(obs, nn_state)
@@ -112,7 +161,8 @@ class TrainEndToEndAgent(EndToEndAgent):
         self.nn_act = self.agent.act(self.nn_state)
         self.action = self.transform_action(self.nn_act)
         
-        self.agent.train()
+        if self.is_learner:
+            self.agent.train()
 
         return self.action 
 
@@ -136,8 +186,8 @@ class TrainEndToEndAgent(EndToEndAgent):
         self.nn_state = None
         self.state = None
 
-        np.save(self.data_root_path + "RewardHistory.npy", self.reward_history)
-        self.agent.save(self.name, self.data_root_path)
+        if self.is_learner and self.checkpoints.is_due(self.step_counter):
+            self.save_checkpoint()
 
 
 class TinyAgent(BasePlanner):
@@ -146,9 +196,10 @@ class TinyAgent(BasePlanner):
         self.range_finder_scale = 10
 
         self.skip_n = int(np.ceil(1081 / self.planner_params.number_of_beams))
+        self.scan_beams = slice(None, None, self.skip_n)
         self.state_space = self.planner_params.number_of_beams *2
-        self.scan_buffer = np.zeros((self.planner_params.n_scans, self.planner_params.number_of_beams))
-        self.actor = torch.load(self.data_root_path + f'{self.name}_actor.pth')
+        self.scan_buffer = ScanHistory(self.planner_params.n_scans, self.planner_params.number_of_beams)
+        self.actor = load_inference_actor(self.data_root_path, self.name, (self.planner_params.n_scans, self.planner_params.number_of_beams), self.planner_params.inference_backend)
         
     def plan(self, obs):
         nn_state = self.transform_obs(obs)
@@ -174,32 +225,31 @@ class TinyAgent(BasePlanner):
         speed = obs['vehicle_speed'] / self.planner_params.max_speed
         scan = np.clip(obs['scan'][::self.skip_n] /self.planner_params.range_finder_scale, 0, 1)
 
-        if self.scan_buffer.all() ==0: # first reading
-            for i in range(self.scan_buffer.shape[0]):
-                self.scan_buffer[i, :] = scan 
-        else:
-            self.scan_buffer = np.roll(self.scan_buffer, 1, axis=0)
-            self.scan_buffer[0, :] = scan
+        self.scan_buffer.add(scan)
 
         # dual_scan = np.reshape(self.scan_buffer, (-1))
         # speed = np.reshape(speed, (1,1))
         # nn_obs = np.concatenate((self.scan_buffer, speed))
-        return self.scan_buffer
+        return self.scan_buffer.stacked()
     def linear_map(self, x, x_min, x_max, y_min, y_max):
         return (x - x_min) / (x_max - x_min) * (y_max - y_min) + y_min
     def transform_action(self, nn_action):
-        steering_angle = nn_action[0] * self.vehicle_params.max_steer
-        speed = (nn_action[1] + 1) * (self.vehicle_params.max_speed  / 2 - 0.5) + 1
+        steering_angle = nn_action[..., 0] * self.vehicle_params.max_steer
+        speed = (nn_action[..., 1] + 1) * (self.vehicle_params.max_speed  / 2 - 0.5) + 1
 
         # speed = self.linear_map(nn_action[1], 0, 1, 1, 8)
-        speed = min(speed, self.planner_params.max_speed) # cap the speed for the planner
+        speed = np.minimum(speed, self.planner_params.max_speed) # cap the speed for the planner
 
-        action = np.array([steering_angle, speed])
+        action = np.stack([steering_angle, speed], axis=-1)
 
         return action
+
+    def act_batch(self, nn_states):
+        """Actions for a batch of transformed observations (e.g. parallel test laps), requires an exported inference_backend"""
+        return self.transform_action(self.actor.act_batch(nn_states))
     
 
-class TrainTinyAgent(TinyAgent): 
+class TrainTinyAgent(TrainingCheckpoints, TinyAgent): 
     def __init__(self, map_name, test_id, extra_params={}):
         BasePlanner.__init__(self, "TinyLidarNet", test_id, extra_params=extra_params) #NOTE: do not call the inherited __init__()
 
@@ -210,14 +260,18 @@ class TrainTinyAgent(TinyAgent):
         self.action = None
 
         self.skip_n = int(np.ceil(1081 / self.planner_params.number_of_beams))
+        self.scan_beams = slice(None, None, self.skip_n)
         self.state_space = (self.planner_params.n_scans, self.planner_params.number_of_beams)
-        self.scan_buffer = np.zeros((self.planner_params.n_scans, self.planner_params.number_of_beams))
+        self.scan_buffer = ScanHistory(self.planner_params.n_scans, self.planner_params.number_of_beams)
 
-        self.agent = create_train_agent(self.state_space, self.planner_params.algorithm)
+        self.agent = create_train_agent(self.state_space, self.planner_params.algorithm, self.planner_params.prioritized_replay)
+        self.is_learner = True # actor workers in async training only collect experience
         self.current_ep_reward = 0
         self.reward_history = []
+        self.init_checkpoints()
 
     def plan(self, obs): # This overwrites the above plan method
+        self.step_counter += 1
         nn_state = self.transform_obs(obs)
         
         self.add_memory_entry(obs, nn_state)
@@ -231,7 +285,8 @@ class TrainTinyAgent(TinyAgent):
         self.nn_act = self.agent.act(self.nn_state)
         self.action = self.transform_action(self.nn_act)
         
-        self.agent.train()
+        if self.is_learner:
+            self.agent.train()
 
         return self.action 
 
@@ -254,7 +309,7 @@ class TrainTinyAgent(TinyAgent):
         self.current_ep_reward = 0
         self.nn_state = None
         self.state = None
-        np.save(self.data_root_path + "RewardHistory.npy", self.reward_history)
-        self.agent.save(self.name, self.data_root_path)
+        if self.is_learner and self.checkpoints.is_due(self.step_counter):
+            self.save_checkpoint()
 
 
@@ -0,0 +1,178 @@
+import copy
+import time
+import queue
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from f1tenth_benchmarks.simulator import F1TenthSim_TrueLocation
+from f1tenth_benchmarks.utils.BasePlanner import ensure_path_exists
+from f1tenth_benchmarks.drl_racing.td3 import BATCH_SIZE
+
+RING_SIZE = 10000
+MAX_LAG_STEPS = 500 # how far the actors may run ahead of the update-to-data budget
+
+
+class SharedTransitionRing:
+    """
+    Single producer ring of transitions in shared memory.
+    It has the same add() interface as the replay buffers so that it can replace the buffer in an actor worker.
+    """
+    def __init__(self, ctx, state_dim, action_dim, capacity=RING_SIZE):
+        self.capacity = capacity
+        state_shape = tuple(state_dim) if isinstance(state_dim, (tuple, list)) else (state_dim, )
+        self.states = torch.zeros((capacity, *state_shape), dtype=torch.float32).share_memory_()
+        self.actions = torch.zeros((capacity, action_dim), dtype=torch.float32).share_memory_()
+        self.next_states = torch.zeros((capacity, *state_shape), dtype=torch.float32).share_memory_()
+        self.rewards = torch.zeros((capacity, 1), dtype=torch.float32).share_memory_()
+        self.not_dones = torch.zeros((capacity, 1), dtype=torch.float32).share_memory_()
+        self.write_count = ctx.Value('q', 0, lock=False)
+
+    def add(self, state, action, next_state, reward, done):
+        i = self.write_count.value % self.capacity
+        self.states[i] = torch.as_tensor(state, dtype=torch.float32)
+        self.actions[i] = torch.as_tensor(action, dtype=torch.float32)
+        self.next_states[i] = torch.as_tensor(next_state, dtype=torch.float32)
+        self.rewards[i, 0] = float(reward)
+        self.not_dones[i, 0] = 1.0 - float(done)
+        self.write_count.value += 1 # publish only once the slot is written
+
+    def size(self):
+        return self.write_count.value
+
+    def drain(self, read_count, replay_buffer):
+        """
+        Copies the transitions written since read_count into the replay buffer and returns the new read count.
+        The producer does not wait for the reader, so write_count is read again after the copy (as in a seqlock)
+        and the slots it may have overwritten meanwhile, including the one being written, are dropped.
+        """
+        write_count = self.write_count.value
+        read_count = max(read_count, write_count - self.capacity)
+        if write_count == read_count:
+            return read_count
+
+        ind = torch.arange(read_count, write_count) % self.capacity
+        batch = (self.states[ind], self.actions[ind], self.next_states[ind], self.rewards[ind], self.not_dones[ind])
+        n_overwritten = max(0, self.write_count.value + 1 - self.capacity - read_count)
+        if n_overwritten < len(ind):
+            replay_buffer.add_batch(*(values[n_overwritten:] for values in batch))
+
+        return write_count
+
+
+class SharedActor:
+    """Copy of the actor network in shared memory that the learner publishes to and the workers pull from"""
+    def __init__(self, ctx, actor):
+        self.actor = copy.deepcopy(actor)
+        self.actor.share_memory()
+        self.version = ctx.Value('q', 0, lock=False)
+        self.lock = ctx.Lock()
+
+    def publish(self, actor):
+        with self.lock, torch.no_grad():
+            for shared_param, param in zip(self.actor.parameters(), actor.parameters()):
+                shared_param.copy_(param)
+            self.version.value += 1
+
+    def pull(self, actor, local_version):
+        if self.version.value == local_version:
+            return local_version
+        with self.lock:
+            actor.load_state_dict(self.actor.state_dict())
+            return self.version.value
+
+
+def run_actor_worker(worker_id, planner_class, train_map, test_id, planner_params, sim_params, ring, shared_actor, episode_rewards, env_steps, updates, n_steps, utd_ratio, warmup_steps, seed):
+    torch.set_num_threads(1)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+    worker_test_id = test_id if worker_id == 0 else f"{test_id}_worker{worker_id}"
+    worker_params = dict(planner_params, resume_training=False, checkpoint_directory=f"Checkpoints_worker{worker_id}/") # the learner owns Checkpoints/
+    planner = planner_class(train_map, worker_test_id, extra_params=worker_params)
+    planner.is_learner = False
+    planner.agent.replay_buffer = ring
+    actor_version = shared_actor.pull(planner.agent.actor, -1)
+
+    sim = F1TenthSim_TrueLocation(train_map, planner.name, worker_test_id, False, True, extra_params=sim_params)
+    sim.scan_simulator.register_beams("planner", planner.scan_beams)
+    ensure_path_exists(sim.path + f"RawData_{worker_test_id}/")
+    observation, done, init_pose = sim.reset()
+
+    for i in range(n_steps):
+        while utd_ratio > 0 and env_steps.value > warmup_steps and env_steps.value - updates.value / utd_ratio > MAX_LAG_STEPS:
+            time.sleep(0.0005)
+        actor_version = shared_actor.pull(planner.agent.actor, actor_version)
+
+        action = planner.plan(observation)
+        observation, done = sim.step(action)
+        with env_steps.get_lock():
+            env_steps.value += 1
+        if done:
+            planner.done_callback(observation)
+            episode_rewards.put(planner.reward_history[-1])
+            observation, done, init_pose = sim.reset()
+
+
+def collect_episode_rewards(planner, episode_rewards):
+    """The learner has no episodes of its own, its reward history (checkpointed and restored on resume) is made of the workers' episodes"""
+    while True:
+        try:
+            planner.reward_history.append(episode_rewards.get_nowait())
+        except queue.Empty:
+            return
+
+
+def save_learner_checkpoint(planner, step):
+    planner.step_counter = step
+    planner.save_checkpoint()
+
+
+def train_async(planner, train_map, test_id, extra_params={}, n_workers=2, utd_ratio=1.0, weight_sync_interval=20):
+    """
+    Actor-learner training: n_workers simulator processes collect experience and push it through shared memory rings.
+    This process is the learner and calls planner.agent.train() utd_ratio times per environment step, publishing the actor every weight_sync_interval updates.
+    If the planner resumed from a checkpoint, training continues from its step_counter up to training_steps.
+    """
+    ctx = mp.get_context("spawn")
+    agent = planner.agent
+    rings = [SharedTransitionRing(ctx, planner.state_space, agent.replay_buffer.action_dim) for _ in range(n_workers)]
+    shared_actor = SharedActor(ctx, agent.actor)
+    env_steps = ctx.Value('q', planner.step_counter)
+    updates = ctx.Value('q', int(utd_ratio * planner.step_counter), lock=False)
+    episode_rewards = ctx.Queue()
+
+    steps_per_worker = int(np.ceil(max(planner.planner_params.training_steps - planner.step_counter, 0) / n_workers))
+    planner_params = vars(planner.planner_params)
+    workers = []
+    for w in range(n_workers):
+        seed = int(np.random.randint(0, 2**31 - 1))
+        args = (w, type(planner), train_map, test_id, planner_params, extra_params, rings[w], shared_actor, episode_rewards, env_steps, updates, steps_per_worker, utd_ratio, BATCH_SIZE, seed)
+        worker = ctx.Process(target=run_actor_worker, args=args, daemon=True)
+        worker.start()
+        workers.append(worker)
+
+    read_counts = [0] * n_workers
+    while True:
+        running = any(w.is_alive() for w in workers)
+        for w in range(n_workers):
+            read_counts[w] = rings[w].drain(read_counts[w], agent.replay_buffer)
+        collect_episode_rewards(planner, episode_rewards)
+
+        if agent.replay_buffer.size() >= BATCH_SIZE and updates.value < utd_ratio * env_steps.value:
+            agent.train()
+            updates.value += 1
+            if updates.value % weight_sync_interval == 0:
+                shared_actor.publish(agent.actor)
+            if planner.checkpoints.is_due(env_steps.value):
+                save_learner_checkpoint(planner, env_steps.value)
+        elif not running:
+            break
+        else:
+            time.sleep(0.0005)
+
+    for worker in workers:
+        worker.join()
+    collect_episode_rewards(planner, episode_rewards)
+    save_learner_checkpoint(planner, env_steps.value)
+    print(f"Async training complete: {env_steps.value} steps, {updates.value} updates")
@@ -0,0 +1,118 @@
+import os
+import glob
+import time
+import random
+import yaml
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from f1tenth_benchmarks.utils.BasePlanner import ensure_path_exists
+
+
+class CheckpointManager:
+    """
+    Writes training checkpoints on a step and/or wall time cadence.
+    Files are written atomically and only the last keep_last and the best keep_best (by score) checkpoints are retained.
+    Without resume, the checkpoints of a previous run in the directory are deleted so that they do not mix with the new ones.
+    """
+    def __init__(self, directory, every_steps=None, every_seconds=None, keep_last=2, keep_best=1, resume=False):
+        self.directory = directory
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        ensure_path_exists(directory)
+
+        self.index_path = directory + "index.yaml"
+        self.index = []
+        if resume and os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as file:
+                self.index = yaml.safe_load(file) or []
+        elif not resume:
+            for stale_file in glob.glob(directory + "checkpoint_*.pt*") + glob.glob(self.index_path):
+                os.remove(stale_file)
+        self.last_step = self.index[-1]["step"] if self.index else 0 # set to the restored step by the caller when resuming
+        self.last_time = time.time()
+
+    def is_due(self, step):
+        if self.every_steps and step - self.last_step >= self.every_steps:
+            return True
+        if self.every_seconds and time.time() - self.last_time >= self.every_seconds:
+            return True
+        return False
+
+    def save(self, step, state, score=None):
+        file_name = f"checkpoint_{step:08d}.pt"
+        atomic_torch_save(state, self.directory + file_name)
+        self.index = [entry for entry in self.index if entry["step"] != step]
+        self.index.append({"step": int(step), "file": file_name, "score": None if score is None else float(score)})
+        self.last_step = step
+        self.last_time = time.time()
+        self.apply_retention()
+
+    def apply_retention(self):
+        keep = set(entry["file"] for entry in self.index[-self.keep_last:])
+        scored = [entry for entry in self.index if entry["score"] is not None]
+        scored.sort(key=lambda entry: entry["score"], reverse=True)
+        keep.update(entry["file"] for entry in scored[:self.keep_best])
+
+        for entry in self.index:
+            if entry["file"] not in keep and os.path.exists(self.directory + entry["file"]):
+                os.remove(self.directory + entry["file"])
+        self.index = [entry for entry in self.index if entry["file"] in keep]
+
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as file:
+            yaml.dump(self.index, file)
+        os.replace(tmp_path, self.index_path)
+
+    def load_latest(self):
+        if not self.index:
+            return None
+        return torch.load(self.directory + self.index[-1]["file"], weights_only=False) # our own files, they hold numpy and python RNG states
+
+    def load_best(self):
+        scored = [entry for entry in self.index if entry["score"] is not None]
+        if not scored:
+            return self.load_latest()
+        best = max(scored, key=lambda entry: entry["score"])
+        return torch.load(self.directory + best["file"], weights_only=False)
+
+
+def atomic_torch_save(obj, path):
+    tmp_path = path + ".tmp"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def agent_state_dict(agent):
+    """Collects the networks, optimisers and learnable tensors (e.g. SAC log_alpha) of an agent, excluding the replay buffer"""
+    state = {}
+    for name, value in vars(agent).items():
+        if isinstance(value, (nn.Module, optim.Optimizer)):
+            state[name] = value.state_dict()
+        elif isinstance(value, torch.Tensor):
+            state[name] = value.detach().clone()
+    return state
+
+
+def load_agent_state_dict(agent, state):
+    for name, value in state.items():
+        target = getattr(agent, name)
+        if isinstance(target, (nn.Module, optim.Optimizer)):
+            target.load_state_dict(value)
+        else:
+            with torch.no_grad():
+                target.copy_(value)
+
+
+def rng_state_dict():
+    return {"numpy": np.random.get_state(), "torch": torch.get_rng_state(), "python": random.getstate()}
+
+
+def load_rng_state_dict(state):
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    random.setstate(state["python"])
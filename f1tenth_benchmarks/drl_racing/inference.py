@@ -0,0 +1,101 @@
+import os
+import numpy as np
+import torch
+import torch.nn as nn
+
+from f1tenth_benchmarks.drl_racing.training_utils import PolicyNetworkSAC
+
+
+class ScanHistory:
+    """
+    Stack of the last n_scans LiDAR scans kept as a ring with a head index instead of rolling the array every step.
+    stacked() returns the scans most recent first, matching the previous np.roll layout.
+    """
+    def __init__(self, n_scans, n_beams):
+        self.ring = np.zeros((n_scans, n_beams))
+        self.order = (np.arange(n_scans)[:, None] - np.arange(n_scans)[None, :]) % n_scans # order[head] lists rows newest first
+        self.head = 0
+        self.empty = True
+
+    def add(self, scan):
+        if self.empty: # first reading
+            self.ring[:] = scan
+            self.empty = False
+            return
+        self.head = (self.head + 1) % self.ring.shape[0]
+        self.ring[self.head] = scan
+
+    def stacked(self):
+        return self.ring[self.order[self.head]]
+
+    def reset(self):
+        self.head = 0
+        self.empty = True
+
+
+class DeterministicActor(nn.Module):
+    """Evaluation policy used for export: the SAC policy returns tanh(mean) in place of a sampled action"""
+    def __init__(self, actor):
+        super(DeterministicActor, self).__init__()
+        self.actor = actor
+
+    def forward(self, state):
+        if isinstance(self.actor, PolicyNetworkSAC):
+            x = torch.relu(self.actor.linear1(state))
+            x = torch.relu(self.actor.linear2(x))
+            return torch.tanh(self.actor.mean_linear(x))
+        return self.actor(state)
+
+
+def export_actor(actor, state_shape, path, backend="torchscript"):
+    """
+    Traces the actor for batched CPU inference, saved as TorchScript (.pt) or ONNX (.onnx) with a dynamic batch dimension.
+    state_shape excludes the batch dimension.
+    """
+    model = DeterministicActor(actor).eval()
+    example = torch.zeros((1, *state_shape), dtype=torch.float32)
+    with torch.no_grad():
+        if backend == "torchscript":
+            traced = torch.jit.freeze(torch.jit.trace(model, example))
+            torch.jit.save(traced, path)
+        elif backend == "onnx":
+            torch.onnx.export(model, example, path, input_names=["state"], output_names=["action"], dynamic_axes={"state": {0: "batch"}, "action": {0: "batch"}})
+        else: raise ValueError(f"Inference backend {backend} not recognised")
+
+
+class BatchedActor:
+    """
+    Inference wrapper around an exported actor.
+    act_batch() takes (B, *state_shape) states and returns (B, act_dim) actions; test_action() keeps the single state interface of the networks.
+    """
+    def __init__(self, path):
+        self.onnx = path.endswith(".onnx")
+        if self.onnx:
+            import onnxruntime as ort
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = 1
+            self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        else:
+            self.model = torch.jit.load(path)
+
+    def act_batch(self, states):
+        states = np.ascontiguousarray(states, dtype=np.float32)
+        if self.onnx:
+            return self.session.run(None, {"state": states})[0]
+        with torch.inference_mode():
+            return self.model(torch.from_numpy(states)).numpy()
+
+    def test_action(self, state):
+        return self.act_batch(state[None])[0]
+
+
+def load_inference_actor(directory, name, state_shape, backend="torch"):
+    """Loads the saved actor for testing, exporting it to the requested backend the first time"""
+    actor = torch.load(directory + f'{name}_actor.pth', weights_only=False) # the whole module is pickled, not a state dict
+    if backend == "torch":
+        return actor
+
+    path = directory + f'{name}_actor' + (".onnx" if backend == "onnx" else ".pt")
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(directory + f'{name}_actor.pth'):
+        export_actor(actor, state_shape, path, backend)
+    return BatchedActor(path)
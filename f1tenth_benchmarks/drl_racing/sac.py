@@ -1,6 +1,5 @@
 import numpy as np
 import torch
-import torch.nn as nn
 import torch.optim as optim
 
 torch.autograd.set_detect_anomaly(True)
@@ -12,7 +11,7 @@ BATCH_SIZE = 100
 LR = 1e-3
 
    
-from f1tenth_benchmarks.drl_racing.training_utils import DoubleQNet, PolicyNetworkSAC, OffPolicyBuffer
+from f1tenth_benchmarks.drl_racing.training_utils import DoubleQNet, PolicyNetworkSAC, create_replay_buffer, weighted_critic_loss
 
 
 def soft_update(net, net_target, tau):
@@ -21,8 +20,8 @@ def soft_update(net, net_target, tau):
        
 
 class TrainSAC:
-    def __init__(self, state_dim, action_dim):
-        self.replay_buffer = OffPolicyBuffer(state_dim, action_dim)
+    def __init__(self, state_dim, action_dim, prioritized=False):
+        self.replay_buffer = create_replay_buffer(state_dim, action_dim, prioritized)
 
         self.soft_q_net1 = DoubleQNet(state_dim, action_dim)
         self.soft_q_net2 = DoubleQNet(state_dim, action_dim)
@@ -33,7 +32,6 @@ class TrainSAC:
         
         self.actor = PolicyNetworkSAC(state_dim, action_dim)
         
-        self.soft_q_criterion = nn.MSELoss()
         self.q_optimiser = optim.Adam(list(self.soft_q_net1.parameters()) + list(self.soft_q_net2.parameters()), lr=LR)
         self.policy_optimizer = optim.Adam(self.actor.parameters(), lr=LR)
         
@@ -85,7 +83,7 @@ class TrainSAC:
             target_q_values = torch.min(target_q1, target_q2) - alpha * new_log_pi
 
             q_target = reward + done * GAMMA * target_q_values
-            q_loss = self.soft_q_criterion(current_q1, q_target.detach()) + self.soft_q_criterion(current_q2, q_target.detach())
+            q_loss = weighted_critic_loss(self.replay_buffer, current_q1, current_q2, q_target.detach())
             
             self.q_optimiser.zero_grad()
             q_loss.backward()
@@ -1,9 +1,8 @@
 import numpy as np
 import torch
-import torch.nn.functional as F
 
 from f1tenth_benchmarks.drl_racing.training_utils import DoublePolicyNet, DoubleQNet, TinyPolicyNet, TinyCriticNet
-from f1tenth_benchmarks.drl_racing.training_utils import DoubleQNet, PolicyNetworkSAC, OffPolicyBuffer, TinyPolicyBuffer
+from f1tenth_benchmarks.drl_racing.training_utils import DoubleQNet, PolicyNetworkSAC, create_replay_buffer, weighted_critic_loss
 
 
 # hyper parameters
@@ -23,7 +22,7 @@ def soft_update(net, net_target, tau):
        
 
 class TrainTD3:
-    def __init__(self, state_dim, action_dim):
+    def __init__(self, state_dim, action_dim, prioritized=False):
         self.act_dim = action_dim
         
         self.actor = DoublePolicyNet(state_dim, action_dim)
@@ -39,7 +38,7 @@ class TrainTD3:
         self.critic_target_2.load_state_dict(self.critic_2.state_dict())
         self.critic_optimizer = torch.optim.Adam(list(self.critic_1.parameters()) + list(self.critic_2.parameters()), lr=1e-3)
 
-        self.replay_buffer = OffPolicyBuffer(state_dim, action_dim)
+        self.replay_buffer = create_replay_buffer(state_dim, action_dim, prioritized)
 
     def act(self, state, noise=EXPLORE_NOISE):
         state = torch.FloatTensor(state.reshape(1, -1))
@@ -78,7 +77,7 @@ class TrainTD3:
         current_Q1 = self.critic_1(state, action)
         current_Q2 = self.critic_2(state, action)
 
-        critic_loss = F.mse_loss(current_Q1, target_Q) + F.mse_loss(current_Q2, target_Q) 
+        critic_loss = weighted_critic_loss(self.replay_buffer, current_Q1, current_Q2, target_Q)
 
         self.critic_optimizer.zero_grad()
         critic_loss.backward()
@@ -97,7 +96,7 @@ class TrainTD3:
 
 
 class TrainTinyTD3:
-    def __init__(self, state_dim, action_dim):
+    def __init__(self, state_dim, action_dim, prioritized=False):
         self.act_dim = action_dim
         
         self.actor = TinyPolicyNet(state_dim, action_dim)
@@ -113,7 +112,7 @@ class TrainTinyTD3:
         self.critic_target_2.load_state_dict(self.critic_2.state_dict())
         self.critic_optimizer = torch.optim.Adam(list(self.critic_1.parameters()) + list(self.critic_2.parameters()), lr=1e-3)
 
-        self.replay_buffer = TinyPolicyBuffer(state_dim, action_dim)
+        self.replay_buffer = create_replay_buffer(state_dim, action_dim, prioritized, tiny=True)
 
     def act(self, state, noise=EXPLORE_NOISE):
         # state = torch.FloatTensor(state.reshape(1, -1))
@@ -153,7 +152,7 @@ class TrainTinyTD3:
         current_Q1 = self.critic_1(state, action)
         current_Q2 = self.critic_2(state, action)
 
-        critic_loss = F.mse_loss(current_Q1, target_Q) + F.mse_loss(current_Q2, target_Q) 
+        critic_loss = weighted_critic_loss(self.replay_buffer, current_Q1, current_Q2, target_Q)
 
         self.critic_optimizer.zero_grad()
         critic_loss.backward()
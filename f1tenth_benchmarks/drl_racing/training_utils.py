@@ -2,6 +2,7 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from numba import njit
 
 # NN_LAYER_1 = 100
 # NN_LAYER_2 = 100
@@ -14,105 +15,201 @@ NN_LAYER_2 = 256
 MEMORY_SIZE = 100000
 
 class OffPolicyBuffer(object):
-    def __init__(self, state_dim, action_dim):     
+    """Ring buffer of float32 torch tensors, sampled with a single gather per field"""
+    def __init__(self, state_dim, action_dim, memory_size=MEMORY_SIZE, pin_memory=False):     
         self.state_dim = state_dim
         self.action_dim = action_dim
+        self.memory_size = memory_size
         self.ptr = 0
+        self.count = 0
+
+        state_shape = tuple(state_dim) if isinstance(state_dim, (tuple, list)) else (state_dim, )
+        self.states = torch.empty((memory_size, *state_shape), dtype=torch.float32)
+        self.actions = torch.empty((memory_size, action_dim), dtype=torch.float32)
+        self.next_states = torch.empty((memory_size, *state_shape), dtype=torch.float32)
+        self.rewards = torch.empty((memory_size, 1), dtype=torch.float32)
+        self.not_dones = torch.empty((memory_size, 1), dtype=torch.float32)
 
-        self.states = np.empty((MEMORY_SIZE, state_dim))
-        self.actions = np.empty((MEMORY_SIZE, action_dim))
-        self.next_states = np.empty((MEMORY_SIZE, state_dim))
-        self.rewards = np.empty((MEMORY_SIZE, 1))
-        self.dones = np.empty((MEMORY_SIZE, 1))
+        if pin_memory and torch.cuda.is_available():
+            self.states, self.actions, self.next_states = self.states.pin_memory(), self.actions.pin_memory(), self.next_states.pin_memory()
+            self.rewards, self.not_dones = self.rewards.pin_memory(), self.not_dones.pin_memory()
 
     def add(self, state, action, next_state, reward, done):
-        self.states[self.ptr] = state
-        self.actions[self.ptr] = action
-        self.next_states[self.ptr] = next_state
-        self.rewards[self.ptr] = reward
-        self.dones[self.ptr] = done
+        self.states[self.ptr] = torch.as_tensor(state, dtype=torch.float32)
+        self.actions[self.ptr] = torch.as_tensor(action, dtype=torch.float32)
+        self.next_states[self.ptr] = torch.as_tensor(next_state, dtype=torch.float32)
+        self.rewards[self.ptr, 0] = float(reward)
+        self.not_dones[self.ptr, 0] = 1.0 - float(done)
 
         self.ptr += 1
+        self.count = min(self.count + 1, self.memory_size)
         
-        if self.ptr == MEMORY_SIZE: self.ptr = 0
+        if self.ptr == self.memory_size: self.ptr = 0
+
+    def add_batch(self, states, actions, next_states, rewards, not_dones):
+        n = states.shape[0]
+        ind = (self.ptr + torch.arange(n)) % self.memory_size
+        self.states[ind] = states
+        self.actions[ind] = actions
+        self.next_states[ind] = next_states
+        self.rewards[ind] = rewards
+        self.not_dones[ind] = not_dones
+
+        self.ptr = (self.ptr + n) % self.memory_size
+        self.count = min(self.count + n, self.memory_size)
+
+        return ind
 
     def sample(self, batch_size):
-        ind = np.random.randint(0, self.ptr-1, size=batch_size)
-        states = np.empty((batch_size, self.state_dim))
-        actions = np.empty((batch_size, self.action_dim))
-        next_states = np.empty((batch_size, self.state_dim))
-        rewards = np.empty((batch_size, 1))
-        dones = np.empty((batch_size, 1))
-
-        for i, j in enumerate(ind): 
-            states[i] = self.states[j]
-            actions[i] = self.actions[j]
-            next_states[i] = self.next_states[j]
-            rewards[i] = self.rewards[j]
-            dones[i] = self.dones[j]
-            
-        states = torch.FloatTensor(states)
-        actions = torch.FloatTensor(actions)
-        next_states = torch.FloatTensor(next_states)
-        rewards = torch.FloatTensor(rewards)
-        dones = torch.FloatTensor(1- dones)
+        ind = torch.randint(0, self.count, (batch_size, ))
+
+        return self.gather(ind)
+
+    def gather(self, ind):
+        states = self.states[ind]
+        actions = self.actions[ind]
+        next_states = self.next_states[ind]
+        rewards = self.rewards[ind]
+        dones = self.not_dones[ind]
 
         return states, actions, next_states, rewards, dones
 
     def size(self):
-        return self.ptr
+        return self.count
+
+    def state_dict(self):
+        n = self.count
+        return {"ptr": self.ptr, "count": n, "states": self.states[:n].clone(), "actions": self.actions[:n].clone(), "next_states": self.next_states[:n].clone(), "rewards": self.rewards[:n].clone(), "not_dones": self.not_dones[:n].clone()}
+
+    def load_state_dict(self, state):
+        n = state["count"]
+        self.states[:n] = state["states"]
+        self.actions[:n] = state["actions"]
+        self.next_states[:n] = state["next_states"]
+        self.rewards[:n] = state["rewards"]
+        self.not_dones[:n] = state["not_dones"]
+        self.ptr, self.count = state["ptr"], n
     
 
-class TinyPolicyBuffer(object):
-    def __init__(self, state_dim, action_dim, memory_size=10000):
-        self.state_dim = state_dim
-        self.action_dim = action_dim
-        self.ptr = 0
-        self.memory_size = memory_size
-
-        self.states = np.empty((memory_size, *state_dim))
-        self.actions = np.empty((memory_size, action_dim))
-        self.next_states = np.empty((memory_size, *state_dim))
-        self.rewards = np.empty((memory_size, 1))
-        self.dones = np.empty((memory_size, 1))
+class TinyPolicyBuffer(OffPolicyBuffer):
+    def __init__(self, state_dim, action_dim, memory_size=10000, pin_memory=False):
+        super().__init__(state_dim, action_dim, memory_size, pin_memory)
+
+
+PER_ALPHA = 0.6
+PER_BETA = 0.4
+PER_BETA_STEPS = 16000 # samples over which beta is annealed linearly to 1, the default training_steps
+PER_EPSILON = 1e-6
+
+class PrioritizedOffPolicyBuffer(OffPolicyBuffer):
+    """
+    Proportional prioritized replay backed by a sum-tree.
+    sample() records the sampled indices and importance weights so that the agent can weight its loss and call update_priorities().
+    The importance sampling exponent beta grows linearly from beta to 1 over beta_steps samples, so the bias correction is complete by the end of training.
+    """
+    def __init__(self, state_dim, action_dim, memory_size=MEMORY_SIZE, pin_memory=False, alpha=PER_ALPHA, beta=PER_BETA, beta_steps=PER_BETA_STEPS):
+        super().__init__(state_dim, action_dim, memory_size, pin_memory)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = (1.0 - beta) / beta_steps
+        self.max_priority = 1.0
+
+        self.tree_capacity = 1
+        while self.tree_capacity < memory_size:
+            self.tree_capacity *= 2
+        self.tree = np.zeros(2 * self.tree_capacity)
+
+        self.sample_indices = None
+        self.sample_weights = None
 
     def add(self, state, action, next_state, reward, done):
-        self.states[self.ptr] = state
-        self.actions[self.ptr] = action
-        self.next_states[self.ptr] = next_state
-        self.rewards[self.ptr] = reward
-        self.dones[self.ptr] = done
+        sum_tree_update(self.tree, np.array([self.ptr]), np.array([self.max_priority ** self.alpha]), self.tree_capacity)
+        super().add(state, action, next_state, reward, done)
 
-        self.ptr += 1
-        
-        if self.ptr == self.memory_size:
-            self.ptr = 0
+    def add_batch(self, states, actions, next_states, rewards, not_dones):
+        ind = super().add_batch(states, actions, next_states, rewards, not_dones)
+        sum_tree_update(self.tree, ind.numpy(), np.full(len(ind), self.max_priority ** self.alpha), self.tree_capacity)
+        return ind
 
     def sample(self, batch_size):
-        ind = np.random.randint(0, self.ptr-1, size=batch_size)
-        states = np.empty((batch_size, *self.state_dim))
-        actions = np.empty((batch_size, self.action_dim))
-        next_states = np.empty((batch_size, *self.state_dim))
-        rewards = np.empty((batch_size, 1))
-        dones = np.empty((batch_size, 1))
-
-        for i, j in enumerate(ind): 
-            states[i] = self.states[j]
-            actions[i] = self.actions[j]
-            next_states[i] = self.next_states[j]
-            rewards[i] = self.rewards[j]
-            dones[i] = self.dones[j]
-            
-        states = torch.FloatTensor(states)
-        actions = torch.FloatTensor(actions)
-        next_states = torch.FloatTensor(next_states)
-        rewards = torch.FloatTensor(rewards)
-        dones = torch.FloatTensor(1 - dones)
-
-        return states, actions, next_states, rewards, dones
-
-    def size(self):
-        return self.ptr
+        total = self.tree[1]
+        segment = total / batch_size
+        values = (np.arange(batch_size) + np.random.random(batch_size)) * segment
+        ind = sum_tree_retrieve(self.tree, values, self.tree_capacity, self.count)
+
+        probs = np.maximum(self.tree[ind + self.tree_capacity] / total, 1e-12)
+        weights = (self.count * probs) ** (-self.beta)
+        weights = weights / weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+
+        self.sample_indices = ind
+        self.sample_weights = torch.as_tensor(weights[:, None], dtype=torch.float32)
+
+        return self.gather(torch.as_tensor(ind))
+
+    def state_dict(self):
+        state = super().state_dict()
+        state["tree"] = self.tree.copy()
+        state["max_priority"] = self.max_priority
+        state["beta"] = self.beta
+        return state
+
+    def load_state_dict(self, state):
+        super().load_state_dict(state)
+        self.tree[:] = state["tree"]
+        self.max_priority = state["max_priority"]
+        self.beta = state["beta"]
+
+    def update_priorities(self, td_errors):
+        priorities = np.abs(td_errors.reshape(-1)) + PER_EPSILON
+        self.max_priority = max(self.max_priority, priorities.max())
+        sum_tree_update(self.tree, self.sample_indices, priorities ** self.alpha, self.tree_capacity)
+
+
+def weighted_critic_loss(replay_buffer, current_Q1, current_Q2, target_Q):
+    """Critic loss of the twin Q networks, weighted by the importance weights of a prioritized buffer's last sample (whose priorities it updates)"""
+    weights = getattr(replay_buffer, "sample_weights", None)
+    if weights is None:
+        return F.mse_loss(current_Q1, target_Q) + F.mse_loss(current_Q2, target_Q) 
+
+    replay_buffer.update_priorities((current_Q1 - target_Q).detach().numpy())
+    return (weights * (current_Q1 - target_Q) ** 2).mean() + (weights * (current_Q2 - target_Q) ** 2).mean()
+
+
+@njit(cache=True)
+def sum_tree_update(tree, indices, priorities, capacity):
+    for k in range(indices.shape[0]):
+        node = indices[k] + capacity
+        change = priorities[k] - tree[node]
+        while node >= 1:
+            tree[node] += change
+            node //= 2
+
+
+@njit(cache=True)
+def sum_tree_retrieve(tree, values, capacity, count):
+    indices = np.empty(values.shape[0], dtype=np.int64)
+    for k in range(values.shape[0]):
+        value = values[k]
+        node = 1
+        while node < capacity:
+            left = 2 * node
+            if value <= tree[left]:
+                node = left
+            else:
+                value -= tree[left]
+                node = left + 1
+        indices[k] = min(node - capacity, count - 1)
+    return indices
+
+
+def create_replay_buffer(state_dim, action_dim, prioritized=False, tiny=False):
+    memory_size = 10000 if tiny else MEMORY_SIZE
+    if prioritized:
+        return PrioritizedOffPolicyBuffer(state_dim, action_dim, memory_size)
+    if tiny:
+        return TinyPolicyBuffer(state_dim, action_dim)
+    return OffPolicyBuffer(state_dim, action_dim)
    
 
 
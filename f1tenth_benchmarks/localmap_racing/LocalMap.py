@@ -4,6 +4,10 @@ import trajectory_planning_helpers as tph
 
 
 class LocalMap:
+    """
+    Geometry of one local track, computed once per scan: element lengths, s, heading, curvature and normal vectors.
+    The planners, LocalReference and local_opt_min_curv all read it from here instead of recomputing it.
+    """
     def __init__(self, track):
         self.track = track
         self.el_lengths = None
@@ -11,14 +15,17 @@ class LocalMap:
         self.kappa = None
         self.nvecs = None
         self.s_track = None
-
-        if len(self.track) > 3:
-            self.tck = interpolate.splprep([self.track[:, 0], self.track[:, 1]], k=3, s=0)[0]
-        else:
-            self.tck = None
+        self._tck = False
 
         self.calculate_length_heading_nvecs()
 
+    @property
+    def tck(self):
+        """The spline is only fitted if calculate_s needs it"""
+        if self._tck is False:
+            self._tck = interpolate.splprep([self.track[:, 0], self.track[:, 1]], k=3, s=0)[0] if len(self.track) > 3 else None
+        return self._tck
+
     def calculate_length_heading_nvecs(self):
         self.el_lengths = np.linalg.norm(np.diff(self.track[:, :2], axis=0), axis=1)
         self.s_track = np.insert(np.cumsum(self.el_lengths), 0, 0)
@@ -5,8 +5,10 @@ from scipy import interpolate
 import os
 
 from f1tenth_benchmarks.localmap_racing.LocalMapGenerator import LocalMapGenerator
+from f1tenth_benchmarks.localmap_racing.LocalMap import LocalMap
 from f1tenth_benchmarks.localmap_racing.local_opt_min_curv import local_opt_min_curv
 from f1tenth_benchmarks.utils.BasePlanner import BasePlanner
+from f1tenth_benchmarks.utils.velocity_profile import VelocityProfile
 
 
 class LocalMapPP(BasePlanner): 
@@ -14,6 +16,7 @@ class LocalMapPP(BasePlanner):
         super().__init__("LocalMapPP", test_id)
         self.local_map_generator = LocalMapGenerator(self.data_root_path, test_id, save_data)
         self.local_track = None
+        self.local_map = None
 
         self.use_raceline = raceline
         if self.use_raceline:
@@ -28,6 +31,7 @@ class LocalMapPP(BasePlanner):
                         [self.vehicle_params.max_speed, p.max_longitudinal_acc, p.max_lateral_acc]])
             self.ax_max_machine = np.array([[0, p.max_longitudinal_acc],
                                             [self.vehicle_params.max_speed, p.max_longitudinal_acc]])
+            self.velocity_profile = VelocityProfile(self.ggv, self.ax_max_machine, p.mu, p.max_speed)
 
     def plan(self, obs):
         self.local_track = self.local_map_generator.generate_line_local_map(np.copy(obs['scan']))
@@ -35,6 +39,7 @@ class LocalMapPP(BasePlanner):
         if len(self.local_track) < 4:
             self.step_counter += 1
             return np.zeros(2)
+        self.local_map = LocalMap(self.local_track)
 
         if self.use_raceline:
             self.generate_minimum_curvature_path()
@@ -54,8 +59,7 @@ class LocalMapPP(BasePlanner):
         current_progress = np.linalg.norm(self.local_track[0, 0:2])
         lookahead = self.planner_params.centre_lookahead_distance + current_progress
 
-        local_el = np.linalg.norm(np.diff(self.local_track[:, 0:2], axis=0), axis=1)
-        s_track = np.insert(np.cumsum(local_el), 0, 0)
+        s_track = self.local_map.s_track
         lookahead = min(lookahead, s_track[-1]) 
         lookahead_point = interp_2d_points(lookahead, s_track, self.local_track[:, 0:2])
 
@@ -71,23 +75,20 @@ class LocalMapPP(BasePlanner):
         track[:, 2:] -= self.planner_params.path_exclusion_width / 2
 
         try:
-            alpha, nvecs = local_opt_min_curv(track, self.planner_params.kappa_bound, 0, fix_s=True, fix_e=False)
+            alpha, nvecs = local_opt_min_curv(track, self.planner_params.kappa_bound, 0, fix_s=True, fix_e=False, local_map=self.local_map)
             # alpha, nvecs = local_opt_min_curv(track, local_map.nvecs, self.planner_params.kappa_bound, 0, print_debug=False, psi_s=local_map.psi[0], psi_e=local_map.psi[-1], fix_s=True, fix_e=False)
             self.raceline = track[:, :2] + np.expand_dims(alpha, 1) * nvecs
         except Exception as e:
             self.raceline = track[:, :2]
 
-        self.tck = interpolate.splprep([self.raceline[:, 0], self.raceline[:, 1]], k=3, s=0)[0]
+        self.raceline_map = LocalMap(self.raceline)
+        self.tck = self.raceline_map.tck
         
     def generate_max_speed_profile(self):
         max_speed = self.planner_params.max_speed
-        mu = self.planner_params.mu * np.ones_like(self.raceline[:, 0])
 
-        raceline_el_lengths = np.linalg.norm(np.diff(self.raceline, axis=0), axis=1)
-        self.s_raceline = np.insert(np.cumsum(raceline_el_lengths), 0, 0)
-        _, raceline_curvature = tph.calc_head_curv_num.calc_head_curv_num(self.raceline, raceline_el_lengths, False)
-
-        self.vs = tph.calc_vel_profile.calc_vel_profile(self.ax_max_machine, raceline_curvature, raceline_el_lengths, False, 0, self.vehicle_params.vehicle_mass, ggv=self.ggv, mu=mu, v_max=max_speed, v_start=max_speed, v_end=max_speed)
+        self.s_raceline = self.raceline_map.s_track
+        self.vs = self.velocity_profile.solve(self.raceline_map.kappa, self.raceline_map.el_lengths, v_start=max_speed, v_end=max_speed).copy()
 
     def calculate_zero_point_progress(self):
         n_pts = np.count_nonzero(self.s_raceline < 5) # search first 4 m
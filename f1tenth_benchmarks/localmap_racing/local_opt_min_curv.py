@@ -15,7 +15,8 @@ def local_opt_min_curv(reftrack: np.ndarray,
                 #  psi_s: float = None,
                 #  psi_e: float = None,
                  fix_s: bool = False,
-                 fix_e: bool = False) -> tuple:
+                 fix_e: bool = False,
+                 local_map=None) -> tuple:
     """
     author:
     Alexander Heilmeier
@@ -68,6 +69,9 @@ def local_opt_min_curv(reftrack: np.ndarray,
     :type fix_s:        bool
     :param fix_e:       determines if last point is fixed to reference line for unclosed tracks
     :type fix_e:        bool
+    :param local_map:   LocalMap of the same reference line, its heading and normal vectors are used instead of
+                        recomputing them (the widths may differ)
+    :type local_map:    LocalMap
 
     .. outputs::
     :return alpha_mincurv:  solution vector of the opt. problem containing the lateral shift in m for every point.
@@ -80,10 +84,12 @@ def local_opt_min_curv(reftrack: np.ndarray,
     # ------------------------------------------------------------------------------------------------------------------
     # PREPARATIONS -----------------------------------------------------------------------------------------------------
     # ------------------------------------------------------------------------------------------------------------------
-    el_lengths = np.linalg.norm(np.diff(reftrack[:, :2], axis=0), axis=1)
-    s_track = np.insert(np.cumsum(el_lengths), 0, 0)
-    psi, kappa = tph.calc_head_curv_num.calc_head_curv_num(reftrack, el_lengths, False)
-    normvectors = tph.calc_normal_vectors_ahead.calc_normal_vectors_ahead(psi)
+    if local_map is not None:
+        psi, normvectors = local_map.psi, local_map.nvecs
+    else:
+        el_lengths = np.linalg.norm(np.diff(reftrack[:, :2], axis=0), axis=1)
+        psi, kappa = tph.calc_head_curv_num.calc_head_curv_num(reftrack, el_lengths, False)
+        normvectors = tph.calc_normal_vectors_ahead.calc_normal_vectors_ahead(psi)
     psi_s = psi[0]
     psi_e = psi[-1]
 
@@ -1,99 +1,154 @@
 import numpy as np
+from numba import njit, prange
 from f1tenth_benchmarks.utils.BasePlanner import BasePlanner
 
+SCAN_TRIM = 135 # we won't use the LiDAR data from directly behind us
+
+
 class FollowTheGap(BasePlanner):
     def __init__(self, test_id):
         super().__init__("FollowTheGap", test_id)
         self.name = 'FollowTheGap'
+        self.proc_ranges = None
+        self.prefix = None
+        self.scan_beams = slice(SCAN_TRIM, -SCAN_TRIM)
 
     def plan(self, obs):
         scan = obs['scan']
-        proc_ranges = self.preprocess_lidar(scan)
-        # Find closest point to LiDAR
-        closest = proc_ranges.argmin()
-
-        # Eliminate all points inside 'bubble' (set them to zero)
-        min_index = closest - self.planner_params.bubble_radius
-        max_index = closest + self.planner_params.bubble_radius
-        if min_index < 0: min_index = 0
-        if max_index >= len(proc_ranges): max_index = len(proc_ranges) - 1
-        proc_ranges[min_index:max_index] = 0
-
-        # Find max length gap
-        gap_start, gap_end = self.find_max_gap(proc_ranges)
-
-        # Find the best point in the gap
-        best = self.find_best_point(gap_start, gap_end, proc_ranges)
-
-        # Publish Drive message
-        steering_angle = self.get_angle(best, len(proc_ranges))
-        if abs(steering_angle) > self.planner_params.straights_steering_angle:
-            speed = self.planner_params.corners_speed
-        elif abs(steering_angle) > self.planner_params.fast_steering_angle:
-            speed = self.planner_params.straights_speed
-        else:
-            speed = self.planner_params.fast_speed
-    
+        if self.proc_ranges is None or self.proc_ranges.shape != (len(scan) - 2 * SCAN_TRIM, ):
+            self.proc_ranges, self.prefix = allocate_ftg_buffers(len(scan))
+
+        p = self.planner_params
+        steering_angle, speed = follow_the_gap_kernel(scan, self.proc_ranges, self.prefix, p.preprocess_conv_size, p.max_lidar_dist, p.bubble_radius, p.best_point_conv_size, p.safe_threshold, p.max_steer, p.straights_steering_angle, p.fast_steering_angle, p.corners_speed, p.straights_speed, p.fast_speed)
+
         action = np.array([steering_angle, speed])
 
         return action
 
-    def preprocess_lidar(self, ranges):
-        """ Preprocess the LiDAR scan array. Expert implementation includes:
-            1.Setting each value to the mean over some window
-            2.Rejecting high values (eg. > 3m)
-        """
-        self.radians_per_elem = (2 * np.pi) / len(ranges)
-        # we won't use the LiDAR data from directly behind us
-        proc_ranges = np.array(ranges[135:-135])
-        # sets each value to the mean over a given window
-        proc_ranges = np.convolve(proc_ranges, np.ones(self.planner_params.preprocess_conv_size), 'same') / self.planner_params.preprocess_conv_size
-        proc_ranges = np.clip(proc_ranges, 0, self.planner_params.max_lidar_dist)
-        return proc_ranges
-
-    def find_max_gap(self, free_space_ranges):
-        """ Return the start index & end index of the max gap in free_space_ranges
-            free_space_ranges: list of LiDAR data which contains a 'bubble' of zeros
-        """
-        # mask the bubble
-        masked = np.ma.masked_where(free_space_ranges == 0, free_space_ranges)
-        # get a slice for each contigous sequence of non-bubble data
-        slices = np.ma.notmasked_contiguous(masked)
-        # print(slices)
-        # max_len = slices[-1].stop - slices[-1].start
-        # chosen_slice = slices[-1]
-        # I think we will only ever have a maximum of 2 slices but will handle an
-        # indefinitely sized list for portablility
-        for sl in slices[::-1]:
-            # print(sl)
-            sl_len = sl.stop - sl.start
-            if sl_len > self.planner_params.safe_threshold:
-                chosen_slice = sl
-                # print("Slice choosen")
-                return chosen_slice.start, chosen_slice.stop
-
-    def find_best_point(self, start_i, end_i, ranges):
-        """Start_i & end_i are start and end indices of max-gap range, respectively
-        Return index of best point in ranges
-        Naive: Choose the furthest point within ranges and go there
-        """
-        # do a sliding window average over the data in the max gap, this will
-        # help the car to avoid hitting corners
-        averaged_max_gap = np.convolve(ranges[start_i:end_i], np.ones(self.planner_params.best_point_conv_size),
-                                       'same') / self.planner_params.best_point_conv_size
-        return averaged_max_gap.argmax() + start_i
-
-    def get_angle(self, range_index, range_len):
-        """ Get the angle of a particular element in the lidar data and transform it into an appropriate steering angle
-        """
-        lidar_angle = (range_index - (range_len / 2)) * self.radians_per_elem
-        steering_angle = lidar_angle / 2
-        steering_angle = np.clip(steering_angle, -self.planner_params.max_steer, self.planner_params.max_steer)
-        return steering_angle
-    
-        
+    def plan_batch(self, scans, actions=None):
+        """Plans for many scans at once, scans is (B, n_beams). Buffers are reused between calls with the same shape."""
+        scans = np.ascontiguousarray(scans)
+        n_scans, n_beams = scans.shape
+        if self.proc_ranges is None or self.proc_ranges.shape != (n_scans, n_beams - 2 * SCAN_TRIM):
+            self.proc_ranges, self.prefix = allocate_ftg_buffers(n_beams, n_scans)
+        if actions is None:
+            actions = np.empty((n_scans, 2))
+
+        p = self.planner_params
+        follow_the_gap_batch(scans, self.proc_ranges, self.prefix, actions, p.preprocess_conv_size, p.max_lidar_dist, p.bubble_radius, p.best_point_conv_size, p.safe_threshold, p.max_steer, p.straights_steering_angle, p.fast_steering_angle, p.corners_speed, p.straights_speed, p.fast_speed)
+
+        return actions
+
+
+def allocate_ftg_buffers(n_beams, n_scans=None):
+    n_ranges = n_beams - 2 * SCAN_TRIM
+    if n_scans is None:
+        return np.empty(n_ranges), np.empty(n_ranges + 1)
+    return np.empty((n_scans, n_ranges)), np.empty((n_scans, n_ranges + 1))
+
+
+@njit(cache=True)
+def window_mean(prefix, n, i, conv_size):
+    """Matches np.convolve(x, np.ones(conv_size), 'same') / conv_size where x is stored as a prefix sum"""
+    out_len = max(n, conv_size)
+    offset = (min(n, conv_size) - 1) // 2
+    m = i + offset
+    lo = max(0, m - conv_size + 1)
+    hi = min(n - 1, m)
+    if i >= out_len or hi < lo:
+        return 0.0
+    return (prefix[hi + 1] - prefix[lo]) / conv_size
+
+
+@njit(cache=True)
+def follow_the_gap_kernel(scan, proc_ranges, prefix, conv_size, max_lidar_dist, bubble_radius, best_conv_size, safe_threshold, max_steer, straights_steering_angle, fast_steering_angle, corners_speed, straights_speed, fast_speed):
+    """
+    Single pass Follow-The-Gap: preprocessing, bubble zeroing, max gap search and best point smoothing.
+    Writes into the preallocated proc_ranges (n_beams - 270) and prefix (n_beams - 269) buffers.
+
+    Returns:
+        steering_angle, speed
+    """
+    n = proc_ranges.shape[0]
+
+    # smooth the ranges with a sliding window and clip
+    prefix[0] = 0.0
+    for i in range(n):
+        prefix[i + 1] = prefix[i] + scan[i + SCAN_TRIM]
+    closest = 0
+    for i in range(n):
+        r = window_mean(prefix, n, i, conv_size)
+        if r < 0: r = 0.0
+        elif r > max_lidar_dist: r = max_lidar_dist
+        proc_ranges[i] = r
+        if r < proc_ranges[closest]:
+            closest = i
+
+    # eliminate all points inside the bubble around the closest point
+    min_index = max(closest - bubble_radius, 0)
+    max_index = min(closest + bubble_radius, n - 1)
+    for i in range(min_index, max_index):
+        proc_ranges[i] = 0.0
+
+    # find the last contiguous non-zero gap longer than the threshold, otherwise the longest gap
+    gap_start, gap_end = -1, -1
+    longest_start, longest_end = 0, 0
+    i = n - 1
+    while i >= 0:
+        if proc_ranges[i] == 0:
+            i -= 1
+            continue
+        end = i + 1
+        while i >= 0 and proc_ranges[i] != 0:
+            i -= 1
+        start = i + 1
+        if end - start > safe_threshold:
+            gap_start, gap_end = start, end
+            break
+        if end - start > longest_end - longest_start:
+            longest_start, longest_end = start, end
+    if gap_start < 0:
+        gap_start, gap_end = longest_start, longest_end
+
+    # find the best point in the gap using a sliding window average over the gap
+    gap_len = gap_end - gap_start
+    prefix[0] = 0.0
+    for i in range(gap_len):
+        prefix[i + 1] = prefix[i] + proc_ranges[gap_start + i]
+    best = 0
+    best_val = -1.0
+    for i in range(max(gap_len, best_conv_size)):
+        v = window_mean(prefix, gap_len, i, best_conv_size)
+        if v > best_val:
+            best_val = v
+            best = i
+    best += gap_start
+
+    radians_per_elem = (2 * np.pi) / scan.shape[0]
+    lidar_angle = (best - (n / 2)) * radians_per_elem
+    steering_angle = min(max(lidar_angle / 2, -max_steer), max_steer)
+
+    if abs(steering_angle) > straights_steering_angle:
+        speed = corners_speed
+    elif abs(steering_angle) > fast_steering_angle:
+        speed = straights_speed
+    else:
+        speed = fast_speed
+
+    return steering_angle, speed
+
+
+@njit(cache=True, parallel=True)
+def follow_the_gap_batch(scans, proc_ranges, prefix, actions, conv_size, max_lidar_dist, bubble_radius, best_conv_size, safe_threshold, max_steer, straights_steering_angle, fast_steering_angle, corners_speed, straights_speed, fast_speed):
+    for b in prange(scans.shape[0]):
+        steer, speed = follow_the_gap_kernel(scans[b], proc_ranges[b], prefix[b], conv_size, max_lidar_dist, bubble_radius, best_conv_size, safe_threshold, max_steer, straights_steering_angle, fast_steering_angle, corners_speed, straights_speed, fast_speed)
+        actions[b, 0] = steer
+        actions[b, 1] = speed
+    return actions
+
+
 def main():
     pass
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
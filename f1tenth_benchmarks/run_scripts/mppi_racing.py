@@ -0,0 +1,29 @@
+from f1tenth_benchmarks.classic_racing.MPPI import MPPI
+
+from f1tenth_benchmarks.data_tools.plot_trajectory_analysis import plot_trajectory_analysis
+
+from f1tenth_benchmarks.run_scripts.run_functions import *
+
+
+def test_mppi_planning():
+    test_id = "planning_mppi"
+    map_name = "aut"
+    planner = MPPI(test_id, planner_name="GlobalPlanMPPI")
+    test_planning_single_map(planner, map_name, test_id)
+    # test_planning_all_maps(planner, test_id)
+
+    plot_trajectory_analysis(planner.name, test_id)
+
+def test_full_stack_mppi():
+    test_id = "full_stack_mppi"
+    map_name = "aut"
+    planner = MPPI(test_id, planner_name="FullStackMPPI")
+    test_full_stack_single_map(planner, map_name, test_id)
+
+    plot_trajectory_analysis(planner.name, test_id)
+
+
+
+if __name__ == "__main__":
+    test_mppi_planning()
+    test_full_stack_mppi()
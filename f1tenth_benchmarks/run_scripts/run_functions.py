@@ -1,23 +1,29 @@
 from f1tenth_benchmarks.simulator import F1TenthSim_TrueLocation, F1TenthSim
 from f1tenth_benchmarks.classic_racing.particle_filter import ParticleFilter
+from f1tenth_benchmarks.drl_racing.async_training import train_async
 import torch
 import numpy as np
 from pyglet.gl import GL_POINTS
 
 NUMBER_OF_LAPS = 1
 
-def simulate_laps(sim, planner, n_laps):
+def simulate_laps(sim, planner, n_laps, collect_dataset=False):
+    """With collect_dataset the (noisy) scans and actions of every step are returned, otherwise the lists stay empty and pose-only planners never ray cast"""
     n_laps = 10 # for collecting data
     lidar_dataset = []  # Initialize an empty list to store the lidar scans
     steering_angles = []  # Initialize an empty list to store the steering angles
     speeds = []  # Initialize an empty list to store the speeds
+    sim.scan_simulator.register_beams("planner", planner.scan_beams)
+    if collect_dataset:
+        sim.scan_simulator.register_beams("dataset", None) # the lidar dataset keeps the full scans
     
     for lap in range(n_laps):
         observation, done, init_pose = sim.reset()
         #print("Keys in observation:", observation.keys())
         while not done:
-            action = planner.plan(observation)
+            action = sim.plan(planner, observation)
             observation, done = sim.step(action)
+            if not collect_dataset: continue
             lidar_scan = observation['scan']  # Extract the lidar scan from the observation
             # Preprocessing
             noise = np.random.normal(0, 0.5, lidar_scan.shape)
@@ -31,11 +37,13 @@ def simulate_laps(sim, planner, n_laps):
     return lidar_dataset, steering_angles, speeds
 
 def simulate_localisation_laps(sim, planner, pf, n_laps):
+    sim.scan_simulator.register_beams("planner", planner.scan_beams)
+    sim.scan_simulator.register_beams("particle_filter", pf.scan_beams)
     for lap in range(n_laps):
         observation, done, init_pose = sim.reset()
         observation['pose'] = pf.init_pose(init_pose)
         while not done:
-            action = planner.plan(observation)
+            action = sim.plan(planner, observation)
             observation, done = sim.step(action)
             observation['pose'] = pf.localise(action, observation)
         pf.lap_complete()
@@ -43,14 +51,21 @@ def simulate_localisation_laps(sim, planner, pf, n_laps):
 
 def simulate_training_steps(planner, train_map, test_id, extra_params={}):
     sim = F1TenthSim_TrueLocation(train_map, planner.name, test_id, False, True, extra_params=extra_params)
+    sim.scan_simulator.register_beams("planner", planner.scan_beams)
     observation, done, init_pose = sim.reset()
     
-    for i in range(planner.planner_params.training_steps):
-        action = planner.plan(observation)
+    for i in range(planner.step_counter, planner.planner_params.training_steps): # step_counter is restored when resuming
+        action = sim.plan(planner, observation)
         observation, done = sim.step(action)
         if done:
             planner.done_callback(observation)
             observation, done, init_pose = sim.reset()
+    planner.finish_training()
+
+
+def simulate_training_steps_async(planner, train_map, test_id, extra_params={}, n_workers=2, utd_ratio=1.0, weight_sync_interval=20):
+    """Trains with n_workers simulator processes feeding a learner in this process, at utd_ratio agent updates per environment step"""
+    train_async(planner, train_map, test_id, extra_params, n_workers, utd_ratio, weight_sync_interval)
 
 
 #map_list = ["example", "MoscowRaceway", "Austin", "YasMarina", "Spielberg", "Oschersleben"]
@@ -60,16 +75,18 @@ map_list = ["example", "MoscowRaceway", "Austin", "Spielberg"]#, "esp"]
 # map_list = ["example"]
 # map_list = ["aut", "esp", "gbr", 'mco']
 
-def test_planning_all_maps(planner, test_id, extra_params={}, number_of_laps=NUMBER_OF_LAPS):
+def test_planning_all_maps(planner, test_id, extra_params={}, number_of_laps=NUMBER_OF_LAPS, collect_dataset=False):
     lidar_dataset_all_maps = []  # Initialize an empty list to store lidar datasets from all maps
     steering_angles_all_maps = []  # Initialize an empty list to store steering angles from all maps
     speeds_all_maps = []  # Initialize an empty list to store speeds from all maps
     for map_name in map_list:
-        lidar_data_single_map, steering_angles_single_map, speeds_single_map = test_planning_single_map(planner, map_name, test_id, extra_params=extra_params, number_of_laps=number_of_laps)
-        if map_name in ["Spielberg"]:
+        lidar_data_single_map, steering_angles_single_map, speeds_single_map = test_planning_single_map(planner, map_name, test_id, extra_params=extra_params, number_of_laps=number_of_laps, collect_dataset=collect_dataset)
+        if map_name in ["Spielberg"] and collect_dataset:
             lidar_dataset_all_maps.extend(lidar_data_single_map)  # Extend the list with lidar data from the current map
             steering_angles_all_maps.extend(steering_angles_single_map)  # Extend the list with steering angles from the current map
             speeds_all_maps.extend(speeds_single_map)  # Extend the list with speeds from the current map
+    if not collect_dataset:
+        return
     
     # Convert the lists to numpy arrays
     lidar_dataset_all_maps = np.array(lidar_dataset_all_maps)
@@ -83,11 +100,11 @@ def test_planning_all_maps(planner, test_id, extra_params={}, number_of_laps=NUM
     print('Simulated Data Saved')
 
 
-def test_planning_single_map(planner, map_name, test_id, extra_params={}, number_of_laps=NUMBER_OF_LAPS):
+def test_planning_single_map(planner, map_name, test_id, extra_params={}, number_of_laps=NUMBER_OF_LAPS, collect_dataset=False):
     print(f"Testing on {map_name}...")
     simulator = F1TenthSim_TrueLocation(map_name, planner.name, test_id, extra_params=extra_params)
     planner.set_map(map_name)
-    lidar_data, steering_angles, speeds = simulate_laps(simulator, planner, number_of_laps)
+    lidar_data, steering_angles, speeds = simulate_laps(simulator, planner, number_of_laps, collect_dataset)
     
     # Convert the lists to numpy arrays
     lidar_data_np = np.array(lidar_data)
@@ -118,12 +135,12 @@ def test_full_stack_single_map(planner, map_name, test_id, extra_params={}, numb
 
 
 
-def test_mapless_all_maps(planner, test_id, extra_params={}, number_of_laps=NUMBER_OF_LAPS):
+def test_mapless_all_maps(planner, test_id, extra_params={}, number_of_laps=NUMBER_OF_LAPS, collect_dataset=False):
     lidar_dataset_all_maps = []  # Initialize an empty list to store lidar datasets from all maps
     steering_angles_all_maps = []  # Initialize an empty list to store steering angles from all maps
     speeds_all_maps = []  # Initialize an empty list to store speeds from all maps
     for map_name in map_list:
-        lidar_data_single_map, steering_angles_single_map, speeds_single_map = test_mapless_single_map(planner, map_name, test_id, extra_params=extra_params, number_of_laps=number_of_laps)
+        lidar_data_single_map, steering_angles_single_map, speeds_single_map = test_mapless_single_map(planner, map_name, test_id, extra_params=extra_params, number_of_laps=number_of_laps, collect_dataset=collect_dataset)
         lidar_dataset_all_maps.extend(lidar_data_single_map)  # Extend the list with lidar data from the current map
         steering_angles_all_maps.extend(steering_angles_single_map)  # Extend the list with steering angles from the current map
         speeds_all_maps.extend(speeds_single_map)  # Extend the list with speeds from the current map
@@ -137,10 +154,10 @@ def test_mapless_all_maps(planner, test_id, extra_params={}, number_of_laps=NUMB
     # print("Shape of the steering_angles_all_maps dataset:", steering_angles_all_maps.shape)
     # print("Shape of the speeds_all_maps dataset:", speeds_all_maps.shape)
 
-def test_mapless_single_map(planner, map_name, test_id, extra_params={}, number_of_laps=NUMBER_OF_LAPS):
+def test_mapless_single_map(planner, map_name, test_id, extra_params={}, number_of_laps=NUMBER_OF_LAPS, collect_dataset=False):
     print(f"Testing on {map_name}...")
     simulator = F1TenthSim(map_name, planner.name, test_id, extra_params=extra_params)
-    lidar_data, steering_angles, speeds = simulate_laps(simulator, planner, number_of_laps)
+    lidar_data, steering_angles, speeds = simulate_laps(simulator, planner, number_of_laps, collect_dataset)
     
     # Convert the lists to numpy arrays
     lidar_data_np = np.array(lidar_data)
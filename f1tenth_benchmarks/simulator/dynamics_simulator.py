@@ -99,6 +99,14 @@ class DynamicsSimulator:
 
         return self.state
 
+    def get_state(self):
+        return (self.state.copy(), self.steer_buffer.copy(), self.accel, self.steer_angle_vel)
+
+    def set_state(self, dynamics_state):
+        state, steer_buffer, self.accel, self.steer_angle_vel = dynamics_state
+        self.state = state.copy()
+        self.steer_buffer = steer_buffer.copy()
+
     def reset(self, pose):
         # clear control inputs
         self.accel = 0.0
@@ -2,7 +2,7 @@
 
 from f1tenth_benchmarks.simulator.dynamics_simulator import DynamicsSimulator
 from f1tenth_benchmarks.simulator.laser_models import ScanSimulator2D
-from f1tenth_benchmarks.simulator.utils import SimulatorHistory
+from f1tenth_benchmarks.simulator.utils import SimulatorHistory, LazyObservation, LazyValue
 from f1tenth_benchmarks.utils.track_utils import CentreLine
 from f1tenth_benchmarks.utils.BasePlanner import load_parameter_file, load_parameter_file_with_extras, ensure_path_exists
 import numpy as np
@@ -24,6 +24,33 @@ VIDEO_H = 400
 WINDOW_W = 1000
 WINDOW_H = 800
 
+class SimState:
+    """
+    Compact copy of everything that changes while the simulator runs. The maps, centre line and parameters are not copied.
+    Logged lists (progresses, history, lap history) are only recorded by length and truncated on restore.
+    Files written when a lap ends cannot be undone, so rollouts from a snapshot should call step(action, record=False).
+    """
+    def __init__(self, sim):
+        self.dynamics = sim.dynamics_simulator.get_state()
+        self.current_time = sim.current_time
+        self.lap_progress = sim.lap_progress
+        self.centre_line_progress = sim.centre_line_progress
+        self.halfway_crossed = sim.halfway_crossed
+        self.lap_number = sim.lap_number
+        self.starting_progress = sim.starting_progress
+        self.total_steps = sim.total_steps
+        self.flags = (getattr(sim, "collision", False), getattr(sim, "lap_complete", False), getattr(sim, "timeout", False))
+        self.lazy_scan = sim.lazy_scan
+        self.scan_rng_state = sim.scan_simulator.scan_rng.bit_generator.state
+        self.random_start_rng_state = sim.random_start_rng.bit_generator.state
+        self.n_progresses = len(sim.progresses)
+        self.n_laps = len(sim.lap_history)
+        self.history = None
+        if sim.history is not None:
+            self.history = (sim.history.lap_n, len(sim.history.states), len(sim.history.actions), len(sim.history.scans), len(sim.history.progresses))
+        self.latency = (sim.compute_time, list(sim.pending_actions), sim.applied_action.copy(), len(sim.compute_times), sim.deadline_misses)
+
+
 class F1TenthSimBase:
     renderer = None
     render_callbacks = []
@@ -37,7 +64,10 @@ class F1TenthSimBase:
         self.test_id = test_id
         self.training = training
 
-        self.scan_simulator = ScanSimulator2D(self.params.num_beams, self.params.fov, map_name, self.params.random_seed)
+        self.scan_simulator = ScanSimulator2D(self.params.num_beams, self.params.fov, map_name, self.params.random_seed, ray_caster=self.params.ray_caster)
+        self.scan_simulator.set_footprint(self.params.vehicle_length, self.params.vehicle_width)
+        if save_detail_history and self.params.save_scan_history:
+            self.scan_simulator.register_beams("history", None)
         self.dynamics_simulator = DynamicsSimulator(self.params)
         self.centre_line = CentreLine(map_name)
 
@@ -58,6 +88,14 @@ class F1TenthSimBase:
             self.history = SimulatorHistory(self.path, test_id, self.params.save_scan_history)
             self.history.set_map_name(map_name)
             
+        # latency mode: an action only reaches the vehicle once the planner's (scaled) compute time has passed in simulated time
+        self.compute_time = None
+        self.pending_actions = [] # (activation time, action) in the order they were issued
+        self.applied_action = np.zeros(2)
+        self.compute_times = []
+        self.deadline_misses = 0
+        self.planner_warmed_up = False # the first plan() call compiles the planner's numba functions and is not timed
+
         self.pr = cProfile.Profile()
         self.pr.enable()
 
@@ -85,13 +123,26 @@ class F1TenthSimBase:
         if self.history and len(self.history.states) > 1:
             self.history.save_history()
 
-    def step(self, action):
-        if self.history is not None:
-            self.history.add_memory_entry(self.current_state, action, self.scan, self.lap_progress)
+    def step(self, action, record=True):
+        """With record=False nothing is logged or saved, e.g. for rollouts that are undone with restore()"""
+        if self.history is not None and record:
+            scan = self.scan if self.history.save_scan else None # logging without scans does not force the ray cast
+            self.history.add_memory_entry(self.current_state, action, scan, self.lap_progress)
+
+        if self.params.simulate_compute_latency and self.compute_time is not None:
+            delay = self.compute_time * self.params.compute_time_scale
+            self.pending_actions.append((self.current_time + delay, np.array(action)))
+            if delay > self.params.timestep * self.params.n_sim_steps:
+                self.deadline_misses += 1
+            self.compute_time = None
+        else:
+            self.pending_actions = []
+            self.applied_action = np.array(action)
 
         mini_i = self.params.n_sim_steps
         while mini_i > 0:
-            self.current_state = self.dynamics_simulator.update_pose(action[0], action[1])
+            self.activate_pending_action()
+            self.current_state = self.dynamics_simulator.update_pose(self.applied_action[0], self.applied_action[1])
             self.current_time = self.current_time + self.params.timestep
             mini_i -= 1
         
@@ -103,8 +154,11 @@ class F1TenthSimBase:
         self.total_steps += 1
         
         done = self.collision or self.lap_complete or self.timeout
-        if done:
-            self.lap_history.append({"Lap": self.lap_number, "TestMap": self.map_name, "TestID": self.test_id, "Progress": self.lap_progress, "Time": self.current_time, "Steps": self.total_steps, "RecordTime": datetime.datetime.now(), "Planner": self.planner_name, "EntryID": f"{self.map_name}_{self.test_id}_{self.lap_number}", "Collision": self.collision, "LapComplete": self.lap_complete, "StartingProgress": self.starting_progress})
+        if done and record:
+            lap_entry = {"Lap": self.lap_number, "TestMap": self.map_name, "TestID": self.test_id, "Progress": self.lap_progress, "Time": self.current_time, "Steps": self.total_steps, "RecordTime": datetime.datetime.now(), "Planner": self.planner_name, "EntryID": f"{self.map_name}_{self.test_id}_{self.lap_number}", "Collision": self.collision, "LapComplete": self.lap_complete, "StartingProgress": self.starting_progress}
+            if self.params.simulate_compute_latency:
+                lap_entry.update({"DeadlineMisses": self.deadline_misses, "MeanComputeTime": np.mean(self.compute_times) if self.compute_times else 0, "MaxComputeTime": np.max(self.compute_times) if self.compute_times else 0})
+            self.lap_history.append(lap_entry)
             self.save_data_frame()
             if self.history is not None: self.history.save_history()
 
@@ -117,9 +171,45 @@ class F1TenthSimBase:
 
         return observation, done
 
+    def plan(self, planner, observation):
+        """
+        Calls planner.plan and records how long it took. In latency mode the next step() holds the previous action for
+        compute_time_scale times that long (scaled to the target hardware) before applying the new one.
+        The first call warms up the JIT and is applied without delay.
+        """
+        if not self.params.simulate_compute_latency:
+            return planner.plan(observation)
+        if not self.planner_warmed_up:
+            self.planner_warmed_up = True
+            return planner.plan(observation)
+
+        if planner.scan_beams is None or len(np.arange(self.params.num_beams)[planner.scan_beams]) > 0:
+            self.scan # the ray casting is the simulator's cost, not the planner's
+        start = time.perf_counter()
+        action = planner.plan(observation)
+        self.compute_time = time.perf_counter() - start
+        self.compute_times.append(self.compute_time * self.params.compute_time_scale)
+        return action
+
+    def activate_pending_action(self):
+        """Applies the most recently issued action whose compute time has elapsed, older pending actions are superseded by it"""
+        for i in range(len(self.pending_actions) - 1, -1, -1):
+            if self.pending_actions[i][0] <= self.current_time:
+                self.applied_action = self.pending_actions[i][1]
+                del self.pending_actions[:i + 1]
+                return
+
     def build_observation(self, pose):
         raise NotImplementedError("The build_observation method has not been implemented")
 
+    def set_scan_pose(self, pose):
+        """The scan at this pose is only ray cast (and the noise drawn) when it is first read"""
+        self.lazy_scan = LazyValue(lambda: self.scan_simulator.scan(pose))
+
+    @property
+    def scan(self):
+        return self.lazy_scan()
+
     def check_lap_complete(self, pose):
         self.centre_line_progress = self.centre_line.calculate_progress_percent(pose)
         if self.centre_line_progress > self.starting_progress:
@@ -145,21 +235,40 @@ class F1TenthSimBase:
         return done    
     
     def check_vehicle_collision(self, pose):
-        rotation_mtx = np.array([[np.cos(pose[2]), -np.sin(pose[2])], [np.sin(pose[2]), np.cos(pose[2])]])
-
-        pts = np.array([[self.params.vehicle_length/2, self.params.vehicle_width/2], 
-                        [self.params.vehicle_length/2, -self.params.vehicle_width/2], 
-                        [-self.params.vehicle_length/2, self.params.vehicle_width/2], 
-                        [-self.params.vehicle_length/2, -self.params.vehicle_width/2]])
-        pts = np.matmul(pts, rotation_mtx.T) + pose[0:2]
-
-        for i in range(4):
-            if self.scan_simulator.check_location(pts[i, :]):
-                return True
-
-        return False
+        return self.scan_simulator.check_footprint(pose)
     
 
+    def snapshot(self):
+        """Returns a SimState that restore() can return to any number of times, e.g. to branch rollouts from the current state"""
+        return SimState(self)
+
+    def restore(self, sim_state):
+        self.dynamics_simulator.set_state(sim_state.dynamics)
+        self.current_state = self.dynamics_simulator.state
+        self.current_time = sim_state.current_time
+        self.lap_progress = sim_state.lap_progress
+        self.centre_line_progress = sim_state.centre_line_progress
+        self.halfway_crossed = sim_state.halfway_crossed
+        self.lap_number = sim_state.lap_number
+        self.starting_progress = sim_state.starting_progress
+        self.total_steps = sim_state.total_steps
+        self.collision, self.lap_complete, self.timeout = sim_state.flags
+        self.lazy_scan = sim_state.lazy_scan
+        self.compute_time, pending_actions, applied_action, n_compute_times, self.deadline_misses = sim_state.latency
+        self.pending_actions = list(pending_actions)
+        self.applied_action = applied_action.copy()
+        del self.compute_times[n_compute_times:]
+        self.scan_simulator.scan_rng.bit_generator.state = sim_state.scan_rng_state
+        self.random_start_rng.bit_generator.state = sim_state.random_start_rng_state
+        del self.progresses[sim_state.n_progresses:]
+        del self.lap_history[sim_state.n_laps:]
+        if self.history is not None:
+            self.history.lap_n, n_states, n_actions, n_scans, n_progresses = sim_state.history
+            del self.history.states[n_states:]
+            del self.history.actions[n_actions:]
+            del self.history.scans[n_scans:]
+            del self.history.progresses[n_progresses:]
+
     def reset(self):
         # if self.params.use_random_starts and self.lap_number > -1:
         #     self.starting_progress = self.random_start_rng.random()
@@ -183,6 +292,9 @@ class F1TenthSimBase:
 
         self.current_state = self.dynamics_simulator.reset(start_pose)
         self.current_time = 0.0
+        self.compute_time = None
+        self.compute_times = []
+        self.deadline_misses = 0
         action = np.zeros(2)
         obs, done = self.step(action)
         self.lap_progress = 0
@@ -222,27 +334,27 @@ class F1TenthSim(F1TenthSimBase):
     def __init__(self, map_name, planner_name, test_id, save_detail_history=True, training=False, extra_params={}):
         super().__init__(map_name, planner_name, test_id, save_detail_history, training, extra_params=extra_params)
         init_pose = np.append(self.current_state[0:2], self.current_state[4])
-        self.scan = self.scan_simulator.scan(init_pose)
+        self.set_scan_pose(init_pose)
  
     def build_observation(self, pose):
-        self.scan = self.scan_simulator.scan(pose)
-        observation = {"scan": self.scan,
+        self.set_scan_pose(pose)
+        observation = LazyObservation({
                 "vehicle_speed": self.dynamics_simulator.state[3],
                 "collision": self.collision,
                 "lap_complete": self.lap_complete,
                 "timeout": self.timeout,
-                "laptime": self.current_time}
+                "laptime": self.current_time}, {"scan": self.lazy_scan})
         return observation
 
 class F1TenthSim_TrueLocation(F1TenthSimBase):
     def __init__(self, map_name, planner_name, test_id, save_detail_history=True, training=False, extra_params={}):
         super().__init__(map_name, planner_name, test_id, save_detail_history, training, extra_params=extra_params)
         init_pose = np.append(self.current_state[0:2], self.current_state[4])
-        self.scan = self.scan_simulator.scan(init_pose)
+        self.set_scan_pose(init_pose)
     
     def build_observation(self, pose):
-        self.scan = self.scan_simulator.scan(pose)
-        observation = {"scan": self.scan,
+        self.set_scan_pose(pose)
+        observation = LazyObservation({
                 "vehicle_state": self.dynamics_simulator.state,
                 "pose": np.append(self.current_state[0:2], self.current_state[4]),
                 "vehicle_speed": self.dynamics_simulator.state[3],
@@ -251,6 +363,6 @@ class F1TenthSim_TrueLocation(F1TenthSimBase):
                 "timeout": self.timeout,
                 "laptime": self.current_time,
                 "progress": self.lap_progress,
-                "centre_line_progress": self.centre_line_progress}
+                "centre_line_progress": self.centre_line_progress}, {"scan": self.lazy_scan})
         return observation
 
@@ -28,12 +28,18 @@ Author: Hongrui Zheng
 """
 
 import numpy as np
-from numba import njit
+from numba import njit, prange
 from scipy.ndimage import distance_transform_edt as edt
 from PIL import Image
 import os
 import yaml
 
+from f1tenth_benchmarks.simulator.segment_ray_caster import SegmentMap
+from f1tenth_benchmarks.utils.map_assets import shared_array, file_key
+
+N_FOOTPRINT_DISKS = 3
+MAP_DIRECTORY = "/home/m810z573/Downloads/f1tenth_benchmarks/maps/"
+
 
 def get_dt(bitmap, resolution):
     """
@@ -50,6 +56,31 @@ def get_dt(bitmap, resolution):
     dt = resolution * edt(bitmap)
     return dt
 
+def load_binary_map(map_img_path):
+    """Map image as float64 with obstacles 0 and free space 255"""
+    map_img = np.array(Image.open(map_img_path).convert('L').transpose(Image.FLIP_TOP_BOTTOM))
+    map_img = map_img.astype(np.float64)
+
+    # grayscale -> binary
+    map_img[map_img <= 128.] = 0.
+    map_img[map_img > 128.] = 255.
+    return map_img
+
+def load_map_assets(map_name, directory=MAP_DIRECTORY):
+    """
+    Binary image, distance transform, origin and resolution of a map from its yaml.
+    The image and distance transform are shared read-only assets, so every user of the map (simulator, planners) attaches to the same files.
+    """
+    with open(directory + map_name + ".yaml", 'r') as yaml_stream:
+        map_metadata = yaml.safe_load(yaml_stream)
+    resolution = map_metadata['resolution']
+    map_img_path = directory + map_metadata['image']
+
+    key = file_key(map_img_path, resolution)
+    map_img = shared_array(f"{map_name}_map_img", key, lambda: load_binary_map(map_img_path))
+    dt = shared_array(f"{map_name}_dt", key, lambda: get_dt(map_img, resolution))
+    return map_img, dt, map_metadata['origin'], resolution
+
 @njit(cache=True)
 def xy_2_rc(x, y, orig_x, orig_y, orig_c, orig_s, height, width, resolution):
     """
@@ -183,6 +214,29 @@ def get_scan(pose, theta_dis, fov, num_beams, theta_index_increment, sines, cosi
 
     return scan
 
+@njit(cache=True)
+def get_scan_subset(pose, beam_mask, theta_dis, fov, num_beams, theta_index_increment, sines, cosines, eps, orig_x, orig_y, orig_c, orig_s, height, width, resolution, dt, max_range):
+    """
+    Same as get_scan but only traces the beams where beam_mask is True, the others are NaN.
+    The beam angles are stepped exactly as in get_scan so the traced beams match a full scan.
+    """
+    scan = np.full((num_beams,), np.nan)
+
+    theta_index = theta_dis * (pose[2] - fov/2.)/(2. * np.pi)
+    theta_index = np.fmod(theta_index, theta_dis)
+    while (theta_index < 0):
+        theta_index += theta_dis
+
+    for i in range(0, num_beams):
+        if beam_mask[i]:
+            scan[i] = trace_ray(pose[0], pose[1], theta_index, sines, cosines, eps, orig_x, orig_y, orig_c, orig_s, height, width, resolution, dt, max_range)
+
+        theta_index += theta_index_increment
+        while theta_index >= theta_dis:
+            theta_index -= theta_dis
+
+    return scan
+
 @njit(cache=True, error_model='numpy')
 def check_ttc_jit(scan, vel, scan_angles, cosines, side_distances, ttc_thresh):
     """
@@ -353,9 +407,10 @@ class ScanSimulator2D(object):
         eps (float, default=0.0001): ray tracing iteration termination condition
         theta_dis (int, default=2000): number of steps to discretize the angles between 0 and 2pi for look up
         max_range (float, default=30.0): maximum range of the laser
+        ray_caster (str, default="edt"): "edt" sphere traces the distance transform, "segments" casts exact rays against the wall segments
     """
 
-    def __init__(self, num_beams, fov, map_name, random_seed, eps=0.0001, theta_dis=2000, max_range=30.0):
+    def __init__(self, num_beams, fov, map_name, random_seed, eps=0.0001, theta_dis=2000, max_range=30.0, ray_caster="edt"):
         # initialization 
         self.num_beams = num_beams
         self.fov = fov
@@ -373,6 +428,12 @@ class ScanSimulator2D(object):
         self.map_resolution = None
         self.dt = None
         self.scan_rng = np.random.default_rng(seed=random_seed)
+        self.beam_requests = {}
+        self.beam_mask = None # None traces every beam
+        self.footprint = None
+        self.ray_caster = ray_caster
+        self.segment_map = None
+        self.full_beam_mask = np.ones(num_beams, dtype=np.bool_)
         
         # precomputing corresponding cosines and sines of the angle array
         theta_arr = np.linspace(0.0, 2*np.pi, num=theta_dis)
@@ -381,24 +442,7 @@ class ScanSimulator2D(object):
         self.set_map(map_name)
     
     def set_map(self, map_name):
-        map_path = "/home/m810z573/Downloads/f1tenth_benchmarks/maps/" + map_name + ".yaml"
-        
-        with open(map_path, 'r') as yaml_stream:
-            try:
-                map_metadata = yaml.safe_load(yaml_stream)
-                self.map_resolution = map_metadata['resolution']
-                self.origin = map_metadata['origin']
-                map_img_path = "/home/m810z573/Downloads/f1tenth_benchmarks/maps/" + map_metadata['image']
-            except yaml.YAMLError as ex:
-                print(ex)
-
-        # load map image
-        self.map_img = np.array(Image.open(map_img_path).convert('L').transpose(Image.FLIP_TOP_BOTTOM))
-        self.map_img = self.map_img.astype(np.float64)
-
-        # grayscale -> binary
-        self.map_img[self.map_img <= 128.] = 0.
-        self.map_img[self.map_img > 128.] = 255.
+        self.map_img, self.dt, self.origin, self.map_resolution = load_map_assets(map_name)
 
         self.map_height = self.map_img.shape[0]
         self.map_width = self.map_img.shape[1]
@@ -409,11 +453,49 @@ class ScanSimulator2D(object):
         self.orig_s = np.sin(self.origin[2])
         self.orig_c = np.cos(self.origin[2])
 
-        # get the distance transform
-        self.dt = get_dt(self.map_img, self.map_resolution)
+        if self.ray_caster == "segments":
+            self.segment_map = SegmentMap(self.map_img, self.map_resolution, self.origin)
+        elif self.ray_caster != "edt": raise ValueError(f"Ray caster {self.ray_caster} not recognised")
+        if self.footprint is not None:
+            self.set_footprint(*self.footprint)
 
         return True
 
+    def set_footprint(self, length, width, n_disks=N_FOOTPRINT_DISKS):
+        """
+        Precomputes the vehicle footprint for check_footprint: n_disks disks along the chassis that cover it, and points along its outline spaced at the map resolution.
+        """
+        self.footprint = (length, width, n_disks)
+        self.disk_offsets = -length/2 + length/(2*n_disks) + np.arange(n_disks) * length/n_disks
+        self.disk_radius = np.hypot(length/(2*n_disks), width/2) + self.map_resolution # margin for the cell lookup
+
+        corners = np.array([[length/2, width/2], [-length/2, width/2], [-length/2, -width/2], [length/2, -width/2], [length/2, width/2]])
+        outline = []
+        for i in range(4):
+            n_pts = max(int(np.ceil(np.linalg.norm(corners[i+1] - corners[i]) / self.map_resolution)), 1)
+            outline.append(np.linspace(corners[i], corners[i+1], n_pts, endpoint=False))
+        self.footprint_outline = np.concatenate(outline)
+
+    def register_beams(self, consumer, beams=None):
+        """
+        Registers the beams a consumer reads from the scan: an index array or slice (e.g. slice(None, None, 24)), or None for the full scan.
+        Only the union of the registered beams is traced, the rest of the scan is NaN. With no registrations every beam is traced.
+        """
+        self.beam_requests[consumer] = beams
+        self.update_beam_mask()
+
+    def unregister_beams(self, consumer):
+        self.beam_requests.pop(consumer, None)
+        self.update_beam_mask()
+
+    def update_beam_mask(self):
+        if len(self.beam_requests) == 0 or any(beams is None for beams in self.beam_requests.values()):
+            self.beam_mask = None
+            return
+        self.beam_mask = np.zeros(self.num_beams, dtype=np.bool_)
+        for beams in self.beam_requests.values():
+            self.beam_mask[beams] = True
+
     def scan(self, pose, std_dev=0.01):
         """
         Perform simulated 2D scan by pose on the given map
@@ -433,7 +515,13 @@ class ScanSimulator2D(object):
         if self.map_height is None:
             raise ValueError('Map is not set for scan simulator.')
         
-        scan = get_scan(pose, self.theta_dis, self.fov, self.num_beams, self.theta_index_increment, self.sines, self.cosines, self.eps, self.orig_x, self.orig_y, self.orig_c, self.orig_s, self.map_height, self.map_width, self.map_resolution, self.dt, self.max_range)
+        if self.segment_map is not None:
+            beam_mask = self.full_beam_mask if self.beam_mask is None else self.beam_mask
+            scan = self.segment_map.scan(pose, beam_mask, self.fov, self.angle_increment, self.max_range)
+        elif self.beam_mask is None:
+            scan = get_scan(pose, self.theta_dis, self.fov, self.num_beams, self.theta_index_increment, self.sines, self.cosines, self.eps, self.orig_x, self.orig_y, self.orig_c, self.orig_s, self.map_height, self.map_width, self.map_resolution, self.dt, self.max_range)
+        else:
+            scan = get_scan_subset(pose, self.beam_mask, self.theta_dis, self.fov, self.num_beams, self.theta_index_increment, self.sines, self.cosines, self.eps, self.orig_x, self.orig_y, self.orig_c, self.orig_s, self.map_height, self.map_width, self.map_resolution, self.dt, self.max_range)
 
         noise = self.scan_rng.normal(0., std_dev, size=self.num_beams)
         scan += noise
@@ -443,6 +531,13 @@ class ScanSimulator2D(object):
     def get_increment(self):
         return self.angle_increment
 
+    def check_footprint(self, pose):
+        return footprint_collision(pose[0], pose[1], pose[2], self.disk_offsets, self.disk_radius, self.footprint_outline, self.orig_x, self.orig_y, self.orig_c, self.orig_s, self.map_height, self.map_width, self.map_resolution, self.dt)
+
+    def check_footprint_batch(self, poses):
+        """poses is (N, 3), returns a boolean collision flag per pose"""
+        return footprint_collision_batch(np.ascontiguousarray(poses, dtype=np.float64), self.disk_offsets, self.disk_radius, self.footprint_outline, self.orig_x, self.orig_y, self.orig_c, self.orig_s, self.map_height, self.map_width, self.map_resolution, self.dt)
+
     def check_location(self, pose):
         if check_bounds(pose[0], pose[1], self.orig_x, self.orig_y, self.orig_c, self.orig_s, self.map_height, self.map_width, self.map_resolution):
             return True
@@ -468,3 +563,51 @@ def check_bounds(x, y, orig_x, orig_y, orig_c, orig_s, height, width, resolution
         return True
     return False
 
+
+@njit(cache=True)
+def inside_map(x, y, margin, orig_x, orig_y, orig_c, orig_s, height, width, resolution):
+    x_trans = x - orig_x
+    y_trans = y - orig_y
+    x_rot = x_trans * orig_c + y_trans * orig_s
+    y_rot = -x_trans * orig_s + y_trans * orig_c
+    return margin <= x_rot < width * resolution - margin and margin <= y_rot < height * resolution - margin
+
+
+@njit(cache=True)
+def footprint_collision(x, y, theta, disk_offsets, disk_radius, outline, orig_x, orig_y, orig_c, orig_s, height, width, resolution, dt):
+    """
+    Checks the vehicle footprint at (x, y, theta) against the map.
+    If every cover disk is clear of obstacles the pose is collision free; otherwise the outline points are checked like check_location.
+    """
+    c = np.cos(theta)
+    s = np.sin(theta)
+
+    clear = True
+    for k in range(disk_offsets.shape[0]):
+        px = x + c * disk_offsets[k]
+        py = y + s * disk_offsets[k]
+        if not inside_map(px, py, disk_radius, orig_x, orig_y, orig_c, orig_s, height, width, resolution):
+            clear = False
+            break
+        if distance_transform(px, py, orig_x, orig_y, orig_c, orig_s, height, width, resolution, dt) < disk_radius:
+            clear = False
+            break
+    if clear:
+        return False
+
+    for i in range(outline.shape[0]):
+        px = x + c * outline[i, 0] - s * outline[i, 1]
+        py = y + s * outline[i, 0] + c * outline[i, 1]
+        if check_bounds(px, py, orig_x, orig_y, orig_c, orig_s, height, width, resolution):
+            return True
+        if distance_transform(px, py, orig_x, orig_y, orig_c, orig_s, height, width, resolution, dt) < 0.001: #1mm
+            return True
+    return False
+
+
+@njit(cache=True, parallel=True)
+def footprint_collision_batch(poses, disk_offsets, disk_radius, outline, orig_x, orig_y, orig_c, orig_s, height, width, resolution, dt):
+    collisions = np.empty(poses.shape[0], dtype=np.bool_)
+    for i in prange(poses.shape[0]):
+        collisions[i] = footprint_collision(poses[i, 0], poses[i, 1], poses[i, 2], disk_offsets, disk_radius, outline, orig_x, orig_y, orig_c, orig_s, height, width, resolution, dt)
+    return collisions
@@ -0,0 +1,123 @@
+import numpy as np
+from numba import njit
+
+from f1tenth_benchmarks.utils.segment_grid import build_segment_grid
+
+GRID_CELL_SIZE = 1.0 # m
+
+
+class SegmentMap:
+    """
+    Exact ray casting backend: the boundaries of the occupancy image are converted to line segments which are stored in a uniform grid.
+    Rays walk the grid cells (DDA) and are intersected with the segments in each cell, so there is no eps threshold and no dependence on the EDT.
+    """
+    def __init__(self, map_img, resolution, origin, cell_size=GRID_CELL_SIZE):
+        self.segments = extract_wall_segments(map_img, resolution, origin)
+        self.cell_size = cell_size
+        self.x0 = min(self.segments[:, 0].min(), self.segments[:, 2].min()) - cell_size
+        self.y0 = min(self.segments[:, 1].min(), self.segments[:, 3].min()) - cell_size
+        self.nx = int(np.ceil((max(self.segments[:, 0].max(), self.segments[:, 2].max()) - self.x0) / cell_size)) + 1
+        self.ny = int(np.ceil((max(self.segments[:, 1].max(), self.segments[:, 3].max()) - self.y0) / cell_size)) + 1
+        self.cell_start, self.cell_segments = build_segment_grid(self.segments, self.x0, self.y0, cell_size, self.nx, self.ny)
+
+    def scan(self, pose, beam_mask, fov, angle_increment, max_range):
+        return get_scan_segments(pose, beam_mask, fov, angle_increment, self.segments, self.cell_start, self.cell_segments, self.x0, self.y0, self.cell_size, self.nx, self.ny, max_range)
+
+
+def boolean_runs(edges):
+    """Row, start and end (exclusive) column of each run of True along the rows of edges"""
+    padded = np.zeros((edges.shape[0], edges.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = edges
+    d = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(d == 1)
+    _, ends = np.nonzero(d == -1)
+    return rows, starts, ends
+
+
+def extract_wall_segments(map_img, resolution, origin):
+    """
+    Returns the (N, 4) [x1, y1, x2, y2] segments in the map frame that separate occupied (0) from free cells.
+    Edges between neighbouring cells are merged into the longest straight runs.
+    """
+    occupied = map_img == 0
+
+    # horizontal edges lie between rows r and r+1, runs go along the columns
+    rows, starts, ends = boolean_runs(occupied[:-1, :] != occupied[1:, :])
+    horizontal = np.stack([starts, rows + 1, ends, rows + 1], axis=1)
+    # vertical edges lie between columns c and c+1, runs go along the rows
+    cols, starts, ends = boolean_runs((occupied[:, :-1] != occupied[:, 1:]).T)
+    vertical = np.stack([cols + 1, starts, cols + 1, ends], axis=1)
+
+    cells = np.concatenate([horizontal, vertical]).astype(np.float64) * resolution
+    c, s = np.cos(origin[2]), np.sin(origin[2])
+    segments = np.empty_like(cells)
+    for k in (0, 2):
+        segments[:, k] = origin[0] + c * cells[:, k] - s * cells[:, k+1]
+        segments[:, k+1] = origin[1] + s * cells[:, k] + c * cells[:, k+1]
+    return segments
+
+
+@njit(cache=True)
+def ray_segment_distance(x, y, dx, dy, x1, y1, x2, y2):
+    ex = x2 - x1
+    ey = y2 - y1
+    denom = dx * ey - dy * ex
+    if abs(denom) < 1e-12:
+        return np.inf
+    wx = x1 - x
+    wy = y1 - y
+    t = (wx * ey - wy * ex) / denom
+    u = (wx * dy - wy * dx) / denom
+    if t < 0 or u < 0 or u > 1:
+        return np.inf
+    return t
+
+
+@njit(cache=True)
+def cast_ray(x, y, theta, segments, cell_start, cell_segments, x0, y0, cell_size, nx, ny, max_range):
+    dx = np.cos(theta)
+    dy = np.sin(theta)
+    gx = (x - x0) / cell_size
+    gy = (y - y0) / cell_size
+    i = int(np.floor(gx))
+    j = int(np.floor(gy))
+    if i < 0 or i >= nx or j < 0 or j >= ny:
+        return max_range
+
+    step_i = 1 if dx > 0 else -1
+    step_j = 1 if dy > 0 else -1
+    t_max_x = ((i + (1 if dx > 0 else 0)) - gx) * cell_size / dx if dx != 0 else np.inf
+    t_max_y = ((j + (1 if dy > 0 else 0)) - gy) * cell_size / dy if dy != 0 else np.inf
+    t_delta_x = cell_size / abs(dx) if dx != 0 else np.inf
+    t_delta_y = cell_size / abs(dy) if dy != 0 else np.inf
+
+    best = max_range
+    while 0 <= i < nx and 0 <= j < ny:
+        cell = j * nx + i
+        for k in range(cell_start[cell], cell_start[cell + 1]):
+            n = cell_segments[k]
+            t = ray_segment_distance(x, y, dx, dy, segments[n, 0], segments[n, 1], segments[n, 2], segments[n, 3])
+            if t < best:
+                best = t
+        t_exit = min(t_max_x, t_max_y)
+        if best <= t_exit or t_exit >= max_range:
+            break
+        if t_max_x < t_max_y:
+            t_max_x += t_delta_x
+            i += step_i
+        else:
+            t_max_y += t_delta_y
+            j += step_j
+
+    return best
+
+
+@njit(cache=True)
+def get_scan_segments(pose, beam_mask, fov, angle_increment, segments, cell_start, cell_segments, x0, y0, cell_size, nx, ny, max_range):
+    """Scan with exact beam angles, beams where beam_mask is False are NaN"""
+    scan = np.full((beam_mask.shape[0],), np.nan)
+    for i in range(beam_mask.shape[0]):
+        if beam_mask[i]:
+            theta = pose[2] - fov / 2. + i * angle_increment
+            scan[i] = cast_ray(pose[0], pose[1], theta, segments, cell_start, cell_segments, x0, y0, cell_size, nx, ny, max_range)
+    return scan
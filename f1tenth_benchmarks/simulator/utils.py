@@ -25,6 +25,66 @@ class CenterLine:
         return pose
 
 
+class LazyValue:
+    """Evaluates fn on the first call and returns the cached value afterwards"""
+    def __init__(self, fn):
+        self.fn = fn
+        self.value = None
+
+    def __call__(self):
+        if self.fn is not None:
+            self.value = self.fn()
+            self.fn = None
+        return self.value
+
+
+class LazyObservation(dict):
+    """
+    Observation dictionary where expensive entries (e.g. the LiDAR scan) are only computed when a planner reads them.
+    lazy_values maps keys to LazyValue objects. keys(), iteration and len() include the lazy keys without computing them,
+    items(), values(), copy() and dict(obs) compute them first so that copies always hold every entry.
+    """
+    def __init__(self, values, lazy_values):
+        super().__init__(values)
+        self.lazy_values = lazy_values
+
+    def __missing__(self, key):
+        if key not in self.lazy_values:
+            raise KeyError(key)
+        value = self.lazy_values.pop(key)()
+        self[key] = value
+        return value
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.lazy_values
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def evaluate(self):
+        for key in list(self.lazy_values.keys()):
+            self[key]
+        return self
+
+    def keys(self):
+        return list(dict.keys(self)) + list(self.lazy_values.keys())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return dict.__len__(self) + len(self.lazy_values)
+
+    def items(self):
+        return dict.items(self.evaluate())
+
+    def values(self):
+        return dict.values(self.evaluate())
+
+    def copy(self):
+        return dict(self.evaluate())
+
+
 class SimulatorHistory:
     def __init__(self, path, test_id, save_scan=False):
         self.path = path + f"RawData_{test_id}/"
@@ -61,5 +121,6 @@ class SimulatorHistory:
         self.progresses = []
         self.states = []
         self.actions = []
+        self.scans = []
         self.lap_n += 1
         
\ No newline at end of file
@@ -23,6 +23,7 @@ class BasePlanner:
         self.map_name = None
 
         self.step_counter = 0
+        self.scan_beams = None # beams of obs["scan"] that plan() reads (index array or slice), None for the full scan
 
     def set_map(self, map_name):
         self.map_name = map_name
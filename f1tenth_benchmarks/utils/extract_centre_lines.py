@@ -4,10 +4,14 @@ import matplotlib.pyplot as plt
 import csv
 from scipy import ndimage 
 from scipy import interpolate
+from scipy.spatial import cKDTree
 import cv2 as cv
 import trajectory_planning_helpers as tph
 import os
+import glob
+import multiprocessing as mp
 from PIL import Image 
+from f1tenth_benchmarks.utils.track_utils import CentreLine
 
 
 save_path = f"Data/CentreLineExtraction/"
@@ -16,8 +20,17 @@ if not os.path.exists(save_path):
     os.makedirs(save_path)
 
 
-def extract_centre_line(map_name):
-    file_name = 'maps/' + map_name + '.yaml'
+def extract_centre_lines(map_directory="maps/", map_names=None, n_workers=None, plot=False):
+    """Extracts the centre lines of map_names (default: every map in map_directory) in parallel processes, without plotting unless plot is set"""
+    if map_names is None:
+        map_names = sorted(os.path.basename(f)[:-5] for f in glob.glob(map_directory + "*.yaml"))
+    with mp.get_context("spawn").Pool(n_workers) as pool:
+        pool.starmap(extract_centre_line, [(map_name, map_directory, plot) for map_name in map_names])
+    return map_names
+
+
+def extract_centre_line(map_name, map_directory="maps/", plot=True):
+    file_name = map_directory + map_name + '.yaml'
     with open(file_name) as file:
         documents = yaml.full_load(file)
 
@@ -25,7 +38,7 @@ def extract_centre_line(map_name):
     resolution = yaml_file['resolution']
     origin = yaml_file['origin']
 
-    image = cv.imread('maps/' + yaml_file['image'])
+    image = cv.imread(map_directory + yaml_file['image'])
     gray = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
     c, h = cv.findContours(gray ,cv.RETR_TREE , cv.CHAIN_APPROX_NONE)
 
@@ -42,20 +55,20 @@ def extract_centre_line(map_name):
 
     centre_line = caluclate_centre_line(contour1.path, contour2.path)
 
-    flipped_map_img = np.array(Image.open('maps/' + yaml_file['image']).transpose(Image.FLIP_TOP_BOTTOM))
+    flipped_map_img = np.array(Image.open(map_directory + yaml_file['image']).transpose(Image.FLIP_TOP_BOTTOM))
     dt = ndimage.distance_transform_edt(flipped_map_img)
-    np.array(dt *resolution)
-    widths = np.zeros_like(centre_line)
-    for i in range(centre_line.shape[0]):
-        widths[i, :] = get_dt_value(centre_line[i], origin, resolution, dt)
+    widths = np.repeat(get_dt_values(centre_line, origin, resolution, dt)[:, None], 2, axis=1)
 
     track =  np.concatenate([centre_line, widths], axis=-1)     
-    map_c_name = f"maps/{map_name}_centerline.csv"
+    map_c_name = f"{map_directory}{map_name}_centerline.csv"
     with open(map_c_name, 'w') as csvfile:
         csvwriter = csv.writer(csvfile)
         csvwriter.writerows(track)
+    CentreLine(map_name, map_directory) # builds the binary track artifact
 
     print(f"Centerline saved in: {map_c_name}")
+    if not plot:
+        return
     
     plt.figure(1) 
     plt.clf()
@@ -85,16 +98,17 @@ def get_dt_value(pt_xy, origin, resolution, dt):
     return distance
 
 
-def caluclate_centre_line(b1, b2):
-    centre_line = []
-    for i in range(len(b1)):
-        dists = np.linalg.norm(b1[i, :] - b2, axis=1)
-        min_dist_segment = np.argmin(dists)
-        pt = (b1[i, :] + b2[min_dist_segment, :]) / 2
-        centre_line.append(pt)
+def get_dt_values(points, origin, resolution, dt):
+    """get_dt_value for an array of points"""
+    c = np.minimum(((points[:, 0] - origin[0]) / resolution).astype(int), dt.shape[1] - 1)
+    r = np.minimum(((points[:, 1] - origin[1]) / resolution).astype(int), dt.shape[0] - 1)
 
+    return dt[r, c] * resolution
 
-    centre_line = np.array(centre_line)[:-1] # trim the last point
+
+def caluclate_centre_line(b1, b2):
+    _, nearest = cKDTree(b2).query(b1) # each point is paired with the nearest point on the other boundary
+    centre_line = ((b1 + b2[nearest]) / 2)[:-1] # trim the last point
     CENTRE_SEP_DISTANCE = 0.2
     line_length = np.sum(np.linalg.norm(np.diff(centre_line, axis=0), axis=1))
     n_pts = int(line_length / CENTRE_SEP_DISTANCE)
@@ -140,5 +154,5 @@ def interpolate_track(points, n_points=None, s=0):
 
 
 if __name__ == '__main__':
-    extract_centre_line('example')
+    extract_centre_lines()
 
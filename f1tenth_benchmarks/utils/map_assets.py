@@ -0,0 +1,76 @@
+import os
+import struct
+import zipfile
+import hashlib
+import numpy as np
+
+from f1tenth_benchmarks.utils.BasePlanner import ensure_path_exists
+
+ASSET_DIRECTORY = "Data/MapAssets/"
+
+
+def asset_key(*parts):
+    """Short hash of the inputs an asset is computed from (arrays, strings, numbers)"""
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(part.tobytes() if isinstance(part, np.ndarray) else repr(part).encode())
+    return h.hexdigest()[:16]
+
+
+def file_key(path, *parts):
+    """asset_key for an asset computed from a file, changes when the file is modified"""
+    stat = os.stat(path)
+    return asset_key(os.path.abspath(path), stat.st_mtime_ns, stat.st_size, *parts)
+
+
+def shared_array(name, key, compute):
+    """
+    Returns a read-only array backed by a memory-mapped .npy file.
+    Every process that uses the same map attaches to the same file, so the OS page cache holds one copy however many workers there are.
+    The first process to need the asset computes it and writes it atomically.
+    """
+    path = f"{ASSET_DIRECTORY}{name}_{key}.npy"
+    if not os.path.exists(path):
+        ensure_path_exists(ASSET_DIRECTORY)
+        tmp_path = path + f".{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            np.save(file, np.ascontiguousarray(compute()))
+        os.replace(tmp_path, path)
+
+    return np.asarray(np.load(path, mmap_mode='r'))
+
+
+def save_npz(file_name, arrays):
+    """Writes the dict of arrays as an uncompressed .npz atomically, so that load_npz can memory-map it while other processes read the old file"""
+    tmp_name = file_name + f".{os.getpid()}.tmp"
+    with open(tmp_name, 'wb') as file:
+        np.savez(file, **arrays)
+    os.replace(tmp_name, file_name)
+
+
+def load_npz(path, mode='r'):
+    """
+    Memory-maps every array of an uncompressed .npz (np.load reads npz members into memory).
+    The members of np.savez archives are stored .npy files, so each one is mapped at its offset in the zip.
+    With mode='c' the arrays are copy-on-write: writable, with changes kept in memory and never written to the file.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as file:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{path} is compressed and cannot be memory-mapped")
+            file.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack('<HH', file.read(4))
+            file.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = np.asarray(np.memmap(path, dtype=dtype, mode=mode, offset=file.tell(), shape=shape, order='F' if fortran_order else 'C'))
+    return arrays
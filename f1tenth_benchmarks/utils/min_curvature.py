@@ -0,0 +1,102 @@
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg
+import osqp
+
+SOLVER_TOLERANCE = 1e-5 # OSQP absolute and relative tolerance, tighter values take longer without changing the line
+OSQP_SOLVED_STATUSES = (osqp.constant("OSQP_SOLVED"), osqp.constant("OSQP_SOLVED_INACCURATE"))
+
+
+def periodic_spline_system(el_lengths):
+    """
+    Sparse C and D of the closed cubic spline through N points with knot spacing el_lengths: C m = D p gives the second derivatives m.
+    C is cyclic tridiagonal, so nothing here is dense.
+    """
+    n = len(el_lengths)
+    h = el_lengths
+    h_prev = np.roll(h, 1)
+    i = np.arange(n)
+    C = sp.csc_matrix((np.concatenate([h_prev / 6, (h_prev + h) / 3, h / 6]),
+                       (np.concatenate([i, i, i]), np.concatenate([(i - 1) % n, i, (i + 1) % n]))), shape=(n, n))
+    D = sp.csc_matrix((np.concatenate([1 / h_prev, -1 / h_prev - 1 / h, 1 / h]),
+                       (np.concatenate([i, i, i]), np.concatenate([(i - 1) % n, i, (i + 1) % n]))), shape=(n, n))
+    return C, D
+
+
+def spline_derivatives(path, el_lengths, C_factor, D):
+    """First and second derivatives (with respect to arc length) of the closed spline at each point"""
+    m = C_factor(D @ path)
+    h = el_lengths[:, None]
+    first = (np.roll(path, -1, axis=0) - path) / h - h * (2 * m + np.roll(m, -1, axis=0)) / 6
+    return first, m
+
+
+def spline_curvature(first, second):
+    return (first[:, 0] * second[:, 1] - first[:, 1] * second[:, 0]) / np.power(first[:, 0]**2 + first[:, 1]**2, 1.5)
+
+
+def opt_min_curv_sparse(reftrack, normvectors, kappa_bound, w_veh, n_iterations=1, print_debug=False):
+    """
+    Minimum curvature optimisation of a closed track, a sparse version of tph.opt_min_curv.
+    Instead of eliminating the spline coefficients with the dense inverse of the spline matrix, the second derivatives of the x and y splines
+    are kept as variables tied to the lateral shifts alpha by the banded spline equations, and the QP is solved with OSQP.
+    The curvature is linearised around the current line; with n_iterations > 1 it is re-linearised around each solution.
+
+    reftrack: [x, y, w_tr_right, w_tr_left] for every point (unclosed)
+    normvectors: unit normal vectors, alpha is the shift along them
+    Returns alpha and the maximum difference between the linearised and the true curvature of the result, like tph.opt_min_curv.
+    """
+    if n_iterations < 1:
+        raise ValueError(f"n_iterations must be at least 1, got {n_iterations}")
+    n = reftrack.shape[0]
+    path = reftrack[:, :2]
+    el_lengths = np.linalg.norm(np.roll(path, -1, axis=0) - path, axis=1)
+    C, D = periodic_spline_system(el_lengths)
+    C_factor = scipy.sparse.linalg.factorized(C)
+
+    dev_max_right = reftrack[:, 2] - w_veh / 2
+    dev_max_left = reftrack[:, 3] - w_veh / 2
+    if np.any(-dev_max_right > dev_max_left):
+        raise RuntimeError("Problem not solvable, track might be too small to run with current safety distance!")
+
+    # variables z = [alpha, m_x, m_y]; the spline equations C m - D diag(n) alpha = D p_ref are equality rows
+    I = sp.identity(n, format='csc')
+    Z = sp.csc_matrix((n, n))
+    A_spline = sp.bmat([[-D @ sp.diags(normvectors[:, 0]), C, None],
+                        [-D @ sp.diags(normvectors[:, 1]), None, C]], format='csc')
+    b_spline = np.concatenate([D @ path[:, 0], D @ path[:, 1]])
+
+    alpha = np.zeros(n)
+    for iteration in range(n_iterations):
+        # the knot spacing stays that of the reference line so that the spline equations remain linear in alpha
+        first, _ = spline_derivatives(path + alpha[:, None] * normvectors, el_lengths, C_factor, D)
+        den = np.power(first[:, 0]**2 + first[:, 1]**2, 1.5)
+        q_x, q_y = first[:, 1] / den, first[:, 0] / den # kappa = q_y * m_y - q_x * m_x
+
+        P = 2 * sp.bmat([[Z, None, None],
+                         [None, sp.diags(q_x**2), sp.diags(-q_x * q_y)],
+                         [None, sp.diags(-q_x * q_y), sp.diags(q_y**2)]], format='csc')
+        A = sp.vstack([A_spline,
+                       sp.hstack([I, Z, Z]),
+                       sp.hstack([Z, -sp.diags(q_x), sp.diags(q_y)])], format='csc')
+        l = np.concatenate([b_spline, -dev_max_left, -kappa_bound * np.ones(n)])
+        u = np.concatenate([b_spline, dev_max_right, kappa_bound * np.ones(n)])
+
+        solver = osqp.OSQP()
+        solver.setup(sp.triu(P, format='csc'), np.zeros(3 * n), A, l, u, verbose=False, eps_abs=SOLVER_TOLERANCE, eps_rel=SOLVER_TOLERANCE, max_iter=50000, polish=True)
+        results = solver.solve()
+        if results.info.status_val not in OSQP_SOLVED_STATUSES:
+            raise RuntimeError(f"Minimum curvature QP not solved: {results.info.status}")
+        alpha = results.x[:n]
+        if print_debug:
+            print(f"Iteration {iteration}: {results.info.status} in {results.info.run_time:.3f} s")
+
+    # curvature error: the linearised curvature of the final solution against the curvature of the spline through it
+    linearised_kappa = q_y * results.x[2*n:] - q_x * results.x[n:2*n]
+    line = path + alpha[:, None] * normvectors
+    first, second = spline_derivatives(line, el_lengths, C_factor, D)
+    curv_error_max = np.max(np.abs(spline_curvature(first, second) - linearised_kappa))
+    if print_debug:
+        print(f"Solver runtime opt_min_curv_sparse: {results.info.run_time:.3f} s, maximum curvature error {curv_error_max:.4f}")
+
+    return alpha, curv_error_max
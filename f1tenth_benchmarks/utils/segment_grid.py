@@ -0,0 +1,34 @@
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def segment_cells(x1, y1, x2, y2, x0, y0, cell_size):
+    i0 = int((min(x1, x2) - x0) / cell_size)
+    i1 = int((max(x1, x2) - x0) / cell_size)
+    j0 = int((min(y1, y2) - y0) / cell_size)
+    j1 = int((max(y1, y2) - y0) / cell_size)
+    return i0, i1, j0, j1
+
+
+@njit(cache=True)
+def build_segment_grid(segments, x0, y0, cell_size, nx, ny):
+    """CSR layout: the segments in cell (i, j) are cell_segments[cell_start[j*nx + i]:cell_start[j*nx + i + 1]]"""
+    counts = np.zeros(nx * ny + 1, dtype=np.int64)
+    for n in range(segments.shape[0]):
+        i0, i1, j0, j1 = segment_cells(segments[n, 0], segments[n, 1], segments[n, 2], segments[n, 3], x0, y0, cell_size)
+        for j in range(j0, j1 + 1):
+            for i in range(i0, i1 + 1):
+                counts[j * nx + i + 1] += 1
+
+    cell_start = np.cumsum(counts)
+    fill = cell_start[:-1].copy()
+    cell_segments = np.empty(cell_start[-1], dtype=np.int64)
+    for n in range(segments.shape[0]):
+        i0, i1, j0, j1 = segment_cells(segments[n, 0], segments[n, 1], segments[n, 2], segments[n, 3], x0, y0, cell_size)
+        for j in range(j0, j1 + 1):
+            for i in range(i0, i1 + 1):
+                cell_segments[fill[j * nx + i]] = n
+                fill[j * nx + i] += 1
+
+    return cell_start, cell_segments
@@ -2,8 +2,10 @@ import numpy as np
 import trajectory_planning_helpers as tph
 from f1tenth_benchmarks.utils.BasePlanner import *
 from f1tenth_benchmarks.utils.track_utils import CentreLine
+from f1tenth_benchmarks.utils.min_curvature import opt_min_curv_sparse
 from f1tenth_benchmarks.data_tools.specific_plotting.plot_racelines import RaceTrackPlotter
 import matplotlib.pyplot as plt
+import multiprocessing as mp
 
 from copy import copy
 from f1tenth_benchmarks.data_tools.plotting_utils import *
@@ -41,11 +43,7 @@ class Track:
         return crossing 
 
     def smooth_centre_line(self):
-        path_cl = np.row_stack([self.path, self.path[0]])
-        el_lengths_cl = np.append(self.el_lengths, self.el_lengths[0])
-        coeffs_x, coeffs_y, A, normvec_normalized = tph.calc_splines.calc_splines(path_cl, el_lengths_cl)
-    
-        alpha, error = tph.opt_min_curv.opt_min_curv(self.track, self.nvecs, A, 1, 0, print_debug=True, closed=True)
+        alpha, error = opt_min_curv_sparse(self.track, self.nvecs, 1, 0, print_debug=True)
 
         self.path, A_raceline, coeffs_x_raceline, coeffs_y_raceline, spline_inds_raceline_interp, t_values_raceline_interp, s_raceline, spline_lengths_raceline, el_lengths_raceline_interp_cl = tph.create_raceline.create_raceline(self.path, self.nvecs, alpha, 0.2) 
 
@@ -60,7 +58,7 @@ class Track:
 WIDTH_STEP_SIZE = 0.1
 NUMBER_OF_WIDTH_STEPS = 8
 
-def run_smoothing_process(map_name):
+def run_smoothing_process(map_name, plot=True):
     """
     This assumes that the track width is 0.9 m on each side of the centre line
     """
@@ -75,7 +73,7 @@ def run_smoothing_process(map_name):
             raise ValueError("Track is crossing before optimisation.: use smaller step size")
 
         track.smooth_centre_line()
-        plot_map_line(map_name, centre_line, i, track)
+        if plot: plot_map_line(map_name, centre_line, i, track)
 
         test_widths = track.widths + np.ones_like(track.path) * (NUMBER_OF_WIDTH_STEPS-i) * WIDTH_STEP_SIZE
         crossing = track.check_normals_crossing(test_widths)
@@ -83,7 +81,7 @@ def run_smoothing_process(map_name):
             print(f"No longer crossing: {i}")
             track.widths = test_widths
             track.calculate_track_vecs()
-            plot_map_line(map_name, centre_line, "final", track)
+            if plot: plot_map_line(map_name, centre_line, "final", track)
             break
 
         print("")
@@ -92,6 +90,7 @@ def run_smoothing_process(map_name):
     with open(map_c_name, 'w') as csvfile:
         csvwriter = csv.writer(csvfile)
         csvwriter.writerows(track.track)
+    CentreLine(map_name, directory=track_save_path) # builds the binary track artifact
     
 
 def plot_map_line(map_name, centre_line, run_n, new_track):
@@ -122,8 +121,9 @@ def plot_line_and_boundaries(new_track, color, normals=False):
 import cv2 as cs 
 from PIL import Image
 from scipy import ndimage
+from f1tenth_benchmarks.utils.extract_centre_lines import extract_centre_line, get_dt_values
 
-def clip_widths_with_dt(map_name):
+def clip_widths_with_dt(map_name, plot=True):
     smooth_centre_line = CentreLine(map_name, directory=track_save_path)
 
     file_name = 'maps/' + map_name + '.yaml'
@@ -137,58 +137,47 @@ def clip_widths_with_dt(map_name):
 
     flipped_map_img = np.array(Image.open('maps/' + yaml_file['image']).transpose(Image.FLIP_TOP_BOTTOM))
     dt = ndimage.distance_transform_edt(flipped_map_img)
-    np.array(dt *resolution)
-
-    l1 = smooth_centre_line.path + smooth_centre_line.nvecs * smooth_centre_line.widths[:, 0][:, None] 
-    for i in range(l1.shape[0]):
-        new_width = smooth_centre_line.widths[i, 0]
-        new_pt = l1[i]
-        while get_dt_value(new_pt, origin, resolution, dt) < 0.01:
-            new_width -= 0.01
-            new_pt = smooth_centre_line.path[i] + smooth_centre_line.nvecs[i] * new_width
-        smooth_centre_line.widths[i, 0] = new_width
-
-    l2 = smooth_centre_line.path - smooth_centre_line.nvecs * smooth_centre_line.widths[:, 1][:, None] 
-    for i in range(l2.shape[0]):
-        new_width = smooth_centre_line.widths[i, 1]
-        new_pt = l2[i]
-        while get_dt_value(new_pt, origin, resolution, dt) < 0.05:
-            new_width -= 0.01
-            new_pt = smooth_centre_line.path[i] - smooth_centre_line.nvecs[i] * new_width
-        smooth_centre_line.widths[i, 1] = new_width
 
+    smooth_centre_line.widths[:, 0] = shrink_widths(smooth_centre_line.path, smooth_centre_line.nvecs, smooth_centre_line.widths[:, 0], 0.01, origin, resolution, dt)
+    smooth_centre_line.widths[:, 1] = shrink_widths(smooth_centre_line.path, -smooth_centre_line.nvecs, smooth_centre_line.widths[:, 1], 0.05, origin, resolution, dt)
 
-    centre_line = CentreLine(map_name)
-    plot_map_line(map_name, centre_line, "final2", smooth_centre_line)
+    if plot:
+        centre_line = CentreLine(map_name)
+        plot_map_line(map_name, centre_line, "final2", smooth_centre_line)
 
     map_c_name = track_save_path + f"{map_name}_centerline.csv"
     track = np.concatenate([smooth_centre_line.path, smooth_centre_line.widths], axis=1)
     with open(map_c_name, 'w') as csvfile:
         csvwriter = csv.writer(csvfile)
         csvwriter.writerows(track)
+    CentreLine(map_name, directory=track_save_path) # builds the binary track artifact
     
 
     print(f"Min widths: {np.min(smooth_centre_line.widths, axis=0)}")
 
-def get_dt_value(pt_xy, origin, resolution, dt):
-    c = int((pt_xy[0] - origin[0]) / resolution)
-    r = int((pt_xy[1] - origin[1]) / resolution)
-
-    if c >= dt.shape[1]:
-        c = dt.shape[1] - 1
-    if r >= dt.shape[0]:
-        r = dt.shape[0] - 1
-
-    distance = dt[r, c] * resolution
-
-    return distance
-
-
-def smooth_centre_lines():
-    run_smoothing_process("aut")
-    run_smoothing_process("esp")
-    run_smoothing_process("gbr")
-    run_smoothing_process("mco")
+def shrink_widths(path, directions, widths, min_distance, origin, resolution, dt):
+    """Reduces each width in 0.01 m steps until the boundary point along directions is at least min_distance from the walls, all points at once"""
+    widths = widths.copy()
+    active = np.arange(len(widths))
+    while len(active) > 0:
+        points = path[active] + directions[active] * widths[active, None]
+        active = active[get_dt_values(points, origin, resolution, dt) < min_distance]
+        widths[active] -= 0.01
+    return widths
+
+
+def onboard_map(map_name, plot=False):
+    """Centre line extraction, smoothing and width clipping of a new map"""
+    extract_centre_line(map_name, plot=plot)
+    run_smoothing_process(map_name, plot=plot)
+    clip_widths_with_dt(map_name, plot=plot)
+
+
+def smooth_centre_lines(map_names=["aut", "esp", "gbr", "mco"], n_workers=None, plot=False, extract=False):
+    """Smooths (and with extract, first extracts) the centre lines of several maps in parallel processes"""
+    worker = onboard_map if extract else run_smoothing_process
+    with mp.get_context("spawn").Pool(n_workers) as pool:
+        pool.starmap(worker, [(map_name, plot) for map_name in map_names])
 
 
 if __name__ == "__main__":
@@ -1,9 +1,20 @@
 import csv
 import numpy as np
-from numba import njit
+from numba import njit, prange
 import os
 import trajectory_planning_helpers as tph
 from scipy.interpolate import splev, splprep
+from f1tenth_benchmarks.utils.map_assets import shared_array, asset_key, file_key, save_npz, load_npz
+from f1tenth_benchmarks.utils.segment_grid import build_segment_grid
+from f1tenth_benchmarks.utils.BasePlanner import ensure_path_exists
+
+LUT_SPACING = 0.01 # m
+FRENET_CELL_SIZE = 1.0 # m, cell size of the grid of path segments used by to_frenet
+LUT_X, LUT_Y, LUT_PSI, LUT_KAPPA, LUT_NVEC_X, LUT_NVEC_Y, LUT_WIDTHS = 0, 1, 2, 3, 4, 5, 6
+TRACK_ARTIFACT_VERSION = 1 # increase when the contents of the track artifacts change, older files are then rebuilt
+ARTIFACT_TRACK_ARRAYS = ("widths", "psi", "kappa", "nvecs", "speeds", "s_track") # saved when the track has them
+TRACK_ARTIFACT_DIRECTORY = "Data/TrackArtifacts/"
+RACELINE_DIRECTORIES = ["Data/racelines/", "../Data/racelines/"] # relative to the repository root or a script folder
 
 
 class TrackLine:
@@ -12,6 +23,7 @@ class TrackLine:
         self.cm_path = None
 
     def init_path(self):
+        self.segment_grid = None
         self.diffs = self.path[1:, :] - self.path[:-1, :]
         self.l2s = self.diffs[:, 0] ** 2 + self.diffs[:, 1] ** 2
 
@@ -19,8 +31,47 @@ class TrackLine:
         self.s_path = np.insert(np.cumsum(self.el_lengths), 0, 0)
         self.tck = splprep([self.path[:, 0], self.path[:, 1]], k=3, s=0, per=True)[0]
 
+        # the spline parameter is the fraction of the chord length, so distances are divided by the track length
         self.cm_ss = np.linspace(0, self.s_path[-1], int(self.s_path[-1] * 100))
-        self.cm_path = np.array(splev(self.cm_ss, self.tck, ext=3)).T
+        self.cm_path = self.track_array("cm_path", asset_key(self.path, "fraction"), lambda: np.array(splev(self.cm_ss / self.s_path[-1], self.tck, ext=3)).T)
+        self.init_lut()
+
+    def init_lut(self, spacing=LUT_SPACING):
+        """
+        Dense table of x, y, psi, kappa, the left normal vector and (if the track has them) the widths at uniformly spaced s.
+        psi is measured from the x axis, as in calculate_pose. interpolate_lut then answers queries by s in constant time.
+        """
+        length = self.s_path[-1]
+        n_points = int(np.ceil(length / spacing))
+        self.lut_spacing = length / n_points
+        widths = getattr(self, "widths", None)
+
+        def compute():
+            u = np.arange(n_points) / n_points
+            x, y = splev(u, self.tck, ext=3)
+            dx, dy = splev(u, self.tck, der=1, ext=3)
+            ddx, ddy = splev(u, self.tck, der=2, ext=3)
+            psi = np.arctan2(dy, dx)
+            kappa = (dx * ddy - dy * ddx) / (dx**2 + dy**2) ** 1.5
+            columns = [x, y, psi, kappa, -np.sin(psi), np.cos(psi)]
+            if widths is not None:
+                columns += [np.interp(u * length, self.s_path, widths[:, i]) for i in range(widths.shape[1])]
+            return np.stack(columns, axis=1)
+
+        self.lut = self.track_array("lut", asset_key(self.path, widths, self.lut_spacing), compute)
+
+    def track_array(self, name, key, compute):
+        """Shared read-only asset for a map's track, lines built in memory (e.g. the extended track in mpcc_utils) compute it without writing files"""
+        map_name = getattr(self, "map_name", None)
+        if map_name is None:
+            return compute()
+        return shared_array(f"{map_name}_{name}", key, compute)
+
+    def lookup(self, s):
+        """Interpolated LUT rows (see init_lut) for one or many s in metres, s wraps around the track"""
+        ss = np.atleast_1d(np.asarray(s, dtype=np.float64))
+        rows = interpolate_lut(ss, self.lut, self.lut_spacing)
+        return rows[0] if np.ndim(s) == 0 else rows
 
     def init_track(self):
         if self.el_lengths is None:
@@ -30,34 +81,97 @@ class TrackLine:
         )
         self.nvecs = tph.calc_normal_vectors.calc_normal_vectors(self.psi)
 
-    def calculate_progress_m(self, position):
-        if len(position) > 2:
-            position = position[:2]
-        dists = np.linalg.norm(position - self.path, axis=1)
-        minimum_dist_idx = np.argmin(dists)
-        if minimum_dist_idx == 0:
-            if dists[-1] < dists[1]:
-                return self.s_path[-1]  # current shortcut
-            else:
-                start_ind = 0
-                end_ind = int(self.s_path[1] * 100)
-        elif minimum_dist_idx == len(dists) - 1:
-            if dists[-2] < dists[0]:
-                start_ind = int(self.s_path[-2] * 100)
-                end_ind = int(self.s_path[-1] * 100)
-            else:
-                return self.s_path[-1]
+    def init_segment_grid(self):
+        """Uniform grid over the path segments (CSR layout as in the segment ray caster) so that projections only test nearby segments"""
+        segments = np.ascontiguousarray(np.concatenate((self.path[:-1], self.path[1:]), axis=1))
+        x0 = min(segments[:, 0].min(), segments[:, 2].min()) - FRENET_CELL_SIZE
+        y0 = min(segments[:, 1].min(), segments[:, 3].min()) - FRENET_CELL_SIZE
+        nx = int(np.ceil((max(segments[:, 0].max(), segments[:, 2].max()) - x0) / FRENET_CELL_SIZE)) + 1
+        ny = int(np.ceil((max(segments[:, 1].max(), segments[:, 3].max()) - y0) / FRENET_CELL_SIZE)) + 1
+        cell_start, cell_segments = build_segment_grid(segments, x0, y0, FRENET_CELL_SIZE, nx, ny)
+        self.segment_grid = (segments, cell_start, cell_segments, x0, y0, FRENET_CELL_SIZE, nx, ny)
+
+    def to_frenet(self, points):
+        """
+        Projects (N, 2) positions or (N, 3) poses onto the path.
+        Returns s (m), the signed lateral offset n (positive to the left) and the heading error (NaN for positions).
+        """
+        if self.segment_grid is None:
+            self.init_segment_grid()
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        if len(points) == 1: # e.g. calculate_progress_m every step, starting the parallel kernel costs more than the projection
+            s, n, psi = (np.array([value]) for value in frenet_project_point(points[0, 0], points[0, 1], self.s_path, *self.segment_grid))
         else:
-            if dists[minimum_dist_idx + 1] > dists[minimum_dist_idx - 1]:
-                minimum_dist_idx -= 1
-            start_ind = int(self.s_path[minimum_dist_idx] * 100)
-            end_ind = int(self.s_path[minimum_dist_idx + 1] * 100)
+            s, n, psi = frenet_project(np.ascontiguousarray(points[:, :2]), self.s_path, *self.segment_grid)
+        heading_error = np.full(len(points), np.nan)
+        if points.shape[1] > 2:
+            heading_error = (points[:, 2] - psi + np.pi) % (2 * np.pi) - np.pi
+        return s, n, heading_error
 
-        cm_path = self.cm_path[start_ind:end_ind]
-        dists = np.linalg.norm(position - cm_path, axis=1)
-        s_point_m = self.cm_ss[np.argmin(dists) + start_ind]
+    def from_frenet(self, s, n):
+        """(N, 2) points at distance s along the path (wrapped to the track length) and lateral offset n, the inverse of to_frenet"""
+        if self.segment_grid is None:
+            self.init_segment_grid()
+        s = np.atleast_1d(np.asarray(s, dtype=np.float64))
+        n = np.broadcast_to(np.asarray(n, dtype=np.float64), s.shape)
+        return frenet_to_points(s, np.ascontiguousarray(n), self.s_path, self.segment_grid[0])
 
-        return s_point_m
+    def load_or_build(self, source_file, build):
+        """
+        Restores the track from its binary artifact in TRACK_ARTIFACT_DIRECTORY if it was built from the current source_file with the current version.
+        Otherwise build() loads the source and computes everything, and the artifact is written for the next time.
+        The restored arrays are copy-on-write memory maps, so changing them in place does not touch the artifact.
+        """
+        name = os.path.splitext(os.path.basename(source_file))[0]
+        artifact_file = TRACK_ARTIFACT_DIRECTORY + f"{name}_{asset_key(os.path.abspath(source_file))}.npz"
+        source = file_key(source_file, TRACK_ARTIFACT_VERSION)
+        if os.path.exists(artifact_file):
+            artifact = load_npz(artifact_file, mode='c')
+            if str(artifact["source"]) == source:
+                self.restore_artifact(artifact)
+                return
+
+        build()
+        try:
+            ensure_path_exists(TRACK_ARTIFACT_DIRECTORY)
+            self.save_artifact(artifact_file, source)
+        except OSError as e:
+            print(f"Track artifact not saved: {e}")
+
+    def save_artifact(self, artifact_file, source):
+        """Writes the path, splines, LUT and segment grid as an uncompressed .npz that restore_artifact memory-maps"""
+        if self.segment_grid is None:
+            self.init_segment_grid()
+        segments, cell_start, cell_segments, x0, y0, cell_size, nx, ny = self.segment_grid
+        arrays = {"source": np.array(source), "path": self.path, "el_lengths": self.el_lengths, "s_path": self.s_path,
+                  "tck_t": self.tck[0], "tck_c": np.array(self.tck[1]), "tck_k": np.array(self.tck[2]), "cm_ss": self.cm_ss, "cm_path": self.cm_path,
+                  "lut": self.lut, "lut_spacing": np.array(self.lut_spacing),
+                  "grid_segments": segments, "grid_cell_start": cell_start, "grid_cell_segments": cell_segments, "grid_shape": np.array([x0, y0, cell_size, nx, ny])}
+        for name in ARTIFACT_TRACK_ARRAYS:
+            if getattr(self, name, None) is not None:
+                arrays[name] = getattr(self, name)
+        save_npz(artifact_file, arrays)
+
+    def restore_artifact(self, artifact):
+        """Attributes from a memory-mapped artifact, nothing is copied until it is used"""
+        self.path = artifact["path"]
+        self.diffs = self.path[1:, :] - self.path[:-1, :]
+        self.l2s = self.diffs[:, 0] ** 2 + self.diffs[:, 1] ** 2
+        self.el_lengths = artifact["el_lengths"]
+        self.s_path = artifact["s_path"]
+        self.tck = [np.asarray(artifact["tck_t"]), list(np.asarray(artifact["tck_c"])), int(artifact["tck_k"])]
+        self.cm_ss = artifact["cm_ss"]
+        self.cm_path = artifact["cm_path"]
+        self.lut = artifact["lut"]
+        self.lut_spacing = float(artifact["lut_spacing"])
+        x0, y0, cell_size, nx, ny = artifact["grid_shape"]
+        self.segment_grid = (artifact["grid_segments"], artifact["grid_cell_start"], artifact["grid_cell_segments"], x0, y0, cell_size, int(nx), int(ny))
+        for name in ARTIFACT_TRACK_ARRAYS:
+            if name in artifact:
+                setattr(self, name, artifact[name])
+
+    def calculate_progress_m(self, position):
+        return self.to_frenet(np.asarray(position)[None, :2])[0][0]
 
     def calculate_progress_percent(self, position):
         progress_m = self.calculate_progress_m(position)
@@ -66,24 +180,22 @@ class TrackLine:
         return progress_percent
 
     def find_nearest_point(self, s):
-        point = np.array(splev(s, self.tck, ext=3)).T
-        if len(point.shape) > 1:
-            point = point[0]
-
-        return point
+        """Point at the fraction s of the track"""
+        return self.lookup(float(np.ravel(s)[0]) * self.s_path[-1])[LUT_X:LUT_Y+1]
 
     def calculate_pose(self, s):
-        point = np.array(splev(s, self.tck, ext=3)).T
-        dx, dy = splev(s, self.tck, der=1, ext=3)
-        theta = np.arctan2(dy, dx)
-        pose = np.array([point[0], point[1], theta])
-        return pose
+        """[x, y, heading] at the fraction s of the track"""
+        row = self.lookup(s * self.s_path[-1])
+        return row[..., LUT_X:LUT_PSI+1].copy()
 
 
 class CentreLine(TrackLine):
     def __init__(self, map_name, directory=f"/home/m810z573/Downloads/f1tenth_benchmarks/maps/") -> None:
         self.map_name = map_name
 
+        self.load_or_build(directory + map_name + "_centerline.csv", lambda: self.build(map_name, directory))
+
+    def build(self, map_name, directory):
         self.load_track(map_name, directory)
         self.init_path()
         self.init_track()
@@ -97,23 +209,143 @@ class CentreLine(TrackLine):
 
 
 class RaceTrack(TrackLine):
-    def __init__(self, map_name, raceline_id=None, load=True) -> None:
+    def __init__(self, map_name, raceline_id=None, load=True, mu=None) -> None:
         self.map_name = map_name
 
-        if load:
-            self.load_track(map_name, raceline_id)
+        if load and mu is not None:
+            self.load_bundle(map_name, raceline_id, mu)
             self.init_path()
+        elif load:
+            filename = find_raceline_file(f"{raceline_id}/{map_name}_raceline.csv")
+            self.load_or_build(filename, lambda: self.build(filename))
 
-    def load_track(self, map_name, raceline_set):
-        try:
-            filename = f"Data/racelines/{raceline_set}/" + map_name + "_raceline.csv"
-            track = np.loadtxt(filename, delimiter=",", skiprows=1)
-        except:
-            filename = f"../Data/racelines/{raceline_set}/" + map_name + "_raceline.csv"
-            track = np.loadtxt(filename, delimiter=",", skiprows=1)
+    def build(self, filename):
+        self.load_track(filename)
+        self.init_path()
+
+    def load_track(self, filename):
+        track = np.loadtxt(filename, delimiter=",", skiprows=1)
 
         self.path = track[:, 1:3]
         self.speeds = track[:, 5]
         self.psi = track[:, 3]
         self.kappa = track[:, 4]
         self.s_track = track[:, 0]
+
+    def load_bundle(self, map_name, bundle_id, mu):
+        """The raceline for friction mu from a bundle written by RaceTrackGenerator.generate_raceline_bundle"""
+        bundle = load_npz(find_raceline_file(f"{bundle_id}_bundle.npz"), mode='c')
+        mu_index = np.flatnonzero(np.isclose(bundle["mus"], mu))
+        if len(mu_index) == 0:
+            raise ValueError(f"mu {mu} is not in raceline bundle {bundle_id}, which has {bundle['mus']}")
+        self.path = bundle[f"{map_name}/path"]
+        self.speeds = bundle[f"{map_name}/speeds"][mu_index[0]]
+        self.psi = bundle[f"{map_name}/psi"]
+        self.kappa = bundle[f"{map_name}/kappa"]
+        self.s_track = bundle[f"{map_name}/s_track"]
+
+
+def find_raceline_file(name):
+    for directory in RACELINE_DIRECTORIES:
+        if os.path.exists(directory + name):
+            return directory + name
+    raise FileNotFoundError(f"{name} is not in any of {RACELINE_DIRECTORIES}")
+
+
+@njit(cache=True)
+def interpolate_lut_into(ss, lut, spacing, out):
+    """Linear interpolation of the LUT rows at each s (wrapped to the track length), the heading column is interpolated along the shorter angle"""
+    n_points = lut.shape[0]
+    for j in range(ss.shape[0]):
+        f = ss[j] / spacing
+        i0 = int(np.floor(f))
+        t = f - i0
+        i0 = i0 % n_points
+        i1 = (i0 + 1) % n_points
+        for c in range(lut.shape[1]):
+            d = lut[i1, c] - lut[i0, c]
+            if c == LUT_PSI:
+                d = (d + np.pi) % (2 * np.pi) - np.pi
+            out[j, c] = lut[i0, c] + t * d
+        out[j, LUT_PSI] = (out[j, LUT_PSI] + np.pi) % (2 * np.pi) - np.pi
+    return out
+
+
+@njit(cache=True)
+def interpolate_lut(ss, lut, spacing):
+    return interpolate_lut_into(ss, lut, spacing, np.empty((ss.shape[0], lut.shape[1])))
+
+
+@njit(cache=True)
+def closest_in_cell(px, py, cell, segments, cell_start, cell_segments, best, best_k, best_t):
+    for q in range(cell_start[cell], cell_start[cell + 1]):
+        k = cell_segments[q]
+        dx = segments[k, 2] - segments[k, 0]
+        dy = segments[k, 3] - segments[k, 1]
+        l2 = dx * dx + dy * dy
+        t = ((px - segments[k, 0]) * dx + (py - segments[k, 1]) * dy) / l2 if l2 > 0 else 0.0
+        t = min(max(t, 0.0), 1.0)
+        ex = segments[k, 0] + t * dx - px
+        ey = segments[k, 1] + t * dy - py
+        d2 = ex * ex + ey * ey
+        if d2 < best:
+            best, best_k, best_t = d2, k, t
+    return best, best_k, best_t
+
+
+@njit(cache=True)
+def frenet_project_point(px, py, s_path, segments, cell_start, cell_segments, x0, y0, cell_size, nx, ny):
+    """
+    Closest point on the path: the grid cells are searched in rings of growing radius until no unsearched cell can be closer.
+    Points outside the grid fall back to testing every segment. Returns s, signed lateral offset and segment heading.
+    """
+    i = int(np.floor((px - x0) / cell_size))
+    j = int(np.floor((py - y0) / cell_size))
+    best, best_k, best_t = np.inf, -1, 0.0
+    if 0 <= i < nx and 0 <= j < ny:
+        for r in range(max(nx, ny)):
+            for jj in range(max(j - r, 0), min(j + r + 1, ny)):
+                for ii in range(max(i - r, 0), min(i + r + 1, nx)):
+                    if max(abs(ii - i), abs(jj - j)) == r:
+                        best, best_k, best_t = closest_in_cell(px, py, jj * nx + ii, segments, cell_start, cell_segments, best, best_k, best_t)
+            if best_k >= 0 and best <= (r * cell_size) ** 2:
+                break
+    else:
+        for cell in range(nx * ny):
+            best, best_k, best_t = closest_in_cell(px, py, cell, segments, cell_start, cell_segments, best, best_k, best_t)
+
+    dx = segments[best_k, 2] - segments[best_k, 0]
+    dy = segments[best_k, 3] - segments[best_k, 1]
+    length = np.sqrt(dx * dx + dy * dy)
+    s = s_path[best_k] + best_t * (s_path[best_k + 1] - s_path[best_k])
+    n = (dx * (py - segments[best_k, 1]) - dy * (px - segments[best_k, 0])) / length if length > 0 else 0.0
+    return s, n, np.arctan2(dy, dx)
+
+
+@njit(cache=True, parallel=True)
+def frenet_project(points, s_path, segments, cell_start, cell_segments, x0, y0, cell_size, nx, ny):
+    """frenet_project_point for each point in parallel"""
+    n_points = points.shape[0]
+    s = np.empty(n_points)
+    n = np.empty(n_points)
+    psi = np.empty(n_points)
+    for p in prange(n_points):
+        s[p], n[p], psi[p] = frenet_project_point(points[p, 0], points[p, 1], s_path, segments, cell_start, cell_segments, x0, y0, cell_size, nx, ny)
+    return s, n, psi
+
+
+@njit(cache=True)
+def frenet_to_points(s, n, s_path, segments):
+    length = s_path[-1]
+    points = np.empty((s.shape[0], 2))
+    for p in range(s.shape[0]):
+        sp = s[p] % length
+        k = min(max(np.searchsorted(s_path, sp, side='right') - 1, 0), segments.shape[0] - 1)
+        dx = segments[k, 2] - segments[k, 0]
+        dy = segments[k, 3] - segments[k, 1]
+        seg_length = np.sqrt(dx * dx + dy * dy)
+        t = (sp - s_path[k]) / (s_path[k + 1] - s_path[k]) if s_path[k + 1] > s_path[k] else 0.0
+        nx, ny = (-dy / seg_length, dx / seg_length) if seg_length > 0 else (0.0, 0.0)
+        points[p, 0] = segments[k, 0] + t * dx + n[p] * nx
+        points[p, 1] = segments[k, 1] + t * dy + n[p] * ny
+    return points
@@ -0,0 +1,146 @@
+import numpy as np
+from numba import njit, prange
+
+N_LATERAL_ITERATIONS = 3 # fixed point iterations for the cornering speed when the ggv depends on speed
+
+
+class VelocityProfile:
+    """
+    Forward-backward velocity profile, the model of tph.calc_vel_profile without drag: the longitudinal acceleration left after cornering is
+    ax_max * (1 - (ay / ay_max) ** dyn_model_exp) ** (1 / dyn_model_exp), so dyn_model_exp=1 (tph's default) is a diamond and 2 a friction circle.
+    ggv rows are [v, ax_max, ay_max] (one row for constant limits) and ax_max_machine rows are [v, ax_max].
+    The buffers are preallocated and reused, and solve(changed_from=k) only recomputes what depends on points k onwards.
+    """
+    def __init__(self, ggv, ax_max_machine, mu, v_max, closed=False, capacity=1000, dyn_model_exp=1.0):
+        self.ggv = np.ascontiguousarray(np.atleast_2d(ggv), dtype=np.float64)
+        self.ax_max_machine = np.ascontiguousarray(np.atleast_2d(ax_max_machine), dtype=np.float64)
+        self.mu = mu
+        self.v_max = v_max
+        self.closed = closed
+        self.dyn_model_exp = dyn_model_exp
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        self.mus = np.full(capacity, self.mu, dtype=np.float64)
+        self.v_lateral = np.zeros(capacity)
+        self.v_forward = np.zeros(capacity)
+        self.vs = np.zeros(capacity)
+        self.n_points = 0
+
+    def solve(self, kappa, el_lengths, v_start=np.inf, v_end=np.inf, changed_from=0):
+        """
+        Speeds at the n points of a line with curvatures kappa and segment lengths el_lengths (n - 1 open, n closed).
+        changed_from is the first point whose curvature or following segments changed since the last call (v_start must be unchanged), points before it keep their cached limits.
+        Returns a view of the internal buffer.
+        """
+        n = len(kappa)
+        if n > len(self.vs):
+            self.allocate(2 * n)
+        if self.n_points == 0 or self.closed:
+            changed_from = 0
+        changed_from = min(changed_from, self.n_points, n - 1)
+        solve_velocity_profile(np.ascontiguousarray(kappa, dtype=np.float64), np.ascontiguousarray(el_lengths, dtype=np.float64), self.mus[:n], self.ggv, self.ax_max_machine, self.v_max, self.dyn_model_exp,
+                               v_start, v_end, self.closed, changed_from, self.v_lateral[:n], self.v_forward[:n], self.vs[:n])
+        self.n_points = n
+        return self.vs[:n]
+
+    def solve_batch(self, kappa, el_lengths, mus, v_start=np.inf, v_end=np.inf):
+        """Profiles of one line for every friction value in mus (scaling the ggv like mu), returns an array of shape (len(mus), n)"""
+        vs = np.zeros((len(mus), len(kappa)))
+        solve_velocity_profiles(np.ascontiguousarray(kappa, dtype=np.float64), np.ascontiguousarray(el_lengths, dtype=np.float64), np.asarray(mus, dtype=np.float64), self.ggv, self.ax_max_machine, self.v_max, self.dyn_model_exp,
+                                v_start, v_end, self.closed, vs)
+        return vs
+
+
+@njit(cache=True)
+def ggv_limits(v, mu, ggv):
+    if ggv.shape[0] == 1:
+        return mu * ggv[0, 1], mu * ggv[0, 2]
+    return mu * np.interp(v, ggv[:, 0], ggv[:, 1]), mu * np.interp(v, ggv[:, 0], ggv[:, 2])
+
+
+@njit(cache=True)
+def lateral_speed_limit(kappa, mu, ggv, v_max):
+    if abs(kappa) < 1e-6:
+        return v_max
+    v = v_max
+    for _ in range(N_LATERAL_ITERATIONS):
+        _, ay_max = ggv_limits(v, mu, ggv)
+        v = min(np.sqrt(ay_max / abs(kappa)), v_max)
+    return v
+
+
+@njit(cache=True)
+def available_acceleration(v, kappa, mu, ggv, dyn_model_exp):
+    """Longitudinal acceleration the tyres have left after cornering at v (tph.calc_ax_poss)"""
+    ax_max, ay_max = ggv_limits(v, mu, ggv)
+    radicand = 1 - (v * v * abs(kappa) / ay_max) ** dyn_model_exp
+    if radicand <= 0:
+        return 0.0
+    return ax_max * radicand ** (1 / dyn_model_exp)
+
+
+@njit(cache=True)
+def accelerate(v, kappa, mu, el_length, ggv, ax_max_machine, dyn_model_exp):
+    ax = available_acceleration(v, kappa, mu, ggv, dyn_model_exp)
+    if ax_max_machine.shape[0] == 1:
+        ax = min(ax, ax_max_machine[0, 1])
+    else:
+        ax = min(ax, np.interp(v, ax_max_machine[:, 0], ax_max_machine[:, 1]))
+    return np.sqrt(v * v + 2 * ax * el_length)
+
+
+@njit(cache=True)
+def decelerate(v, kappa, mu, kappa_prev, mu_prev, el_length, ggv, dyn_model_exp):
+    """
+    Highest speed one segment earlier (curvature kappa_prev) from which v can still be reached by braking.
+    As in tph, the deceleration is also evaluated at the earlier point with the speed found and the lower result is kept.
+    """
+    v_prev = np.sqrt(v * v + 2 * available_acceleration(v, kappa, mu, ggv, dyn_model_exp) * el_length)
+    return min(v_prev, np.sqrt(v * v + 2 * available_acceleration(v_prev, kappa_prev, mu_prev, ggv, dyn_model_exp) * el_length))
+
+
+@njit(cache=True)
+def solve_velocity_profile(kappa, el_lengths, mu, ggv, ax_max_machine, v_max, dyn_model_exp, v_start, v_end, closed, changed_from, v_lateral, v_forward, vs):
+    n = kappa.shape[0]
+    for i in range(changed_from, n):
+        v_lateral[i] = lateral_speed_limit(kappa[i], mu[i], ggv, v_max)
+
+    if closed:
+        # the slowest corner is never limited by its neighbours, so both passes start there and go once around the track
+        i0 = np.argmin(v_lateral)
+        v_forward[i0] = v_lateral[i0]
+        for m in range(1, n):
+            i = (i0 + m) % n
+            prev = (i - 1) % n
+            v_forward[i] = min(v_lateral[i], accelerate(v_forward[prev], kappa[prev], mu[prev], el_lengths[prev], ggv, ax_max_machine, dyn_model_exp))
+        vs[i0] = v_forward[i0]
+        for m in range(1, n):
+            i = (i0 - m) % n
+            nxt = (i + 1) % n
+            vs[i] = min(v_forward[i], decelerate(vs[nxt], kappa[nxt], mu[nxt], kappa[i], mu[i], el_lengths[i], ggv, dyn_model_exp))
+        return vs
+
+    first = changed_from
+    if changed_from == 0:
+        v_forward[0] = min(v_lateral[0], v_start)
+        first = 1
+    for i in range(first, n):
+        v_forward[i] = min(v_lateral[i], accelerate(v_forward[i - 1], kappa[i - 1], mu[i - 1], el_lengths[i - 1], ggv, ax_max_machine, dyn_model_exp))
+
+    vs[n - 1] = min(v_forward[n - 1], v_end)
+    for i in range(n - 2, -1, -1):
+        v = min(v_forward[i], decelerate(vs[i + 1], kappa[i + 1], mu[i + 1], kappa[i], mu[i], el_lengths[i], ggv, dyn_model_exp))
+        if i < changed_from and v == vs[i]:
+            break # the cached speeds before this point are unchanged
+        vs[i] = v
+    return vs
+
+
+@njit(cache=True, parallel=True)
+def solve_velocity_profiles(kappa, el_lengths, mus, ggv, ax_max_machine, v_max, dyn_model_exp, v_start, v_end, closed, vs):
+    """solve_velocity_profile for each friction value in mus, the rows of vs are filled in parallel"""
+    n = kappa.shape[0]
+    for k in prange(mus.shape[0]):
+        solve_velocity_profile(kappa, el_lengths, np.full(n, mus[k]), ggv, ax_max_machine, v_max, dyn_model_exp, v_start, v_end, closed, 0, np.zeros(n), np.zeros(n), vs[k])
+    return vs
@@ -2,20 +2,19 @@ import time
 import numpy as np
 from numba import njit
 from f1tenth_benchmarks.utils.BasePlanner import BasePlanner
-import tensorflow as tf
+from f1tenth_benchmarks.zarrar.tflite_utils import InterpreterPool, input_rows, preprocess_scan_into, output_to_actions, run_batch, POOL_SIZE, MAX_RANGE
 import os
 os.environ['CUDA_VISIBLE_DEVICES'] = '-1'  # Disable GPU
 
 class EndToEnd(BasePlanner):
-    def __init__(self, test_id, skip_n, model_path):
+    def __init__(self, test_id, skip_n, model_path, num_threads=1, pool=None):
+        """pool: optional InterpreterPool shared between planners running laps concurrently"""
         super().__init__("EndToEnd", test_id)
         self.name = 'EndToEnd'
         self.skip_n = skip_n
+        self.scan_beams = slice(None, None, skip_n)
         self.model_path = model_path
-        self.interpreter = tf.lite.Interpreter(model_path=model_path)
-        self.interpreter.allocate_tensors()
-        self.input_index = self.interpreter.get_input_details()[0]["index"]
-        self.output_details = self.interpreter.get_output_details()
+        self.pool = pool if pool is not None else InterpreterPool(model_path, num_threads=num_threads)
 
     def linear_map(self, x, x_min, x_max, y_min, y_max):
         return (x - x_min) / (x_max - x_min) * (y_max - y_min) + y_min
@@ -24,27 +23,16 @@ class EndToEnd(BasePlanner):
         pass
         
     def plan(self, obs):
-        scans = obs['scan']
-        scans = np.array(scans)
-        scans[scans>10] = 10
-        scans = scans[::self.skip_n]
-        scans = np.expand_dims(scans, axis=-1).astype(np.float32)
-        scans = np.expand_dims(scans, axis=0)
-        self.interpreter.set_tensor(self.input_index, scans)
-            
+        with self.pool.acquire() as interpreter:
+            preprocess_scan_into(obs['scan'], input_rows(interpreter, self.pool.input_index)[0], 0, self.skip_n, POOL_SIZE, MAX_RANGE)
+            interpreter.invoke()
+            output = interpreter.get_tensor(self.pool.output_index)
 
-        start_time = time.time()
-        self.interpreter.invoke()
-        inf_time = time.time() - start_time
-        inf_time = inf_time*1000
-        output = self.interpreter.get_tensor(self.output_details[0]['index'])
-
-        steer = output[0,0]
-        speed = output[0,1]
-        min_speed = 1
-        max_speed = 8
-        speed = self.linear_map(speed, 0, 1, min_speed, max_speed)
         # speed = self.linear_map(speed, 0, 1, 2.5, 8) #for all
-        action = np.array([steer, speed])
+        action = output_to_actions(output)[0]
+
+        return action
 
-        return action
\ No newline at end of file
+    def plan_batch(self, scans):
+        """Plans for (B, n_beams) scans with one invoke(), requires a pool built with batch_size >= B"""
+        return run_batch(self.pool, scans, 0, self.skip_n)
@@ -0,0 +1,95 @@
+import queue
+from contextlib import contextmanager
+import numpy as np
+from numba import njit
+import tensorflow as tf
+
+MAX_RANGE = 10
+POOL_SIZE = 4
+
+
+class InterpreterPool:
+    """
+    A fixed set of TFLite interpreters for one model that concurrently running laps take turns with.
+    With batch_size the input is resized to (batch_size, ...) so that many scans are evaluated in one invoke().
+    """
+    def __init__(self, model_path, size=1, num_threads=1, batch_size=None):
+        self.batch_size = batch_size
+        self.interpreters = queue.Queue()
+        for _ in range(size):
+            interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+            input_details = interpreter.get_input_details()[0]
+            if batch_size is not None:
+                interpreter.resize_tensor_input(input_details["index"], [batch_size, *input_details["shape"][1:]])
+            interpreter.allocate_tensors()
+            self.interpreters.put(interpreter)
+
+        self.input_index = input_details["index"]
+        self.output_index = interpreter.get_output_details()[0]["index"]
+
+    @contextmanager
+    def acquire(self):
+        interpreter = self.interpreters.get()
+        try:
+            yield interpreter
+        finally:
+            self.interpreters.put(interpreter)
+
+
+def input_rows(interpreter, input_index):
+    """Zero-copy (batch, n) view of the input tensor. It must be released before invoke() is called."""
+    view = interpreter.tensor(input_index)()
+    return view.reshape(view.shape[0], -1)
+
+
+@njit(cache=True)
+def preprocess_scan_into(scan, out, pre, skip_n, pool_size, max_range):
+    """
+    Writes the network input for one scan into out.
+    pre 1, 2 and 3 take the mean, max and min of consecutive chunks of pool_size beams, anything else keeps every skip_n-th beam.
+    Values above max_range are clipped.
+    """
+    n = scan.shape[0]
+    k = 0
+    if pre == 1 or pre == 2 or pre == 3:
+        for start in range(0, n, pool_size):
+            end = min(start + pool_size, n)
+            v = scan[start]
+            for i in range(start + 1, end):
+                if pre == 1: v += scan[i]
+                elif pre == 2: v = max(v, scan[i])
+                else: v = min(v, scan[i])
+            if pre == 1: v /= end - start
+            out[k] = v if v <= max_range else max_range
+            k += 1
+    else:
+        for i in range(0, n, skip_n):
+            out[k] = scan[i] if scan[i] <= max_range else max_range
+            k += 1
+    return k
+
+
+def linear_map(x, x_min, x_max, y_min, y_max):
+    return (x - x_min) / (x_max - x_min) * (y_max - y_min) + y_min
+
+
+def output_to_actions(output, min_speed=1, max_speed=8):
+    """Maps the (B, 2) network output of steering and normalised speed to (B, 2) actions"""
+    actions = np.array(output[:, :2], dtype=np.float64)
+    actions[:, 1] = linear_map(actions[:, 1], 0, 1, min_speed, max_speed)
+    return actions
+
+
+def run_batch(pool, scans, pre, skip_n):
+    """Preprocesses each row of scans straight into the batched input tensor and runs a single invoke()"""
+    n_scans = scans.shape[0]
+    assert n_scans <= pool.batch_size, f"The pool was built for batches of {pool.batch_size}"
+    with pool.acquire() as interpreter:
+        rows = input_rows(interpreter, pool.input_index)
+        for b in range(n_scans):
+            preprocess_scan_into(scans[b], rows[b], pre, skip_n, POOL_SIZE, MAX_RANGE)
+        del rows
+        interpreter.invoke()
+        output = interpreter.get_tensor(pool.output_index)[:n_scans]
+
+    return output_to_actions(output)
@@ -2,19 +2,22 @@ import time
 import numpy as np
 from numba import njit
 from f1tenth_benchmarks.utils.BasePlanner import BasePlanner
-import tensorflow as tf
+from f1tenth_benchmarks.zarrar.tflite_utils import InterpreterPool, input_rows, preprocess_scan_into, output_to_actions, run_batch, POOL_SIZE, MAX_RANGE
 
 class TinyLidarNet(BasePlanner):
-    def __init__(self, test_id, skip_n, pre, model_path):
+    def __init__(self, test_id, skip_n, pre, model_path, num_threads=1, pool=None):
+        """pool: optional InterpreterPool shared between planners running laps concurrently"""
         super().__init__("TinyLidarNet", test_id)
         self.pre = pre
         self.skip_n = skip_n
+        if pre == 0:
+            self.scan_beams = slice(None, None, skip_n)
+        elif pre == 4:
+            self.scan_beams = slice(0, 1080, 54)
         self.model_path = model_path
         self.name = 'TinyLidarNet'
-        self.interpreter = tf.lite.Interpreter(model_path=model_path)
-        self.interpreter.allocate_tensors()
-        self.input_index = self.interpreter.get_input_details()[0]["index"]
-        self.output_details = self.interpreter.get_output_details()
+        self.pool = pool if pool is not None else InterpreterPool(model_path, num_threads=num_threads)
+        self.input_index = self.pool.input_index
         self.scan_buffer = np.zeros((2, 20))
 
         self.temp_scan = []
@@ -45,45 +48,29 @@ class TinyLidarNet(BasePlanner):
 
         noise = np.random.normal(0, 0.5, scans.shape)
         scans = scans + noise
-        
-        chunks = [scans[i:i+4] for i in range(0, len(scans), 4)]
-        if self.pre == 1:
-            scans = [np.mean(chunk) for chunk in chunks]
-        elif self.pre == 2:
-            scans = [np.max(chunk) for chunk in chunks]
-        elif self.pre == 3:
-            scans = [np.min(chunk) for chunk in chunks]
-        elif self.pre == 4:
-            scans = self.transform_obs(scans)
-        else:
-            scans = scans[::self.skip_n]
 
-        if self.pre < 4:
-            scans = np.array(scans)
-            scans[scans>10] = 10
+        with self.pool.acquire() as interpreter:
+            return self.plan_with(interpreter, scans)
 
-            scans = np.expand_dims(scans, axis=-1).astype(np.float32)
-            scans = np.expand_dims(scans, axis=0)
-            self.interpreter.set_tensor(self.input_index, scans)
-            
-            start_time = time.time()
-            self.interpreter.invoke()
-            inf_time = time.time() - start_time
-            inf_time = inf_time*1000
-            output = self.interpreter.get_tensor(self.output_details[0]['index'])
+    def plan_batch(self, scans):
+        """Plans for (B, n_beams) scans with one invoke(), requires a pool built with batch_size >= B (pre 0-3 only)"""
+        if self.pre >= 4:
+            raise ValueError(f"plan_batch supports the single scan models (pre 0-3), not pre {self.pre}")
+        scans = scans + np.random.normal(0, 0.5, scans.shape)
+        return run_batch(self.pool, scans, self.pre, self.skip_n)
 
-            steer = output[0,0]
-            speed = output[0,1]
-            min_speed = 1
-            max_speed = 8
-            speed = self.linear_map(speed, 0, 1, min_speed, max_speed) 
-            action = np.array([steer, speed])
+    def plan_with(self, interpreter, scans):
+        if self.pre < 4:
+            preprocess_scan_into(scans, input_rows(interpreter, self.input_index)[0], self.pre, self.skip_n, POOL_SIZE, MAX_RANGE)
+            interpreter.invoke()
+            output = interpreter.get_tensor(self.pool.output_index)
+            action = output_to_actions(output)[0]
 
         elif self.pre == 5:
             # Temporal
             scans = np.array(scans)
             scans[scans>10] = 10
-            input_shape = self.interpreter.get_input_details()[0]['shape']
+            input_shape = interpreter.get_input_details()[0]['shape']
             # print("Input shape:", input_shape)
             # print("Shape of scans:", scans.shape)
             # print("Shape of self.temp_scan:", [s.shape for s in self.temp_scan])
@@ -100,13 +87,13 @@ class TinyLidarNet(BasePlanner):
             # print("Shape of scans:", scans.shape)
             # scans = np.expand_dims(scans, axis=-1).astype(np.float32)
             # scans = np.expand_dims(scans, axis=0)
-            self.interpreter.set_tensor(self.input_index, scans)
+            interpreter.set_tensor(self.input_index, scans)
             
             start_time = time.time()
-            self.interpreter.invoke()
+            interpreter.invoke()
             inf_time = time.time() - start_time
             inf_time = inf_time*1000
-            output = self.interpreter.get_tensor(self.output_details[0]['index'])
+            output = interpreter.get_tensor(self.pool.output_index)
 
             steer = output[0,0]
             speed = output[0,1]
@@ -120,7 +107,7 @@ class TinyLidarNet(BasePlanner):
             # birdeye
             scans = np.array(scans)
             scans[scans>10] = 10
-            input_shape = self.interpreter.get_input_details()[0]['shape']
+            input_shape = interpreter.get_input_details()[0]['shape']
             # print("Input shape:", input_shape)
             # print("Shape of scans:", scans.shape)
             # print("Shape of self.temp_scan:", [s.shape for s in self.temp_scan])
@@ -134,13 +121,13 @@ class TinyLidarNet(BasePlanner):
             scans = np.expand_dims(scans, axis=-1).astype(np.float32)
             scans = np.expand_dims(scans, axis=0).astype(np.float32)
             # print("Shape of scans:", scans.shape)
-            self.interpreter.set_tensor(self.input_index, scans)
+            interpreter.set_tensor(self.input_index, scans)
             
             start_time = time.time()
-            self.interpreter.invoke()
+            interpreter.invoke()
             inf_time = time.time() - start_time
             inf_time = inf_time*1000
-            output = self.interpreter.get_tensor(self.output_details[0]['index'])
+            output = interpreter.get_tensor(self.pool.output_index)
 
             steer = output[0,0]
             speed = output[0,1]
@@ -152,20 +139,22 @@ class TinyLidarNet(BasePlanner):
 
 
         else:
+            if self.pre == 4:
+                scans = self.transform_obs(scans)
             scans = np.expand_dims(scans, axis=-1).astype(np.float32)
             scans = np.expand_dims(scans, axis=0)
 
             scans[scans>10] = 10
             # scans = np.asarray(scans).reshape(-1,1,1081,1).astype(np.float32)
             # print(scans.shape)
-            self.interpreter.set_tensor(self.input_index, scans)
+            interpreter.set_tensor(self.input_index, scans)
             
 
             start_time = time.time()
-            self.interpreter.invoke()
+            interpreter.invoke()
             inf_time = time.time() - start_time
             inf_time = inf_time*1000
-            output = self.interpreter.get_tensor(self.output_details[0]['index'])
+            output = interpreter.get_tensor(self.pool.output_index)
 
             steer = output[0,0]
             speed = output[0,1]